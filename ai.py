@@ -0,0 +1,154 @@
+import os, json, time, random, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from prof import stage, count
+
+MODEL = "claude-sonnet-4-20250514"
+RETRY_STATUS = (429, 500, 502, 503, 529)
+
+# ==========================================
+# 応答キャッシュ付きクライアント
+# ==========================================
+class Advisor:
+    # クライアントは1つを使い回し、同じプロンプトへの応答は TTL の間ファイルに残す（古いものから max_entries 件まで）
+    def __init__(self, api_key, cache_path, base_url=None, model=MODEL, max_tokens=2000, ttl=7*24*3600, max_entries=200):
+        self.api_key, self.base_url, self.model, self.max_tokens = api_key, base_url, model, max_tokens
+        self.cache_path, self.ttl, self.max_entries = cache_path, ttl, max_entries
+        self.lock = threading.Lock(); self._client = None; self._cache = None
+
+    @property
+    def client(self):
+        with self.lock:
+            if self._client is None:
+                import anthropic
+                self._client = anthropic.Anthropic(api_key=self.api_key, base_url=self.base_url)
+            return self._client
+
+    def key(self, prompt): return hashlib.sha256(f"{self.model}\n{prompt}".encode('utf-8')).hexdigest()
+
+    def _load(self):
+        if self._cache is None:
+            try:
+                with open(self.cache_path, encoding='utf-8') as f: self._cache = json.load(f)
+            except Exception: self._cache = {}
+        return self._cache
+
+    def cached(self, prompt):
+        with self.lock:
+            e = self._load().get(self.key(prompt))
+            if not e or time.time() - e['t'] > self.ttl: return None
+            e['used'] = time.time()
+            return e['text']
+
+    def put(self, prompt, text):
+        with self.lock:
+            c = self._load(); now = time.time()
+            c[self.key(prompt)] = dict(t=now, used=now, text=text)
+            for k in [k for k, e in c.items() if now - e['t'] > self.ttl]: del c[k]
+            for k in sorted(c, key=lambda k: c[k]['used'])[:max(len(c) - self.max_entries, 0)]: del c[k]
+            os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+            tmp = self.cache_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f: json.dump(c, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_path)
+
+    def complete(self, prompt, client=None):
+        hit = self.cached(prompt)
+        if hit is not None: return hit
+        with stage('ai'):
+            m = (client or self.client).messages.create(model=self.model, max_tokens=self.max_tokens, messages=[{"role":"user","content":prompt}])
+        text = m.content[0].text
+        count('anthropic', 1, len(prompt.encode('utf-8')) + len(text.encode('utf-8')))
+        self.put(prompt, text)
+        return text
+
+    def stream(self, prompt):
+        # ここまでの全文を順に返す。キャッシュにあれば1回で返す
+        hit = self.cached(prompt)
+        if hit is not None:
+            yield hit; return
+        text = ""
+        with stage('ai'), self.client.messages.stream(model=self.model, max_tokens=self.max_tokens, messages=[{"role":"user","content":prompt}]) as s:
+            for t in s.text_stream:
+                text += t
+                yield text
+        count('anthropic', 1, len(prompt.encode('utf-8')) + len(text.encode('utf-8')))
+        self.put(prompt, text)
+
+    def _retrying(self, prompt, retries, backoff):
+        # レート制限・過負荷・接続エラーは retry-after（無ければ指数バックオフ＋ゆらぎ）を待ってやり直す。SDK 側の再試行は切る
+        import anthropic
+        client = self.client.with_options(max_retries=0)
+        for i in range(retries + 1):
+            try: return self.complete(prompt, client)
+            except (anthropic.APIStatusError, anthropic.APIConnectionError) as e:
+                if i == retries or (isinstance(e, anthropic.APIStatusError) and e.status_code not in RETRY_STATUS): raise
+                ra = e.response.headers.get('retry-after') if isinstance(e, anthropic.APIStatusError) else None
+                try: wait = float(ra)
+                except (TypeError, ValueError): wait = backoff * 2**i * (0.5 + random.random()/2)
+                time.sleep(min(wait, 60))
+
+    def batch(self, prompts, workers=4, retries=5, backoff=1.0):
+        # prompts: {キー: プロンプト}。同時に投げるのは workers 件まで。終わった順に (キー, 応答, 例外) を返す
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            fs = {ex.submit(self._retrying, p, retries, backoff): k for k, p in prompts.items()}
+            for f in as_completed(fs):
+                try: yield fs[f], f.result(), None
+                except Exception as e: yield fs[f], None, e
+
+# ==========================================
+# ローカル確認用の Messages API スタブ
+# ==========================================
+def serve_stub(port=8765, delay=0.02, latency=0.0, limit=0):
+    # ANTHROPIC_BASE_URL（または secrets の anthropic_base_url）を http://127.0.0.1:<port> に向けて使う。
+    # limit > 0 なら同時に limit 件を超えたリクエストに 429（retry-after: 0.2）を返す
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    state = dict(active=0, peak=0, requests=0, limited=0); lock = threading.Lock()
+
+    class H(BaseHTTPRequestHandler):
+        def log_message(self, *a): pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            with lock:
+                state['requests'] += 1
+                busy = limit and state['active'] >= limit
+                if busy: state['limited'] += 1
+                else: state['active'] += 1; state['peak'] = max(state['peak'], state['active'])
+            if busy:
+                out = json.dumps(dict(type="error", error=dict(type="rate_limit_error", message="stub rate limit"))).encode()
+                self.send_response(429); self.send_header('Content-Type', 'application/json'); self.send_header('retry-after', '0.2')
+                self.send_header('Content-Length', str(len(out))); self.end_headers(); self.wfile.write(out); return
+            try: self._reply(body)
+            finally:
+                with lock: state['active'] -= 1
+
+        def _reply(self, body):
+            time.sleep(latency)
+            prompt = body.get('messages', [{}])[-1].get('content', '')
+            text = f"（スタブ応答）{prompt.splitlines()[0][:40] if prompt else ''}\n1. 総評\n2. 良い点\n3. 改善ポイント\n4. 来月のアクション"
+            msg = dict(id="msg_stub", type="message", role="assistant", model=body.get('model', MODEL), content=[], stop_reason=None,
+                       stop_sequence=None, usage=dict(input_tokens=len(prompt), output_tokens=0))
+            if not body.get('stream'):
+                msg.update(content=[dict(type="text", text=text)], stop_reason="end_turn")
+                out = json.dumps(msg, ensure_ascii=False).encode('utf-8')
+                self.send_response(200); self.send_header('Content-Type', 'application/json'); self.send_header('Content-Length', str(len(out))); self.end_headers()
+                self.wfile.write(out); return
+            self.send_response(200); self.send_header('Content-Type', 'text/event-stream'); self.end_headers()
+            def ev(name, data):
+                self.wfile.write(f"event: {name}\ndata: {json.dumps(dict(type=name, **data), ensure_ascii=False)}\n\n".encode('utf-8')); self.wfile.flush()
+            ev('message_start', dict(message=msg))
+            ev('content_block_start', dict(index=0, content_block=dict(type="text", text="")))
+            for i in range(0, len(text), 8):
+                ev('content_block_delta', dict(index=0, delta=dict(type="text_delta", text=text[i:i+8]))); time.sleep(delay)
+            ev('content_block_stop', dict(index=0))
+            ev('message_delta', dict(delta=dict(stop_reason="end_turn", stop_sequence=None), usage=dict(output_tokens=len(text))))
+            ev('message_stop', {})
+
+    srv = ThreadingHTTPServer(('127.0.0.1', port), H)
+    srv.state = state
+    return srv
+
+if __name__ == '__main__':
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    print(f"Messages API stub on http://127.0.0.1:{port}")
+    serve_stub(port).serve_forever()
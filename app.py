@@ -1,18 +1,35 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-import numpy as np
+import os, time
+from functools import wraps
+from data import SCHEMA_VERSION, parse_yen, typed_tx, tx_rows, import_export, Cube, BudgetTracker, build_prompt, TX_SORTS, query_tx, tx_page, tx_summary
+from projection import MODELS, Projection
+from search import MODES, TextIndex
+from categorize import Categorizer, UNSET
+from recurring import RecurringDetector
+from trends import Trends, TOTAL, WINDOWS
+from balances import Balances, read_balances, FREQS
+import charts
+from charts import C_MOSS, C_TERRACOTTA
+from storage import GSheetStore, SQLiteStore, WriteBehind
+from revcache import RevCache
+from ai import Advisor
+import prof
+from prof import stage, instrument_gspread
 
 # ==========================================
 # 基本設定
 # ==========================================
 st.set_page_config(page_title="Kakeibo", layout="wide", page_icon="📒", initial_sidebar_state="collapsed")
 
+# 計測（KAKEIBO_PROFILE=1、secrets の profile、URL の ?diag=1 のどれかで有効）
+PROFILE = os.environ.get("KAKEIBO_PROFILE") == "1" or st.query_params.get("diag") == "1" or ("profile" in st.secrets and bool(st.secrets["profile"]))
+if PROFILE: prof.begin()
+
 # パスワード保護
 if "app_password" in st.secrets:
     if "authenticated" not in st.session_state:
@@ -279,31 +296,19 @@ div[data-baseweb="select"] > div { border-color: var(--border) !important; borde
 # 定数
 # ==========================================
 SPREADSHEET_NAME = "money_db"
+STORAGE = os.environ.get("KAKEIBO_STORAGE") or (st.secrets["storage"] if "storage" in st.secrets else "gsheets")
+SQLITE_PATH = os.environ.get("KAKEIBO_DB", "kakeibo.db")
 CATEGORY_OPTIONS = [
     "住宅", "日用品", "食費", "特別な支出", "衣服・美容", "健康・医療",
     "税・社会保障", "自動車", "水道・光熱費", "保険", "趣味・娯楽",
     "現金・カード", "交際費", "教養・教育", "通信費", "未分類", "交通費"
 ]
 FIXED_COST_CATEGORIES = {"住宅", "水道・光熱費", "保険", "通信費", "税・社会保障", "自動車"}
-
-# Japandi palette for Plotly
-C_MOSS = '#7a9466'
-C_TERRACOTTA = '#d4895e'
-C_INK = '#1a1a1a'
-C_INK_LIGHT = 'rgba(26,26,26,0.55)'
-C_STONE = '#8c8578'
-C_BORDER = '#ddd8d0'
-C_BG = '#f7f6f3'
-C_BG_WARM = '#f0eee9'
-
-CHART_LAYOUT = dict(
-    margin=dict(l=0, r=0, t=10, b=0),
-    plot_bgcolor='rgba(0,0,0,0)',
-    paper_bgcolor='rgba(0,0,0,0)',
-    font=dict(family="DM Sans, Noto Sans JP, sans-serif", size=12, color="#5c5c5c"),
-)
-
-CHART_LEGEND = dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1, font=dict(size=11))
+AUTO_PICK = "（自動で判定）"
+AUTO_CAT = 0.8  # 取り込み時に自動分類を当てる確度の下限
+CACHE_DIR = ".cache"
+PROFILE_LOG = os.path.join(CACHE_DIR, "profile.jsonl")
+AI_WORKERS = 4
 
 # ==========================================
 # DB
@@ -316,46 +321,26 @@ def get_gspread_client():
             creds = ServiceAccountCredentials.from_json_keyfile_dict(st.secrets["gcp_service_account"], scope)
         else:
             creds = ServiceAccountCredentials.from_json_keyfile_name('service_account.json', scope)
-        return gspread.authorize(creds)
+        return instrument_gspread(gspread.authorize(creds))
     except Exception:
         return None
 
-def get_worksheet(sheet_name):
-    client = get_gspread_client()
-    if not client: return None
-    try:
-        ss = client.open(SPREADSHEET_NAME)
-        try: return ss.worksheet(sheet_name)
-        except: return ss.add_worksheet(title=sheet_name, rows=1000, cols=15)
-    except: return None
-
-def load_sheet(name, cols=None):
-    ws = get_worksheet(name)
-    if ws:
-        try:
-            d = ws.get_all_records()
-            if d: return pd.DataFrame(d)
-        except: pass
-    return pd.DataFrame(columns=cols) if cols else pd.DataFrame()
-
-def save_sheet(df, name):
-    ws = get_worksheet(name)
-    if ws:
-        ws.clear()
-        s = df.copy()
-        for c in s.columns: s[c] = s[c].astype(str)
-        ws.update([s.columns.values.tolist()] + s.values.tolist())
+@st.cache_resource
+def get_store():
+    # 書き込みはワーカースレッドに任せる（フォームの保存でシートの書き換えを待たない）
+    if STORAGE == "sqlite": s = SQLiteStore(SQLITE_PATH)
+    else:
+        s = GSheetStore(get_gspread_client, SPREADSHEET_NAME, CACHE_DIR)
+        s.prefetch()
+    return WriteBehind(s, os.path.join(CACHE_DIR, "pending"))
+
+def load_sheet(name, cols=None): return get_store().load(name, cols)
+
+def save_sheet(df, name): get_store().save(df, name)
 
 # ==========================================
 # Utilities
 # ==========================================
-def cc(x):
-    if isinstance(x, str):
-        s = x.replace(',','').replace('¥','').replace('\\','').replace('▲','-').strip()
-        try: return float(s)
-        except: return 0
-    return float(x) if x else 0
-
 def fmt(v):
     return f"¥{v:,.0f}" if v >= 0 else f"-¥{abs(v):,.0f}"
 
@@ -379,79 +364,137 @@ def kpi(label, value, badge="", cls=""):
     b = badge if badge else '<span style="display:block;height:4px;"></span>'
     return f'<div class="j-kpi {cls}"><div class="j-kpi-label">{label}</div><div class="j-kpi-value{" negative" if "negative" in cls else ""}">{value}</div>{b}</div>'
 
+# 明細表の整形は表示側で（行ごとの文字列化をしない）
+TX_COLUMNS = {"日付": st.column_config.DateColumn(format="YYYY/MM/DD"), "金額": st.column_config.NumberColumn(format="yen")}
+TX_COLUMNS_MD = {**TX_COLUMNS, "日付": st.column_config.DateColumn(format="MM/DD")}
+
 def cost_type(c): return "固定費" if c in FIXED_COST_CATEGORIES else "変動費"
 
+def plot(fig, name="chart"):
+    # 計測中はグラフごとの送信バイト数も数える（chart:名前）
+    if prof.active(): prof.count(f"chart:{name}", 1, charts.nbytes(fig))
+    with stage("chart"): st.plotly_chart(fig, use_container_width=True)
+
+# 図は入力（集計済みの DataFrame・配列）のハッシュで使い回す。同じ Figure を返すだけなので書き換えないこと
+@st.cache_resource(max_entries=32, show_spinner=False)
+def chart(kind, *a): return getattr(charts, kind)(*a)
+
 # ==========================================
 # Data loading
 # ==========================================
-@st.cache_data(ttl=60)
+# 読み込みと集計は、依存するシートのリビジョンで引く（振り返りを保存しても取引のキャッシュはそのまま）。
+# スプレッドシートは他所でも編集されるので、リビジョンが同じでも SHEET_TTL 秒たったら読み直す
+SHEET_TTL = None if STORAGE == "sqlite" else 60
+
+@st.cache_resource
+def get_cache(): return RevCache()
+
+def revcached(*sheets, copy=False, ttl=SHEET_TTL):
+    # copy=False の結果はセッション間で共有するので書き換えないこと
+    def deco(f):
+        @wraps(f)
+        def run(*a):
+            v = get_cache().get((f.__name__, a), get_store().rev(*sheets), lambda: f(*a), ttl)
+            return v.copy() if copy else v
+        return run
+    return deco
+
+@revcached("transactions")
 def load_tx():
-    df = load_sheet("transactions")
+    df = get_store().sync("transactions", lambda d: typed_tx(d, cost_type), SCHEMA_VERSION)
     if df.empty: return pd.DataFrame()
-    df['金額_数値'] = df['金額_数値'].astype(str).apply(cc)
-    df['AbsAmount'] = df['AbsAmount'].astype(str).apply(cc)
-    df['日付'] = pd.to_datetime(df['日付'], errors='coerce')
-    df = df.dropna(subset=['日付'])
-    df['年'] = df['日付'].dt.year.astype(int)
-    df['月'] = df['日付'].dt.month.astype(int)
-    df['費用タイプ'] = df['大項目'].apply(cost_type)
     return df.sort_values('日付', ascending=False)
 
+@revcached("transactions")
+def load_cube():
+    return Cube(get_store().monthly_totals(load_tx()), cost_type)
+
+@st.cache_resource
+def get_tracker(): return BudgetTracker()
+
+def load_tracker():
+    # 手入力・取り込みで add() 済みなら作り直さない（件数と指紋が読み込んだ取引と合っているか確かめるだけ）
+    return get_tracker().sync(load_tx())
+
+@st.cache_resource
+def get_index(): return TextIndex()
+
+def load_index(): return get_index().sync(load_tx())
+
+@st.cache_resource
+def get_categorizer(): return Categorizer()
+
+def load_categorizer(): return get_categorizer().sync(load_tx())
+
+@st.cache_resource
+def get_recurring(): return RecurringDetector()
+
+def load_recurring(): return get_recurring().sync(load_tx())
+
+@revcached("transactions")
+def load_trends(): return Trends(load_cube().t)
+
+@revcached("budgets", copy=True)
 def load_budgets():
     df = load_sheet("budgets", ["Category","Budget"])
-    if not df.empty: df['Budget'] = df['Budget'].astype(str).apply(cc)
+    if not df.empty: df['Budget'] = parse_yen(df['Budget'])
     return df
 
+@revcached("assets", copy=True)
 def load_assets():
     cols = ["Month","Bank","Securities","iDeCo","Other","Total"]
     df = load_sheet("assets", cols)
     if not df.empty:
-        for c in cols[1:]: df[c] = df[c].astype(str).apply(cc)
+        for c in cols[1:]: df[c] = parse_yen(df[c])
         df = df.sort_values('Month')
     return df
 
+@revcached("balances")
+def load_balances():
+    # 口座ごとの残高スナップショット（balances シート）
+    return Balances(get_store().sync("balances", lambda d: d))
+
+@revcached("assets", "balances", copy=True)
+def load_asset_months():
+    # 資産推移・予測に使う月次の資産。残高スナップショットのある月はその月末残高で置き換える（assets シートには書き戻さない）
+    da, bl = load_assets(), load_balances()
+    if bl.empty: return da
+    bm = bl.monthly()
+    if not da.empty: da = da[~da['Month'].astype(str).isin(bm['Month'])]
+    return pd.concat([da, bm], ignore_index=True).sort_values('Month', ignore_index=True)
+
+@revcached("goals", copy=True)
 def load_goals():
     df = load_sheet("goals", ["GoalName","TargetAmount","TargetDate"])
-    if not df.empty: df['TargetAmount'] = df['TargetAmount'].astype(str).apply(cc)
+    if not df.empty: df['TargetAmount'] = parse_yen(df['TargetAmount'])
     return df
 
+@revcached("journal", copy=True)
 def load_journal():
     return load_sheet("journal", ["Month","Comment","Score"])
 
+@revcached("advice", copy=True)
+def load_advice():
+    return load_sheet("advice", ["Month","Advice","At"])
+
+def save_advice(res):
+    # {"YYYY-MM": 応答} を advice シートに書く（同じ月は置き換え）
+    dv = load_advice()
+    nv = pd.DataFrame({"Month": list(res), "Advice": list(res.values()), "At": datetime.now().strftime('%Y-%m-%d %H:%M')})
+    if not dv.empty: dv['Month'] = dv['Month'].astype(str); dv = dv[~dv['Month'].isin(res)]
+    save_sheet(pd.concat([dv, nv], ignore_index=True).sort_values('Month', ascending=False), "advice")
+
+@revcached("assets", "balances", "goals", ttl=SHEET_TTL and 3600)
+def load_projection(model, rate, day):
+    # モンテカルロ（1万パス）はウィジェット操作のたびに作り直さない
+    return Projection(load_asset_months(), load_goals(), day, model, annual_return=rate)
+
 # AI
-def call_claude(prompt):
-    try:
-        import anthropic
-        if "anthropic_api_key" not in st.secrets: return None
-        c = anthropic.Anthropic(api_key=st.secrets["anthropic_api_key"])
-        m = c.messages.create(model="claude-sonnet-4-20250514", max_tokens=2000, messages=[{"role":"user","content":prompt}])
-        return m.content[0].text
-    except Exception as e:
-        return f"エラー: {e}"
-
-def build_prompt(sy, sm, df, dj):
-    me = df[(df['年']==sy)&(df['月']==sm)&(df['金額_数値']<0)]
-    mi = df[(df['年']==sy)&(df['月']==sm)&(df['金額_数値']>0)]
-    ye = df[(df['年']==sy)&(df['金額_数値']<0)]
-    vi = mi['金額_数値'].sum(); ve = me['AbsAmount'].sum()
-    am = ye['月'].nunique() or 1
-    p = f"あなたはプロのFPです。以下の{sy}年{sm}月の家計データを分析し、具体的で前向きなアドバイスを。\n\n収入:¥{vi:,.0f} 支出:¥{ve:,.0f} 収支:¥{(vi-ve):,.0f}\n\nカテゴリ別支出:\n"
-    if not me.empty:
-        for cat, val in me.groupby('大項目')['AbsAmount'].sum().sort_values(ascending=False).items():
-            avg = ye[ye['大項目']==cat]['AbsAmount'].sum()/am; d=val-avg
-            p += f"- {cat}: ¥{val:,.0f}（年平均¥{avg:,.0f}、差{'+' if d>0 else ''}{d:,.0f}）\n"
-    if not me.empty:
-        fx = me[me['費用タイプ']=='固定費']['AbsAmount'].sum()
-        vr = me[me['費用タイプ']=='変動費']['AbsAmount'].sum()
-        p += f"\n固定費:¥{fx:,.0f} 変動費:¥{vr:,.0f}\n"
-    if not dj.empty:
-        t = f"{sy}-{sm:02d}"
-        jr = dj[dj['Month'].astype(str)==t]
-        if not jr.empty:
-            r = jr.iloc[-1]
-            p += f"\n本人の振り返り（満足度{r['Score']}/10）: {r['Comment']}\n"
-    p += "\n回答は番号付きの平文で300〜400字:\n1. 今月の総評\n2. 良い点\n3. 改善ポイント（金額目安込み）\n4. 来月のアクション"
-    return p
+@st.cache_resource
+def get_advisor():
+    if "anthropic_api_key" not in st.secrets: return None
+    return Advisor(st.secrets["anthropic_api_key"], os.path.join(CACHE_DIR, "ai_cache.json"),
+                   base_url=st.secrets["anthropic_base_url"] if "anthropic_base_url" in st.secrets else None)
 
 # ==========================================
 # Header
@@ -459,34 +502,22 @@ def build_prompt(sy, sm, df, dj):
 today = datetime.today()
 st.markdown(f'<div class="japandi-header"><div><h1>Kakeibo</h1><p>{today.strftime("%Y年%m月%d日")} 更新</p></div></div>', unsafe_allow_html=True)
 
-df_all = load_tx()
-if df_all.empty:
-    st.info("データがありません。「データ管理」タブからCSVをアップロードしてください。")
-
-# ==========================================
-# Tabs
-# ==========================================
-tab_dash, tab_month, tab_data, tab_budget, tab_asset, tab_journal = st.tabs([
-    "ダッシュボード", "月別詳細", "データ管理", "予算管理", "資産・ゴール", "振り返り"
-])
 
 # ==========================================================================
 # ダッシュボード
 # ==========================================================================
-with tab_dash:
-    if not df_all.empty:
+def view_dash():
+    cube = load_cube()
+    if not cube.empty:
         c1, c2, _ = st.columns([1,1,4])
-        with c1: sy = st.selectbox("年", sorted(df_all['年'].unique(), reverse=True), key="dy")
+        with c1: sy = st.selectbox("年", cube.years(), key="dy")
         with c2:
-            ma = sorted(df_all[df_all['年']==sy]['月'].unique(), reverse=True)
+            ma = cube.months(sy)
             sm = st.selectbox("月", ma if ma else [today.month], key="dm")
 
-        dm = df_all[(df_all['年']==sy)&(df_all['月']==sm)]
-        dme = dm[dm['金額_数値']<0]; dmi = dm[dm['金額_数値']>0]
-        vi = dmi['金額_数値'].sum(); ve = dme['AbsAmount'].sum(); vb = vi-ve
-        dp = df_all[(df_all['年']==sy-1)&(df_all['月']==sm)]
-        pe = dp[dp['金額_数値']<0]['AbsAmount'].sum()
-        pi = dp[dp['金額_数値']>0]['金額_数値'].sum()
+        vi, ve = cube.month(sy, sm); vb = vi-ve
+        pi, pe = cube.month(sy-1, sm)
+        dme = cube.cats(sy, sm)
         db = load_budgets()
         tb = db['Budget'].sum() if not db.empty else 0
         bp = (ve/tb*100) if tb>0 else 0
@@ -512,12 +543,12 @@ with tab_dash:
         with cc1:
             st.markdown('<div class="j-section">月別収支推移</div>', unsafe_allow_html=True)
             yrs = [sy]
-            if sy-1 in df_all['年'].unique(): yrs = [sy-1, sy]
+            if sy-1 in cube.years(): yrs = [sy-1, sy]
             frames = []
             for yr in yrs:
-                dy = df_all[df_all['年']==yr]
-                ei = dy[dy['金額_数値']>0].groupby('月')['金額_数値'].sum().reset_index(); ei.columns=['月','金額']; ei['種別']=f'{yr}年 収入'
-                ee = dy[dy['金額_数値']<0].groupby('月')['AbsAmount'].sum().reset_index(); ee.columns=['月','金額']; ee['種別']=f'{yr}年 支出'
+                dy = cube.year_months(yr)
+                ei = dy.loc[dy['収入']>0, '収入'].reset_index(); ei.columns=['月','金額']; ei['種別']=f'{yr}年 収入'
+                ee = dy.loc[dy['支出']>0, '支出'].reset_index(); ee.columns=['月','金額']; ee['種別']=f'{yr}年 支出'
                 frames.extend([ei,ee])
             if frames:
                 dfc = pd.concat(frames)
@@ -525,29 +556,24 @@ with tab_dash:
                 for yr in yrs:
                     if yr==sy: cm[f'{yr}年 収入']=C_MOSS; cm[f'{yr}年 支出']=C_TERRACOTTA
                     else: cm[f'{yr}年 収入']='rgba(122,148,102,0.3)'; cm[f'{yr}年 支出']='rgba(212,137,94,0.3)'
-                f1 = px.bar(dfc, x='月', y='金額', color='種別', barmode='group', color_discrete_map=cm)
-                f1.update_layout(**CHART_LAYOUT, legend=CHART_LEGEND, height=320, xaxis=dict(dtick=1, title=""), yaxis=dict(title="", gridcolor=C_BORDER, gridwidth=0.5))
-                f1.update_xaxes(ticksuffix="月")
-                st.plotly_chart(f1, use_container_width=True)
+                with stage("chart"): f1 = chart("year_bars", dfc, cm)
+                plot(f1, "year_bars")
 
         with cc2:
             st.markdown('<div class="j-section">カテゴリ別支出</div>', unsafe_allow_html=True)
             if not dme.empty:
-                cd = dme.groupby('大項目')['AbsAmount'].sum().reset_index().sort_values('AbsAmount', ascending=False)
-                colors = [C_INK_LIGHT, C_MOSS, C_TERRACOTTA, C_STONE, C_BORDER, 'rgba(26,26,26,0.25)', 'rgba(140,133,120,0.5)', '#b8a99a', '#8a9e7a', '#c4a882', '#9a8e82', '#7a7267', '#bfb5a8', '#a09486', '#8c8578', '#706b64', '#5c5c5c']
-                f2 = px.pie(cd, values='AbsAmount', names='大項目', hole=0.5, color_discrete_sequence=colors[:len(cd)])
-                f2.update_layout(**CHART_LAYOUT, height=320, showlegend=True,
-                    legend=dict(orientation="v", yanchor="middle", y=0.5, xanchor="left", x=1.02, font=dict(size=10)))
-                f2.update_traces(textposition='inside', textinfo='percent', textfont_size=10)
-                st.plotly_chart(f2, use_container_width=True)
+                cd = dme.rename_axis('大項目').reset_index(name='AbsAmount')
+                with stage("chart"): f2 = chart("cat_pie", cd)
+                plot(f2, "cat_pie")
             else:
                 st.info("支出データがありません")
 
         # Fixed vs Variable
         if not dme.empty:
             st.markdown('<div class="j-section">固定費 vs 変動費</div>', unsafe_allow_html=True)
-            fx = dme[dme['費用タイプ']=='固定費']['AbsAmount'].sum()
-            vr = dme[dme['費用タイプ']=='変動費']['AbsAmount'].sum()
+            fx, vr = cube.fixed_var(sy, sm)
+            # 大項目では変動費でも、毎月・毎年決まって出ていく支払い（サブスク等）は固定費に数える
+            rc = load_recurring(); ex, en = rc.fixed_extra(sy, sm); fx += ex; vr -= ex
             tt = fx+vr; fp = fx/tt*100 if tt>0 else 0; vp = vr/tt*100 if tt>0 else 0
             st.markdown(f"""<div class="j-fv-row">
                 <div class="j-fv"><div class="j-fv-label">固定費</div><div class="j-fv-val">{fmt(fx)}</div><div class="j-fv-pct">支出の {fp:.1f}%</div>
@@ -555,13 +581,20 @@ with tab_dash:
                 <div class="j-fv"><div class="j-fv-label">変動費</div><div class="j-fv-val">{fmt(vr)}</div><div class="j-fv-pct">支出の {vp:.1f}%</div>
                 <div class="j-bar-track" style="margin-top:12px;"><div class="j-bar-fill" style="width:{vp}%;background:var(--terracotta);"></div></div></div>
             </div>""", unsafe_allow_html=True)
+            if en: st.caption(f"定期的な支払い {en}件（{fmt(ex)}）を固定費に含めています")
+            sb = rc.subscriptions(today)
+            if not sb.empty:
+                with st.expander(f"定期的な支払い {len(sb)}件・年額 {fmt(sb['年額'].sum())}"):
+                    st.dataframe(sb.drop(columns=['状態']), use_container_width=True, hide_index=True, column_config={
+                        "金額": TX_COLUMNS["金額"], "年額": TX_COLUMNS["金額"], "変動": st.column_config.NumberColumn(format="percent"),
+                        "初回": TX_COLUMNS["日付"], "最終": TX_COLUMNS["日付"], "次回予定": TX_COLUMNS["日付"]})
 
         # Year summary table
         st.markdown('<div class="j-section">年間カテゴリ別サマリー</div>', unsafe_allow_html=True)
-        dye = df_all[(df_all['年']==sy)&(df_all['金額_数値']<0)]
+        dye = cube.year_cats(sy)
         if not dye.empty:
-            am = dye['月'].nunique() or 1
-            cy = dye.groupby('大項目')['AbsAmount'].sum().reset_index().sort_values('AbsAmount', ascending=False)
+            am = cube.exp_months(sy)
+            cy = dye.rename_axis('大項目').reset_index(name='AbsAmount')
             cy['月平均'] = cy['AbsAmount']/am
             cy['構成比'] = (cy['AbsAmount']/cy['AbsAmount'].sum()*100).round(1)
             disp = pd.DataFrame({
@@ -576,31 +609,61 @@ with tab_dash:
         st.markdown('<div class="j-section">AI 家計アドバイス</div>', unsafe_allow_html=True)
         dj = load_journal()
         if "anthropic_api_key" in st.secrets:
-            if st.button("分析を実行", type="primary", use_container_width=True, key="ai"):
-                with st.spinner("分析中..."):
-                    r = call_claude(build_prompt(sy,sm,df_all,dj))
-                    if r: st.markdown(f'<div class="j-ai-result">{r}</div>', unsafe_allow_html=True)
-                    else: st.error("APIキー設定を確認してください")
+            dv = load_advice(); ym = f"{sy}-{sm:02d}"
+            sv = dv[dv['Month'].astype(str)==ym] if not dv.empty else dv
+            out = st.empty()
+            if not sv.empty:
+                out.markdown(f'<div class="j-ai-result">{sv.iloc[0]["Advice"]}</div>', unsafe_allow_html=True)
+                st.caption(f"保存済みの分析（{sv.iloc[0]['At']}）")
+            if st.button("再分析する" if not sv.empty else "分析を実行", type="primary", use_container_width=True, key="ai"):
+                adv = get_advisor(); p = build_prompt(sy,sm,cube,dj)
+                hit = adv.cached(p) is not None
+                try:
+                    r = ""
+                    with st.spinner("分析中..."):
+                        for r in adv.stream(p): out.markdown(f'<div class="j-ai-result">{r}</div>', unsafe_allow_html=True)
+                    if r: save_advice({ym: r})
+                    if hit: st.caption("前回の分析結果を表示しています（同じデータの再分析は API を呼びません）")
+                except Exception as e:
+                    st.error(f"エラー: {e}")
+
+            with st.expander("まとめて分析する"):
+                b1,b2=st.columns(2)
+                with b1: by=st.selectbox("年",cube.years(),key="aiy")
+                with b2: bm=st.radio("対象",["未分析の月だけ","この年の全月"],horizontal=True,key="aim")
+                done=set(dv['Month'].astype(str)) if not dv.empty else set()
+                tg={f"{by}-{m:02d}": build_prompt(by,m,cube,dj) for m in cube.months(by) if bm=="この年の全月" or f"{by}-{m:02d}" not in done}
+                st.caption(f"{len(tg)}ヶ月分を最大{AI_WORKERS}件ずつ並行して分析します")
+                if st.button("まとめて分析", key="aib", disabled=not tg):
+                    bar=st.progress(0.0, text="分析中..."); res={}; err={}
+                    for k,r,e in get_advisor().batch(tg, workers=AI_WORKERS):
+                        if e is None: res[k]=r
+                        else: err[k]=e
+                        bar.progress((len(res)+len(err))/len(tg), text=f"分析中... {len(res)+len(err)}/{len(tg)}")
+                    if res: save_advice(res)
+                    if err: st.error(f"{len(res)}ヶ月分を保存しました。"+"、".join(sorted(err))+f" は失敗しました（{next(iter(err.values()))}）")
+                    else: st.success(f"{len(res)}ヶ月分を保存しました"); st.rerun()
         else:
             st.caption("Anthropic APIキーを設定するとAI分析が使えます。現在はプロンプトコピー方式です。")
             if st.button("分析用プロンプトを生成", key="aicopy"):
-                st.code(build_prompt(sy,sm,df_all,dj), language="text")
+                st.code(build_prompt(sy,sm,cube,dj), language="text")
     else:
         st.info("「データ管理」タブからデータを登録してください")
 
 # ==========================================================================
 # 月別詳細
 # ==========================================================================
-with tab_month:
+def view_month():
+    df_all = load_tx(); cube = load_cube()
     if not df_all.empty:
         c1,c2,_ = st.columns([1,1,4])
-        with c1: my = st.selectbox("年", sorted(df_all['年'].unique(), reverse=True), key="my")
+        with c1: my = st.selectbox("年", cube.years(), key="my")
         with c2:
-            mav = sorted(df_all[df_all['年']==my]['月'].unique(), reverse=True)
+            mav = cube.months(my)
             mm = st.selectbox("月", mav if mav else [1], key="mm")
         dm = df_all[(df_all['年']==my)&(df_all['月']==mm)]
         dme = dm[dm['金額_数値']<0]; dmi = dm[dm['金額_数値']>0]
-        mvi = dmi['金額_数値'].sum(); mve = dme['AbsAmount'].sum()
+        mvi, mve = cube.month(my, mm)
         mk1,mk2,mk3 = st.columns(3)
         with mk1: st.markdown(kpi("収入",fmt(mvi),"","income"), unsafe_allow_html=True)
         with mk2: st.markdown(kpi("支出",fmt(mve),"","expense"), unsafe_allow_html=True)
@@ -610,18 +673,11 @@ with tab_month:
 
         st.markdown('<div class="j-section">カテゴリ別：今月 vs 年平均</div>', unsafe_allow_html=True)
         if not dme.empty:
-            dya = df_all[(df_all['年']==my)&(df_all['金額_数値']<0)]
-            am = dya['月'].nunique() or 1
-            mc = dme.groupby('大項目')['AbsAmount'].sum().reset_index(); mc.columns=['カテゴリ','今月']
-            yc = dya.groupby('大項目')['AbsAmount'].sum().reset_index(); yc['年平均']=yc['AbsAmount']/am
-            mg = pd.merge(mc, yc[['大項目','年平均']], left_on='カテゴリ', right_on='大項目', how='left')
+            mc = cube.cats(my, mm)
+            mg = pd.DataFrame({'カテゴリ': mc.index, '今月': mc.values})
+            mg['年平均'] = mg['カテゴリ'].map(cube.year_cats(my))/cube.exp_months(my)
             mg['差額'] = mg['今月'] - mg['年平均']
-            mg = mg.sort_values('今月', ascending=False)
-            dpm = df_all[(df_all['年']==my-1)&(df_all['月']==mm)&(df_all['金額_数値']<0)]
-            if not dpm.empty:
-                pc = dpm.groupby('大項目')['AbsAmount'].sum().reset_index(); pc.columns=['カテゴリ','前年同月']
-                mg = pd.merge(mg, pc, on='カテゴリ', how='left'); mg['前年同月']=mg['前年同月'].fillna(0)
-            else: mg['前年同月']=0
+            mg['前年同月'] = mg['カテゴリ'].map(cube.cats(my-1, mm)).fillna(0)
             dd = pd.DataFrame()
             dd['カテゴリ']=mg['カテゴリ']
             dd['今月']=mg['今月'].apply(lambda x: f"¥{x:,.0f}")
@@ -631,59 +687,92 @@ with tab_month:
             st.dataframe(dd, use_container_width=True, hide_index=True)
 
             chd = mg[['カテゴリ','今月','年平均']].melt(id_vars='カテゴリ', var_name='種別', value_name='金額')
-            fc = px.bar(chd, x='カテゴリ', y='金額', color='種別', barmode='group', color_discrete_map={'今月':C_TERRACOTTA,'年平均':C_BORDER})
-            fc.update_layout(**CHART_LAYOUT, legend=CHART_LEGEND, height=280, xaxis=dict(title=""), yaxis=dict(title="", gridcolor=C_BORDER, gridwidth=0.5))
-            st.plotly_chart(fc, use_container_width=True)
+            with stage("chart"): fc = chart("month_compare", chd)
+            plot(fc, "month_compare")
 
         st.markdown('<div class="j-section">支出明細</div>', unsafe_allow_html=True)
         if not dme.empty:
-            det = dme[['日付','内容','AbsAmount','大項目','中項目','保有金融機関','費用タイプ']].copy()
-            det['日付']=det['日付'].dt.strftime('%m/%d')
-            det['金額']=det['AbsAmount'].apply(lambda x: f"¥{x:,.0f}")
-            det=det.rename(columns={'保有金融機関':'決済元'})
+            det = dme[['日付','内容','金額_数値','大項目','費用タイプ','保有金融機関']].rename(columns={'金額_数値':'金額','保有金融機関':'決済元'})
             f1,f2=st.columns(2)
             with f1: cf=st.multiselect("カテゴリで絞込", sorted(det['大項目'].unique()), key="dc")
             with f2: tf=st.multiselect("費用タイプで絞込", ["固定費","変動費"], key="dt")
             if cf: det=det[det['大項目'].isin(cf)]
             if tf: det=det[det['費用タイプ'].isin(tf)]
-            st.dataframe(det[['日付','内容','金額','大項目','費用タイプ','決済元']], use_container_width=True, hide_index=True)
+            det=det.assign(金額=-det['金額'])
+            st.dataframe(det, use_container_width=True, hide_index=True, column_config=TX_COLUMNS_MD)
         if not dmi.empty:
             with st.expander("収入明細を表示"):
-                id = dmi[['日付','内容','金額_数値','大項目','保有金融機関']].copy()
-                id['日付']=id['日付'].dt.strftime('%m/%d'); id['金額']=id['金額_数値'].apply(lambda x: f"¥{x:,.0f}")
-                st.dataframe(id[['日付','内容','金額','大項目','保有金融機関']], use_container_width=True, hide_index=True)
+                st.dataframe(dmi[['日付','内容','金額_数値','大項目','保有金融機関']].rename(columns={'金額_数値':'金額'}), use_container_width=True, hide_index=True, column_config=TX_COLUMNS_MD)
     else: st.info("データがありません")
 
+# ==========================================================================
+# 推移
+# ==========================================================================
+def view_trend():
+    tr = load_trends()
+    if tr.empty: st.info("データがありません"); return
+    c1, c2, c3 = st.columns([1,1,2])
+    with c1: tc = st.selectbox("カテゴリ", [TOTAL] + tr.cats, key="tc")
+    with c2: tp = st.selectbox("期間", ["直近3年", "直近5年", "全期間"], key="tp")
+    with c3: tl = st.multiselect("重ねる線", [f"{w}ヶ月平均" for w in WINDOWS] + ["例年同月"], default=["3ヶ月平均", "12ヶ月平均"], key="tl")
+    n = {"直近3年": 36, "直近5年": 60}.get(tp)
+    start = tr.months[max(tr.last + 1 - n, 0)] if n else None
+    ds = tr.series(tc, start)
+    last = ds.iloc[-1]
+    k1, k2, k3 = st.columns(3)
+    with k1: st.markdown(kpi(f"{last['月']} の支出", fmt(last['支出'])), unsafe_allow_html=True)
+    with k2: st.markdown(kpi("12ヶ月平均", fmt(last['12ヶ月平均'])), unsafe_allow_html=True)
+    with k3: st.markdown(kpi("前年同月との差", fmts(last['前年差']) if pd.notna(last['前年差']) else "—"), unsafe_allow_html=True)
+
+    st.markdown('<div class="j-section">月ごとの支出と移動平均</div>', unsafe_allow_html=True)
+    with stage("chart"): ft = chart("trend", ds, tuple(tl))
+    plot(ft, "trend")
+
+    st.markdown('<div class="j-section">年累計の推移</div>', unsafe_allow_html=True)
+    ys = tr.years[-(n//12):] if n else tr.years
+    with stage("chart"): fy = chart("year_curves", tr.year_curves(tc, ys))
+    plot(fy, "year_curves")
+
+    st.markdown('<div class="j-section">カテゴリ別：例年・前年との比較</div>', unsafe_allow_html=True)
+    y, m = map(int, last['月'].split('-'))
+    sn = tr.snapshot(y, m)
+    sn = sn.assign(例年との差=sn['当月'] - sn['例年同月']).rename_axis('カテゴリ').reset_index()
+    st.caption(f"{y}年{m}月時点。例年同月は前年までの同じ月の平均")
+    st.dataframe(sn, use_container_width=True, hide_index=True, column_config={c: st.column_config.NumberColumn(format="yen") for c in sn.columns[1:]})
+
 # ==========================================================================
 # データ管理
 # ==========================================================================
-with tab_data:
+def view_data():
+    df_all = load_tx()
     st.markdown('<div class="j-section">CSVアップロード</div>', unsafe_allow_html=True)
-    st.caption("マネーフォワードからエクスポートしたCSVファイルをアップロードしてください")
-    csv = st.file_uploader("CSVファイルを選択", type=['csv'], label_visibility="collapsed")
+    st.caption("マネーフォワードからエクスポートしたCSVファイル（月別CSVをまとめたZIPも可）をアップロードしてください")
+    csv = st.file_uploader("CSVファイルを選択", type=['csv','zip'], label_visibility="collapsed")
     if csv:
+        ac=st.checkbox(f"未分類の行にカテゴリを自動で付ける（確度{AUTO_CAT:.0%}以上）", value=True, key="autocat")
         if st.button("データを取り込む", type="primary", use_container_width=True):
             try:
-                try: dn = pd.read_csv(csv, encoding='shift-jis')
-                except:
-                    csv.seek(0); dn = pd.read_csv(csv, encoding='utf-8')
-                dn['日付']=pd.to_datetime(dn['日付'], errors='coerce'); dn=dn.dropna(subset=['日付'])
-                dn['年']=dn['日付'].dt.year; dn['月']=dn['日付'].dt.month
-                dn['金額_数値']=dn['金額（円）'].apply(cc); dn['AbsAmount']=dn['金額_数値'].abs()
-                sc=['日付','内容','金額（円）','保有金融機関','大項目','中項目','年','月','金額_数値','AbsAmount']
-                ex=[c for c in sc if c in dn.columns]; dns=dn[ex]
-                dc=load_tx()
-                if not dc.empty:
-                    co=[c for c in ex if c in dc.columns]
-                    dm=pd.concat([dc[co],dns[co]],ignore_index=True)
-                    dm=dm.drop_duplicates(subset=['日付','内容','金額（円）'],keep='last')
-                    dm['日付']=pd.to_datetime(dm['日付']); dm=dm.sort_values('日付',ascending=False)
-                else: dm=dns
-                save_sheet(dm,"transactions")
-                st.success(f"{len(dns)}件を取り込みました（合計{len(dm)}件）")
-                st.cache_data.clear(); st.rerun()
+                cz=load_categorizer() if ac else get_categorizer()
+                db_=get_store(); tr=get_tracker(); xi=get_index(); rc=get_recurring(); bar=st.progress(0.0, text="取り込み中...")
+                def app_(d):
+                    db_.append(d,"transactions"); t=typed_tx(d,cost_type); tr.add(t); xi.add(t); cz.add(t); rc.add(t)
+                def upd_(d):
+                    if db_.update_rows(d,"transactions"): tr.invalidate(); xi.invalidate(); cz.invalidate(); rc.invalidate()
+                for done,total,n in import_export(csv, load_tx(), app_, upd_, classify=(lambda d: cz.fill(d, AUTO_CAT)) if ac else None):
+                    bar.progress(min(done/total,1.0), text=f"取り込み中... {n['rows']:,}件")
+                st.success(f"{n['rows']}件を取り込みました（新規{n['new']}件・更新{n['upd']}件・重複スキップ{n['skip']}件"
+                           + (f"・自動分類{n['auto']}件" if n['auto'] else "") + "）")
+                st.rerun()
             except Exception as e: st.error(f"エラー: {e}")
 
+    if get_store().name == "sqlite" and get_gspread_client():
+        with st.expander("スプレッドシートから複製"):
+            st.caption(f"「{SPREADSHEET_NAME}」の全シートをローカルDB（{SQLITE_PATH}）に上書きコピーします")
+            if st.button("複製を実行", key="copydb"):
+                n=get_store().copy_from(GSheetStore(get_gspread_client, SPREADSHEET_NAME, CACHE_DIR))
+                st.success("、".join(f"{k} {v}件" for k,v in n.items())+" を複製しました")
+                st.rerun()
+
     st.markdown("---")
     st.markdown('<div class="j-section">手入力で追加</div>', unsafe_allow_html=True)
     with st.form("manual", clear_on_submit=True):
@@ -692,20 +781,18 @@ with tab_data:
             md=st.date_input("日付",today); mt=st.radio("収支",["支出","収入"],horizontal=True)
             ma=st.number_input("金額（円）",min_value=0,step=100)
         with c2:
-            ms=st.text_input("内容"); mc=st.selectbox("カテゴリ",CATEGORY_OPTIONS,index=2)
+            ms=st.text_input("内容"); mc=st.selectbox("カテゴリ",[AUTO_PICK]+CATEGORY_OPTIONS,index=3)
             msb=st.text_input("中項目（任意）")
         if st.form_submit_button("追加する", type="primary", use_container_width=True) and ma>0:
             try:
                 fn=-ma if mt=="支出" else ma
+                if mc==AUTO_PICK:
+                    p=load_categorizer().predict(pd.DataFrame({"内容":[ms],"金額_数値":[fn],"保有金融機関":["手入力"]})).iloc[0]
+                    mc=p['候補'] or "未分類"
                 nr=pd.DataFrame({"日付":[pd.to_datetime(md)],"内容":[ms],"金額（円）":[str(fn)],"保有金融機関":["手入力"],"大項目":[mc],"中項目":[msb],"年":[md.year],"月":[md.month],"金額_数値":[fn],"AbsAmount":[abs(fn)]})
-                dc=load_tx()
-                if not dc.empty:
-                    co=[c for c in nr.columns if c in dc.columns]
-                    dm=pd.concat([dc[co],nr[co]],ignore_index=True).sort_values('日付',ascending=False)
-                else: dm=nr
-                save_sheet(dm,"transactions")
-                st.success(f"{ms}（{fmt(abs(fn))}）を追加しました")
-                st.cache_data.clear(); st.rerun()
+                get_store().append(nr,"transactions"); t=typed_tx(nr,cost_type); get_tracker().add(t); get_index().add(t); get_categorizer().add(t); get_recurring().add(t)
+                st.success(f"{ms}（{fmt(abs(fn))}・{mc}）を追加しました")
+                st.rerun()
             except Exception as e: st.error(f"エラー: {e}")
 
     if not df_all.empty:
@@ -716,11 +803,82 @@ with tab_data:
             <div class="j-fv"><div class="j-fv-label">期間</div><div class="j-fv-val">{df_all['日付'].min().strftime('%Y/%m')} — {df_all['日付'].max().strftime('%Y/%m')}</div></div>
             <div class="j-fv"><div class="j-fv-label">最新データ</div><div class="j-fv-val">{df_all['日付'].max().strftime('%Y/%m/%d')}</div></div>
         </div>""", unsafe_allow_html=True)
+        cm=get_store().cache_meta("transactions"); lc=cm.get('last')
+        if lc:
+            mode={'hit':'変更なし','delta':'差分','full':'全件'}[lc['mode']]
+            st.caption(f"ローカルキャッシュ: {lc['at']} に{mode}同期（取得 {lc['fetched']}行 / {lc['total']}行・{lc['ms']}ms）　ヒット {cm.get('hits',0)}回・ミス {cm.get('misses',0)}回")
+        with st.expander("シートを整理する"):
+            st.caption("重複行を除いて日付順に全件を書き直します。通常の取り込み・追加は差分だけを書き込みます")
+            if st.button("整理を実行", key="compact"):
+                dc=tx_rows(df_all[~df_all['_fp'].duplicated(keep='last').values].sort_values('日付',ascending=False))
+                save_sheet(dc,"transactions")
+                st.success(f"{len(df_all)-len(dc)}件の重複を除いて{len(dc)}件を書き直しました")
+                st.rerun()
+
+        # 未分類の行に、学習した分類器の候補を出して確度の高いものからまとめて当てる
+        un=df_all[df_all['大項目'].astype(str).isin(UNSET).to_numpy()]
+        if not un.empty:
+            st.markdown('<div class="j-section">未分類の見直し</div>', unsafe_allow_html=True)
+            pc=load_categorizer().predict(un)
+            rv=pd.DataFrame({'日付':un['日付'],'内容':un['内容'],'金額':un['金額_数値'],'決済元':un['保有金融機関']}).join(pc)
+            rv=rv[rv['候補']!=''].sort_values('確度',ascending=False)
+            u1,u2=st.columns([3,1])
+            with u1: th=st.slider("当てる確度の下限",0.5,1.0,AUTO_CAT,0.05,key="uth")
+            ok=rv[rv['確度']>=th]
+            st.caption(f"未分類 {len(un):,}件のうち、候補あり {len(rv):,}件・確度{th:.0%}以上 {len(ok):,}件")
+            st.dataframe(rv.head(200), use_container_width=True, hide_index=True, column_config={**TX_COLUMNS,
+                "確度": st.column_config.ProgressColumn(format="%.2f", min_value=0, max_value=1)})
+            with u2:
+                if st.button(f"{len(ok):,}件に当てる", key="uapply", disabled=ok.empty, use_container_width=True):
+                    fx=df_all.loc[ok.index]
+                    n=get_store().update_rows(tx_rows(fx.assign(大項目=ok['候補'].astype(str))).assign(_row=fx['_row'].to_numpy()),"transactions")
+                    get_tracker().invalidate(); get_categorizer().invalidate(); get_recurring().invalidate()
+                    st.success(f"{n:,}件のカテゴリを更新しました"); st.rerun()
+
+        # 内容・中項目の索引から、一致した文字列ごとの件数・金額
+        st.markdown('<div class="j-section">キーワードで集計</div>', unsafe_allow_html=True)
+        k1,k2=st.columns([3,2])
+        with k1: kq=st.text_input("内容・中項目",key="kq",placeholder="例: Amazon、電気")
+        with k2: km=st.radio("一致",list(MODES),format_func=MODES.get,horizontal=True,key="km")
+        if kq.strip():
+            kr=load_index().search(kq,km)
+            if kr.empty: st.info("一致する取引がありません")
+            else:
+                st.caption(f"{len(kr)}件の内容に一致（計 {kr['件数'].sum():,}件・支出 {fmt(kr['支出'].sum())}・収入 {fmt(kr['収入'].sum())}）")
+                st.dataframe(kr, use_container_width=True, hide_index=True, column_config={**TX_COLUMNS, "支出": TX_COLUMNS["金額"], "収入": TX_COLUMNS["金額"],
+                    "最終日": TX_COLUMNS["日付"], "類似度": st.column_config.ProgressColumn(format="%.2f", min_value=0, max_value=1)})
+
+        # 全期間の取引を検索（絞り込みはサーバ側、送るのは1ページ分だけ）
+        st.markdown('<div class="j-section">取引を探す</div>', unsafe_allow_html=True)
+        d0,d1=df_all['日付'].min().date(),df_all['日付'].max().date()
+        e1,e2,e3=st.columns(3)
+        with e1: xd=st.date_input("期間",(d0,d1),min_value=d0,max_value=d1,key="xd")
+        with e2: xk=st.selectbox("収支",["すべて","支出","収入"],key="xk")
+        with e3: xs=st.selectbox("並び順",list(TX_SORTS),format_func=TX_SORTS.get,key="xs")
+        e4,e5=st.columns(2)
+        with e4: xc=st.multiselect("カテゴリ",[c for c in df_all['大項目'].cat.categories if c],key="xc")
+        with e5: xb=st.multiselect("決済元",[c for c in df_all['保有金融機関'].cat.categories if c],key="xb")
+        e6,e7,e8=st.columns([2,1,1])
+        with e6: xt=st.text_input("内容で検索",key="xt",placeholder="例: コンビニ")
+        with e7: xlo=st.number_input("金額（下限）",min_value=0,value=0,step=1000,key="xlo")
+        with e8: xhi=st.number_input("金額（上限）",min_value=0,value=None,step=1000,key="xhi")
+        ix=query_tx(df_all, xd[0] if len(xd) else None, xd[1] if len(xd)>1 else None, xc, xb,
+                    None if xk=="すべて" else xk, xt.strip(), xlo or None, xhi, xs)
+        sm_=tx_summary(df_all,ix)
+        p1,p2=st.columns([3,1])
+        with p2: xn=st.selectbox("表示件数",[50,100,500],key="xn")
+        npg=max(1,-(-sm_['n']//xn))
+        if st.session_state.get("xp",1)>npg: st.session_state.xp=1
+        with p1: xp=st.number_input(f"ページ（全{npg:,}ページ）",min_value=1,max_value=npg,value=1,key="xp")
+        st.caption(f"{sm_['n']:,}件（支出 {fmt(sm_['out'])}・収入 {fmt(sm_['inc'])}）"
+                   + (f"　{(xp-1)*xn+1:,}〜{min(xp*xn,sm_['n']):,}件目を表示" if sm_['n'] else ""))
+        st.dataframe(tx_page(df_all,ix,xp-1,xn), use_container_width=True, hide_index=True, column_config=TX_COLUMNS)
 
 # ==========================================================================
 # 予算管理
 # ==========================================================================
-with tab_budget:
+def view_budget():
+    cube = load_cube()
     st.markdown('<div class="j-section">カテゴリ別月次予算の設定</div>', unsafe_allow_html=True)
     st.caption("カテゴリごとの月次予算を設定し、今月の消化状況を確認できます")
     dbu = load_budgets()
@@ -737,29 +895,40 @@ with tab_budget:
                 rows=[{"Category":k,"Budget":v} for k,v in bv.items() if v>0]
                 save_sheet(pd.DataFrame(rows),"budgets"); st.success("保存しました"); st.rerun()
 
-    if not dbu.empty and not df_all.empty:
+    if not dbu.empty and not cube.empty:
         st.markdown('<div class="j-section">今月の予算消化状況</div>', unsafe_allow_html=True)
-        ce=df_all[(df_all['年']==today.year)&(df_all['月']==today.month)&(df_all['金額_数値']<0)]
-        cs=ce.groupby('大項目')['AbsAmount'].sum().to_dict() if not ce.empty else {}
-        for _,br in dbu.iterrows():
-            cat=br['Category']; bud=br['Budget']; sp=cs.get(cat,0)
+        tr=load_tracker(); bs=dbu.groupby('Category',sort=False)['Budget'].sum()
+        bn=tr.burn(today.year, today.month, bs, today.day); hs=[]
+        for cat,bud,sp,proj,over,dd in zip(bn.index,bn['予算'],bn['支出'],bn['月末見込み'],bn['超過済み'],bn['超過日']):
             rem=bud-sp; pct=min(sp/bud*100,100) if bud>0 else 0
             if pct<=60: bc="#5a7247"
             elif pct<=85: bc="#c2703e"
             else: bc="#b54a32"
             rh=fmt(rem) if rem>=0 else f"<b style='color:var(--warm-red)'>超過 {fmt(abs(rem))}</b>"
-            st.markdown(f"""<div class="j-budget-item">
+            if over: note=f"{dd}日に超過"
+            elif dd: note=f"<b style='color:var(--warm-red)'>このペースだと{dd}日に超過</b>"
+            else: note=f"月末見込み {fmt(proj)}"
+            hs.append(f"""<div class="j-budget-item">
                 <div class="j-budget-head"><span class="j-budget-cat">{cat}</span><span class="j-budget-nums">{fmt(sp)} / {fmt(bud)}</span></div>
                 <div class="j-bar-track"><div class="j-bar-fill" style="width:{pct}%;background:{bc};"></div></div>
-                <div class="j-budget-foot"><span class="j-budget-pct">{pct:.0f}%</span><span style="font-size:0.78rem;">残り: {rh}</span></div>
-            </div>""", unsafe_allow_html=True)
+                <div class="j-budget-foot"><span class="j-budget-pct">{pct:.0f}% ・ {note}</span><span style="font-size:0.78rem;">残り: {rh}</span></div>
+            </div>""")
+        st.markdown("".join(hs), unsafe_allow_html=True)
+
+        st.markdown('<div class="j-section">予算と実績の推移</div>', unsafe_allow_html=True)
+        hi=tr.history(bs)
+        if not hi.empty:
+            hy=st.selectbox("年",sorted({k[:4] for k in hi.index},reverse=True),key="bhy")
+            hp=(hi[hi.index.str.startswith(hy)]/bs*100).rename_axis('月').reset_index()
+            st.caption("予算に対する実績の割合（100%を超えた月は予算超過）")
+            st.dataframe(hp, use_container_width=True, hide_index=True, column_config={c: st.column_config.NumberColumn(format="%.0f%%") for c in bs.index})
     elif dbu.empty:
         st.info("上の「予算を設定・変更する」から予算を登録してください")
 
 # ==========================================================================
 # 資産・ゴール
 # ==========================================================================
-with tab_asset:
+def view_asset():
     st.markdown('<div class="j-section">資産額の入力</div>', unsafe_allow_html=True)
     with st.expander("資産額を入力・更新する"):
         with st.form("af"):
@@ -776,8 +945,16 @@ with tab_asset:
                 na=pd.DataFrame({"Month":[ms],"Bank":[vb],"Securities":[vs],"iDeCo":[vid],"Other":[vo],"Total":[tv]})
                 da=pd.concat([da,na],ignore_index=True).sort_values('Month')
                 save_sheet(da,"assets"); st.success("保存しました"); st.rerun()
+    with st.expander("口座の残高をCSVで取り込む"):
+        st.caption("「日付・口座・残高（・種別）」の列、または「日付＋口座ごとの残高」の列を持つCSV。同じ日・同じ口座は後から取り込んだ値が優先されます")
+        bf=st.file_uploader("残高CSV",type=['csv'],key="bcsv",label_visibility="collapsed")
+        if bf and st.button("残高を取り込む",key="bimp",use_container_width=True):
+            try:
+                nb=read_balances(bf); get_store().append(nb,"balances")
+                st.success(f"{len(nb):,}件（{nb['Account'].nunique()}口座）を取り込みました"); st.rerun()
+            except Exception as e: st.error(f"エラー: {e}")
 
-    da=load_assets()
+    da=load_asset_months()
     if not da.empty:
         st.markdown('<div class="j-section">資産推移</div>', unsafe_allow_html=True)
         lt=da.iloc[-1]['Total']
@@ -787,12 +964,8 @@ with tab_asset:
         else: db=""
         st.markdown(kpi("現在の総資産",fmt(lt),db,"asset"), unsafe_allow_html=True)
 
-        fa=go.Figure()
-        conf=[('Bank','銀行・現金',C_MOSS),('Securities','証券',C_TERRACOTTA),('iDeCo','iDeCo',C_STONE),('Other','その他',C_BORDER)]
-        for col,nm,clr in conf:
-            fa.add_trace(go.Scatter(x=da['Month'],y=da[col],mode='lines',stackgroup='one',name=nm,line=dict(width=0.5),fillcolor=clr))
-        fa.update_layout(**CHART_LAYOUT, legend=CHART_LEGEND, height=350, xaxis=dict(type='category',title=""), yaxis=dict(title="",gridcolor=C_BORDER,gridwidth=0.5))
-        st.plotly_chart(fa, use_container_width=True)
+        with stage("chart"): fa=chart("assets", da)
+        plot(fa, "assets")
 
         with st.expander("詳細データ"):
             dd=da.copy()
@@ -800,6 +973,20 @@ with tab_asset:
             dd.columns=['月','銀行・現金','証券','iDeCo','その他','合計']
             st.dataframe(dd, use_container_width=True, hide_index=True)
 
+        bl=load_balances()
+        if not bl.empty:
+            st.markdown('<div class="j-section">口座別の残高</div>', unsafe_allow_html=True)
+            b1,b2,b3=st.columns(3)
+            with b1: bq=st.radio("間隔",list(FREQS),format_func=FREQS.get,index=1,horizontal=True,key="bq")
+            with b2: bby=st.radio("内訳",["group","account"],format_func={"group":"種別","account":"口座"}.get,horizontal=True,key="bby")
+            with b3: bp=st.selectbox("期間",["直近3ヶ月","直近1年","全期間"],index=1,key="bp")
+            be=bl.span()[1]; bs_={"直近3ヶ月":be-90,"直近1年":be-365}.get(bp)
+            db=bl.frame(bq, bs_, by=bby)
+            with stage("chart"): fb=chart("balances", db)
+            plot(fb, "balances")
+            st.dataframe(bl.latest(), use_container_width=True, hide_index=True,
+                         column_config={"残高": st.column_config.NumberColumn(format="yen"), "更新日": st.column_config.DateColumn(format="YYYY/MM/DD")})
+
         st.markdown('<div class="j-section">資産ゴール設定</div>', unsafe_allow_html=True)
         dg=load_goals()
         with st.expander("ゴールを設定・変更する"):
@@ -814,7 +1001,11 @@ with tab_asset:
                     save_sheet(dg,"goals"); st.success("保存しました"); st.rerun()
 
         if not dg.empty and len(da)>=2:
-            for _,goal in dg.iterrows():
+            q1,q2=st.columns([3,1])
+            with q1: pm=st.radio("予測モデル",list(MODELS),format_func=MODELS.get,horizontal=True,key="pm")
+            with q2: pr=st.number_input("想定利回り（年%）",value=4.0,step=0.5,key="pr",disabled=pm not in ("compound","montecarlo"))
+            pj=load_projection(pm,pr/100,today.date())
+            for gi,(_,goal) in enumerate(dg.iterrows()):
                 gn=goal['GoalName']; gt=goal['TargetAmount']; gds=str(goal['TargetDate'])
                 st.markdown(f'<div class="j-section">{gn}</div>', unsafe_allow_html=True)
                 prog=min(lt/gt*100,100) if gt>0 else 0; rem=max(gt-lt,0)
@@ -825,27 +1016,23 @@ with tab_asset:
                     st.markdown(f'<div class="j-kpi asset"><div class="j-kpi-label">達成率</div><div class="j-kpi-value">{prog:.1f}%</div><div class="j-bar-track"><div class="j-bar-fill" style="width:{prog}%;background:{bc2};"></div></div></div>', unsafe_allow_html=True)
                 with p3: st.markdown(kpi("残り",fmt(rem),"",""), unsafe_allow_html=True)
 
-                tots=da['Total'].values; avg=np.mean(np.diff(tots))
-                lm=da.iloc[-1]['Month']
-                try: tdt=datetime.strptime(gds[:10],'%Y-%m-%d')
-                except: tdt=datetime(today.year+5,12,31)
-                mah=min(max((tdt.year-today.year)*12+(tdt.month-today.month),12),240)
-                fm2,fv2=[],[]; cur=lt; base=datetime.strptime(lm+"-01",'%Y-%m-%d')
-                for i in range(1,mah+1):
-                    nd=base+relativedelta(months=i); fm2.append(nd.strftime('%Y-%m')); cur+=avg; fv2.append(max(cur,0))
-
-                fg=go.Figure()
-                fg.add_trace(go.Scatter(x=da['Month'].tolist(),y=da['Total'].tolist(),mode='lines+markers',name='実績',line=dict(color=C_MOSS,width=3),marker=dict(size=6)))
-                fg.add_trace(go.Scatter(x=[lm]+fm2,y=[lt]+fv2,mode='lines',name=f'予測（月{fmts(avg)}）',line=dict(color=C_MOSS,width=2,dash='dash')))
-                fg.add_hline(y=gt,line_dash="dot",line_color=C_TERRACOTTA,annotation_text=f"目標: {fmt(gt)}",annotation_position="top left")
-                fg.update_layout(**CHART_LAYOUT, legend=CHART_LEGEND, height=380, xaxis=dict(type='category',title="",tickangle=-45,dtick=max(1,len(fm2)//12)), yaxis=dict(title="",gridcolor=C_BORDER,gridwidth=0.5))
-                st.plotly_chart(fg, use_container_width=True)
-
-                if avg>0 and rem>0:
-                    est=today+relativedelta(months=int(rem/avg))
-                    st.info(f"現在のペース（月平均 {fmts(avg)}）で続けると、{est.strftime('%Y年%m月')} 頃に目標達成の見込みです")
-                elif avg<=0 and rem>0: st.warning("現在のペースでは資産が増加していません。収支の見直しを検討しましょう")
-                elif rem<=0: st.success("目標を達成しています！")
+                avg=pj.pace; fm2,fv2,band=pj.goal(gi)
+
+                nm=f'予測（月{fmts(avg)}）' if pm in ("linear","trailing") else f'予測（{MODELS[pm]}{"・中央値" if band else ""}）'
+                with stage("chart"): fg=chart("goal", da['Month'].astype(str), da['Total'], fm2, fv2, band, gt, nm, f"目標: {fmt(gt)}")
+                plot(fg, "goal")
+
+                if pj.prob is not None and rem>0: st.caption(f"期限（{fm2[-1]}）までに目標に届くパスの割合: {pj.prob[gi]:.0%}（{pj.paths:,}パス）")
+                if rem<=0: st.success("目標を達成しています！")
+                elif pm in ("linear","trailing"):
+                    if avg>0:
+                        est=today+relativedelta(months=int(rem/avg))
+                        st.info(f"現在のペース（月平均 {fmts(avg)}）で続けると、{est.strftime('%Y年%m月')} 頃に目標達成の見込みです")
+                    else: st.warning("現在のペースでは資産が増加していません。収支の見直しを検討しましょう")
+                else:
+                    rm=pj.reach(gi)
+                    if rm: st.info(f"{MODELS[pm]}の予測では {rm[:4]}年{rm[5:]}月 頃に目標達成の見込みです")
+                    else: st.warning(f"{MODELS[pm]}の予測では期限までに目標に届きません")
         elif dg.empty: st.info("ゴールを設定すると予測グラフが表示されます")
         else: st.info("予測には2ヶ月以上の資産データが必要です")
     else: st.info("資産データを入力すると推移グラフが表示されます")
@@ -853,7 +1040,7 @@ with tab_asset:
 # ==========================================================================
 # 振り返り
 # ==========================================================================
-with tab_journal:
+def view_journal():
     st.markdown('<div class="j-section">月次振り返り</div>', unsafe_allow_html=True)
     st.caption("毎月の感想や気づきを記録。AI分析にもこのコメントが反映されます。")
     djn = load_journal()
@@ -887,3 +1074,46 @@ with tab_journal:
                 <div class="j-journal-comment">{row['Comment']}</div>
             </div>""", unsafe_allow_html=True)
     else: st.info("まだ振り返りが登録されていません")
+
+# ==========================================
+# Navigation
+# ==========================================
+# 遅延モードでは選択中のビューだけがデータを読み、図を組み立てる（KAKEIBO_LAZY_TABS=0 で従来の全タブ描画）
+VIEWS = {"ダッシュボード": view_dash, "月別詳細": view_month, "推移": view_trend, "データ管理": view_data,
+         "予算管理": view_budget, "資産・ゴール": view_asset, "振り返り": view_journal}
+LAZY_TABS = os.environ.get("KAKEIBO_LAZY_TABS", "1") != "0"
+
+def run_view(name):
+    t = time.perf_counter()
+    with stage("render"): VIEWS[name]()
+    st.session_state.setdefault("view_ms", {})[name] = (time.perf_counter()-t)*1000
+
+if LAZY_TABS:
+    view = st.radio("表示", list(VIEWS), horizontal=True, key="view", label_visibility="collapsed")
+    run_view(view)
+else:
+    for tab, name in zip(st.tabs(list(VIEWS)), VIEWS):
+        with tab: run_view(name)
+
+vms = st.session_state.get("view_ms", {})
+st.caption("描画時間: " + " ・ ".join(f"{k} {v:,.0f}ms" for k, v in vms.items() if k in VIEWS))
+wp = get_store().pending()
+if wp: st.caption("書き込み待ち: " + " ・ ".join(f"{k} {v:,}行" + (f"（再試行中: {get_store().errors[k][:60]}）" if k in get_store().errors else "") for k, v in wp.items()))
+
+# ==========================================
+# Diagnostics
+# ==========================================
+if PROFILE:
+    rec = prof.end(PROFILE_LOG, view=st.session_state.get("view", "all") if LAZY_TABS else "all", storage=STORAGE)
+    with st.expander("診断（この再実行の内訳）"):
+        st.caption(f"合計 {rec['ms']:,.0f}ms ・ ログ: {PROFILE_LOG}")
+        cc = get_cache(); st.caption(f"データキャッシュ: {len(cc.d)}件・{cc.bytes/2**20:,.1f}MB ・ ヒット {cc.hits:,}回 / 作り直し {cc.misses:,}回")
+        st.dataframe(pd.DataFrame([{"ステージ":k,"時間(ms)":v[0],"回数":v[1]} for k,v in rec['stages'].items()]), use_container_width=True, hide_index=True)
+        if rec['calls']:
+            st.dataframe(pd.DataFrame([{"呼び出し先":k,"回数":v[0],"バイト":v[1]} for k,v in rec['calls'].items()]), use_container_width=True, hide_index=True)
+        hist = prof.history(PROFILE_LOG)
+        if hist:
+            st.markdown('<div class="j-section">直近の再実行</div>', unsafe_allow_html=True)
+            st.dataframe(pd.DataFrame([dict(日時=h['at'], ビュー=h.get('view',''), 合計ms=h['ms'],
+                **{k: v[0] for k, v in h['stages'].items()}, API回数=sum(v[0] for k, v in h['calls'].items() if not k.startswith('chart:')),
+                バイト=sum(v[1] for k, v in h['calls'].items() if not k.startswith('chart:')), 図バイト=sum(v[1] for k, v in h['calls'].items() if k.startswith('chart:'))) for h in reversed(hist)]), use_container_width=True, hide_index=True)
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+from data import sniff_encoding
+from prof import staged
+
+# ==========================================
+# 口座ごとの残高の時系列
+# ==========================================
+# balances シートには (日付, 口座, 種別, 残高) のスナップショットを追記していく（同じ日・同じ口座は後の行が勝つ）。
+# 読み込んだら口座ごとに日付（日単位の整数）と残高の numpy 配列に畳み、日・週・月への引き直しは searchsorted で直前の値を引き継ぐ
+BAL_COLS = ['Date', 'Account', 'Group', 'Balance']
+GROUPS = {'Bank': '銀行・現金', 'Securities': '証券', 'iDeCo': 'iDeCo', 'Other': 'その他'}  # assets シートの列と同じ
+FREQS = {'D': '日', 'W': '週', 'M': '月'}
+# 取り込む CSV の列名の揺れ
+_ALIAS = {'Date': ('日付', '日時', '基準日'), 'Account': ('口座', '口座名', '金融機関', '保有金融機関'),
+          'Group': ('種別', '種類', '区分'), 'Balance': ('残高', '残高（円）', '金額', '評価額')}
+_WORDS = (('iDeCo', ('ideco', '確定拠出', '年金')), ('Securities', ('証券', '株', '投信', '投資信託', 'nisa', 'securities')), ('Bank', ('銀行', '現金', '預金', '財布', 'bank', 'cash')))
+
+def _amount(s):
+    # 残高 -> float。parse_yen と違い、読めない値（'-'・'abc'・メモ）は 0 ではなく NaN にする（偽の残高 0 が前の残高を上書きしないように）
+    s = s.astype('string').str.normalize('NFKC').str.replace(r'[¥\\,円\s]', '', regex=True).str.replace('▲', '-', regex=False)  # 全角の ￥・数字も読む
+    return pd.to_numeric(s, errors='coerce').astype(float)
+
+def group_of(s):
+    # 種別（または口座名）を assets の列名に寄せる
+    s = str(s).strip()
+    for k, v in GROUPS.items():
+        if s in (k, v): return k
+    t = s.casefold()
+    for k, ws in _WORDS:
+        if any(w in t for w in ws): return k
+    return 'Other'
+
+def read_balances(f):
+    # 残高 CSV -> (Date, Account, Group, Balance)。口座の列が無ければ「日付＋口座ごとの残高の列」の横持ちとみなす
+    head = f.read(4096); f.seek(0)
+    df = pd.read_csv(f, encoding=sniff_encoding(head), dtype=str)
+    col = {}
+    for k, names in _ALIAS.items():
+        for c in df.columns:
+            if c.strip() in names or c.strip().casefold() == k.casefold(): col.setdefault(k, c)
+    if 'Date' not in col: raise ValueError("日付の列が見つかりません")
+    if 'Account' in col and 'Balance' in col:
+        d = pd.DataFrame({'Date': df[col['Date']], 'Account': df[col['Account']], 'Balance': df[col['Balance']],
+                          'Group': df[col['Group']] if 'Group' in col else np.nan})
+    else:
+        # 横持ちの「合計」列（合計（円）・総合計・Total など）は口座ではないので落とす（残すと Total が倍になる）
+        tot = [c for c in df.columns if c != col['Date'] and any(w in c.strip().casefold() for w in ('合計', '総額', '総資産', 'total'))]
+        d = df.drop(columns=tot).melt(id_vars=col['Date'], var_name='Account', value_name='Balance').rename(columns={col['Date']: 'Date'}).assign(Group=np.nan)
+    d['Date'] = pd.to_datetime(d['Date'], errors='coerce', format='mixed')
+    d['Balance'] = _amount(d['Balance'])
+    d['Account'] = d['Account'].fillna('').astype(str).str.strip()
+    d = d[d['Date'].notna() & d['Balance'].notna() & (d['Account'] != '')]
+    g = d['Group'].fillna(d['Account']).astype(str); u = g.unique()
+    return d.assign(Date=d['Date'].dt.strftime('%Y-%m-%d'), Group=g.map(dict(zip(u, map(group_of, u)))))[BAL_COLS].reset_index(drop=True)
+
+class Balances:
+    # 口座 j の記録は d[j]（日付, int32 の日数）と v[j]（残高）。口座ごとに日付順・重複なし
+    @staged('aggregate')
+    def __init__(self, df):
+        self.acc, self.grp, self.d, self.v = [], [], [], []
+        if df is None or df.empty: return
+        d = pd.to_datetime(df['Date'], errors='coerce', format='mixed').to_numpy('datetime64[D]')
+        v = _amount(df['Balance']).to_numpy(float); ok = ~np.isnat(d) & ~np.isnan(v)
+        a = df['Account'].fillna('').astype(str).to_numpy(object); ok &= a != ''
+        if not ok.any(): return
+        ai, self.acc = pd.factorize(a[ok]); self.acc = list(self.acc)
+        d = d[ok].astype(np.int64); v = v[ok]; g = df['Group'].fillna('').astype(str).to_numpy(object)[ok]
+        g = np.where(g == '', a[ok], g)  # 種別が空なら口座名から推す
+        # 口座・日付・行の順に並べ、同じ日の記録は最後の行（後から取り込んだもの）だけ残す
+        o = np.lexsort((np.arange(len(d)), d, ai)); ai, d, v, g = ai[o], d[o], v[o], g[o]
+        keep = np.r_[(ai[1:] != ai[:-1]) | (d[1:] != d[:-1]), True]; ai, d, v, g = ai[keep], d[keep], v[keep], g[keep]
+        cut = np.flatnonzero(np.diff(ai)) + 1
+        self.d = np.split(d.astype(np.int32), cut); self.v = np.split(v, cut)
+        self.grp = [group_of(x) for x in g[np.r_[cut, len(ai)] - 1]]  # 種別は口座の一番新しい記録のもの
+
+    @property
+    def empty(self): return not self.acc
+
+    def span(self): return min(int(d[0]) for d in self.d), max(int(d[-1]) for d in self.d)
+
+    def grid(self, freq='M', start=None, end=None):
+        # 引き直す日付（日数）。週は日曜、月は月末で区切り、最初と最後の点は start / end（既定はデータの最初と最後の日）
+        s, e = self.span()
+        if start is not None: s = max(s, int(np.datetime64(start, 'D').astype(np.int64)))
+        if end is not None: e = min(e, int(np.datetime64(end, 'D').astype(np.int64)))
+        if s > e: return np.zeros(0, np.int64)
+        if freq == 'D': g = np.arange(s, e + 1)
+        elif freq == 'W': g = np.arange(s + (-(s + 4)) % 7, e, 7)  # 1970-01-01 は木曜
+        else:
+            m = np.arange(np.datetime64(s, 'D').astype('datetime64[M]'), np.datetime64(e, 'D').astype('datetime64[M]') + 1)
+            g = (m + 1).astype('datetime64[D]').astype(np.int64) - 1
+        return np.unique(np.r_[s, g[(g > s) & (g < e)], e])
+
+    @staged('aggregate')
+    def frame(self, freq='M', start=None, end=None, by='account'):
+        # 各時点の口座ごと（by='group' なら種別ごと）の残高と Total。記録の間は直前の値を引き継ぎ、最初の記録より前は 0
+        g = self.grid(freq, start, end) if not self.empty else np.zeros(0, np.int64)
+        M = np.zeros((len(g), len(self.acc)))
+        for j, (d, v) in enumerate(zip(self.d, self.v)):
+            i = np.searchsorted(d, g, 'right') - 1
+            M[:, j] = np.where(i >= 0, v[np.maximum(i, 0)], 0)
+        ix = pd.DatetimeIndex(g.astype('datetime64[D]'), name='Date')
+        if by == 'group':
+            df = pd.DataFrame(M @ np.array([[x == k for k in GROUPS] for x in self.grp], float).reshape(len(self.acc), len(GROUPS)), index=ix, columns=list(GROUPS))
+        else: df = pd.DataFrame(M, index=ix, columns=self.acc)
+        df['Total'] = M.sum(axis=1)
+        return df
+
+    def monthly(self):
+        # assets シートと同じ形（Month, Bank, Securities, iDeCo, Other, Total）の月末残高
+        df = self.frame('M', by='group').reset_index()
+        return df.assign(Month=df['Date'].dt.strftime('%Y-%m')).drop_duplicates('Month', keep='last')[['Month', *GROUPS, 'Total']].reset_index(drop=True)
+
+    def latest(self):
+        # 口座ごとの最新の残高
+        return pd.DataFrame({'口座': self.acc, '種別': [GROUPS[g] for g in self.grp], '残高': [v[-1] for v in self.v],
+                             '更新日': np.array([d[-1] for d in self.d], np.int64).astype('datetime64[D]'),
+                             '記録数': [len(d) for d in self.d]}).sort_values('残高', ascending=False, ignore_index=True)
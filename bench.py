@@ -0,0 +1,471 @@
+# python bench.py [--rows 100000]
+# python bench.py --ai [--months 24]
+# python bench.py --suite --rows 1000 10000 100000 1000000 [--years 10] [--cats 17] [--json bench.jsonl]
+import argparse, io, json, os, shutil, tempfile, threading, time, tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from data import cc, parse_yen, normalize_export, typed_tx, tx_rows, import_export, monthly_totals, Cube, BudgetTracker, build_prompt, query_tx, tx_page, tx_summary
+from projection import Projection
+from search import TextIndex
+from categorize import Categorizer
+from recurring import RecurringDetector
+from trends import Trends, WINDOWS
+from balances import Balances, read_balances
+import charts
+from ai import Advisor, serve_stub
+from dateutil.relativedelta import relativedelta
+from storage import GSheetStore, WriteBehind
+from revcache import RevCache
+import fake_gspread
+
+EDGE = ['1,200', '-1,200', '¥3,000', '▲500', '▲1,234,567', '\\800', '', ' ', '  42 ', 'abc', '--5', '▲-5',
+        'nan', '1e3', '+7', '.5', '1_000', '１２３', '0', '-0', '3.25', '¥-1,000.5', 'None']
+
+CATS = ["食費", "日用品", "水道・光熱費", "交通費", "収入", "住宅", "特別な支出", "衣服・美容", "健康・医療", "税・社会保障",
+        "自動車", "保険", "趣味・娯楽", "現金・カード", "交際費", "教養・教育", "通信費", "未分類"]
+
+def synth_export(n, seed=0, years=10, cats=5):
+    # マネーフォワードのエクスポートと同じ列構成。金額はシート経由の文字列表記を混ぜる
+    rng = np.random.default_rng(seed)
+    amt = rng.integers(100, 200000, n) * np.where(rng.random(n) < 0.85, -1, 1)
+    fm = rng.integers(0, 5, n)
+    txt = np.where(fm == 0, pd.Series(amt).map('{:,}'.format),
+          np.where(fm == 1, pd.Series(amt).map(lambda v: f"▲{-v:,}" if v < 0 else f"{v:,}"),
+          np.where(fm == 2, pd.Series(amt).map(lambda v: f"¥{v:,}"),
+          np.where(fm == 3, pd.Series(amt).astype(str), ''))))
+    d = pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 365*years, n), unit='D')
+    return pd.DataFrame({
+        '計算対象': 1, '日付': d.strftime('%Y/%m/%d'), '内容': rng.choice(['Amazon', 'セブンイレブン', '東京電力', 'JR東日本', '給与'], n),
+        '金額（円）': txt, '保有金融機関': rng.choice(['三井住友銀行', '楽天カード', '手入力'], n),
+        '大項目': rng.choice(CATS[:cats], n), '中項目': '', 'メモ': '', '振替': 0, 'ID': np.arange(n).astype(str),
+    })
+
+def timed(f, *a, rep=3):
+    best = float('inf')
+    for _ in range(rep):
+        t0 = time.perf_counter(); r = f(*a); best = min(best, time.perf_counter() - t0)
+    return r, best
+
+def bench_parse(n):
+    for col in (pd.Series(EDGE), pd.Series(EDGE + [None, np.nan, 1200, -3.5], dtype=object)):
+        np.testing.assert_array_equal(parse_yen(col).values, col.astype(str).apply(cc).astype(float).values)
+    s = synth_export(n)['金額（円）']
+    ref, t_ref = timed(lambda c: c.astype(str).apply(cc), s)
+    got, t_vec = timed(parse_yen, s)
+    np.testing.assert_array_equal(got.values, ref.astype(float).values)
+    print(f"parse {n:,} rows: apply(cc) {t_ref*1000:.1f}ms / parse_yen {t_vec*1000:.1f}ms (x{t_ref/t_vec:.1f}), parity OK")
+
+FIXED = {"住宅", "水道・光熱費", "保険", "通信費", "税・社会保障", "自動車"}
+def cost_type(c): return "固定費" if c in FIXED else "変動費"
+
+def synth_sheet(n, seed=0, years=10, cats=5):
+    # transactions シートを get_all_values した形（全部文字列）
+    return sheet_rows(synth_export(n, seed, years, cats))
+
+def sheet_rows(ex):
+    return tx_rows(typed_tx(normalize_export(ex).assign(金額_数値=lambda d: d['金額_数値'].fillna(0)), cost_type)).astype(str)
+
+def legacy_tx(df):
+    # 以前の load_tx の型付け（object 文字列 + float + int64）
+    df = df.copy()
+    df['金額_数値'] = df['金額_数値'].astype(str).apply(cc); df['AbsAmount'] = df['AbsAmount'].astype(str).apply(cc)
+    df['日付'] = pd.to_datetime(df['日付'], errors='coerce'); df = df.dropna(subset=['日付'])
+    df['年'] = df['日付'].dt.year.astype(int); df['月'] = df['日付'].dt.month.astype(int)
+    df['費用タイプ'] = df['大項目'].apply(cost_type)
+    return df
+
+def bench_schema(n):
+    raw = synth_sheet(n)
+    old, t_old = timed(legacy_tx, raw); new, t_new = timed(typed_tx, raw, cost_type)
+    mb = lambda d: d.memory_usage(deep=True).sum() / 2**20
+    g_old = timed(lambda: old[old['金額_数値']<0].groupby(['年','月','大項目'])['AbsAmount'].sum())[1]
+    g_new = timed(lambda: new[new['金額_数値']<0].groupby(['年','月','大項目'], observed=True)['金額_数値'].sum())[1]
+    print(f"schema {n:,} rows: memory {mb(old):.1f}MB -> {mb(new):.1f}MB, parse {t_old*1000:.0f}ms -> {t_new*1000:.0f}ms, groupby {g_old*1000:.1f}ms -> {g_new*1000:.1f}ms")
+
+def bench_explore(n=500000):
+    # 全期間の明細検索。以前の作り（全行を lambda で ¥ 整形してから、整形済みのコピーを絞り込む）と比べる
+    tx = typed_tx(synth_sheet(n, cats=len(CATS)), cost_type).sort_values('日付', ascending=False)
+    def legacy(cats):
+        d = tx[['日付','内容','金額_数値','大項目','保有金融機関']].copy(); d['金額'] = (-d['金額_数値']).apply(lambda x: f"¥{x:,.0f}")
+        return d[d['大項目'].isin(cats)]
+    cats = ["食費", "日用品"]; ref, t_ref = timed(legacy, cats)
+    ix, t_q = timed(lambda: query_tx(tx, cats=cats)); pg, t_p = timed(tx_page, tx, ix, 0, 100)
+    assert len(ix) == len(ref) and (pg['日付'].diff().dropna() <= pd.Timedelta(0)).all()
+    y = tx['日付'].dt.year.max()
+    qs = {'期間1年': dict(start=f'{y}-01-01', end=f'{y}-12-31'), '支出・金額範囲': dict(kind="支出", lo=1000, hi=5000),
+          '文字列': dict(text="amazon"), '全条件': dict(start=f'{y-3}-01-01', cats=cats, kind="支出", text="東", lo=500, sort="big")}
+    out = []
+    for k, q in qs.items():
+        ix, t = timed(lambda: query_tx(tx, **q))
+        v = tx['金額_数値'].to_numpy()[ix]; s = tx_summary(tx, ix)
+        if 'lo' in q: assert (np.abs(v) >= q['lo']).all()
+        if 'text' in q: assert tx['内容'].iloc[ix].str.contains(q['text'], case=False).all()
+        if q.get('sort') == 'big': assert (np.diff(np.abs(v)) <= 0).all()
+        out.append(f"{k} {s['n']:,}件 {t*1000:.1f}ms")
+    print(f"explore {n:,} rows: format+filter {t_ref*1000:.0f}ms -> query {t_q*1000:.1f}ms + page {t_p*1000:.1f}ms; " + ", ".join(out))
+
+SHOPS = {"セブン-イレブン": "食費", "ファミリーマート": "食費", "ローソン": "食費", "スターバックス": "食費", "マクドナルド": "食費",
+         "Amazon.co.jp": "日用品", "楽天市場": "日用品", "ダイソー": "日用品", "東京電力エナジーパートナー": "水道・光熱費", "東京ガス": "水道・光熱費",
+         "ＪＲ東日本": "交通費", "ユニクロ": "衣服・美容", "ドコモ": "通信費", "出光": "自動車", "ENEOS": "自動車", "ヨドバシカメラ": "趣味・娯楽"}
+
+def synth_shops(uniq):
+    # 店名＋支店（"ローソン 渋谷3号店" など）を uniq 件と、それぞれの本来のカテゴリ
+    places = ["渋谷", "新宿", "池袋", "品川", "横浜", "大宮", "千葉", "立川"]; shops = list(SHOPS)
+    names = [f"{shops[i % len(shops)]} {places[i // len(shops) % len(places)]}{i // (len(shops)*len(places))}号店" for i in range(uniq)]
+    return np.array(names), np.array([SHOPS[shops[i % len(shops)]] for i in range(uniq)])
+
+def bench_categorize(n=100000, uniq=5000, noise=0.05):
+    # 支店の8割で学び、残り2割（見たことの無い支店名）と既知の支店の行を当てる。学習データのカテゴリは noise の割合で壊しておく
+    rng = np.random.default_rng(5)
+    names, truth = synth_shops(uniq)
+    tx = typed_tx(synth_sheet(2*n, cats=len(CATS)), cost_type).reset_index(drop=True)
+    j = rng.integers(0, uniq, 2*n); tx['内容'] = names[j]; lab = truth[j].astype(object)
+    bad = rng.random(2*n) < noise; lab[bad] = rng.choice(CATS, bad.sum())
+    tx['大項目'] = pd.Categorical(lab); tx['金額_数値'] = np.where(tx['大項目'] == '収入', 1, -1) * tx['金額_数値'].abs()
+    seen = j % 5 != 0
+    train = tx.iloc[:n][seen[:n]]; test = tx.iloc[n:].assign(大項目='未分類')
+    cz, t_fit = timed(lambda: Categorizer().sync(train), rep=1)
+    p, t_pred = timed(cz.predict, test, rep=1)
+    ok = p['候補'].to_numpy() == truth[j[n:]]; new = ~seen[n:]
+    filled, k = cz.fill(test, 0.8); hi = p['確度'].to_numpy() >= 0.8
+    assert k == hi.sum(); acc_k = (filled['大項目'].to_numpy()[hi] == truth[j[n:]][hi]).mean()
+    print(f"categorize: fit {len(train):,} rows {t_fit*1000:.0f}ms, predict {n:,} rows {t_pred*1000:.0f}ms; "
+          f"accuracy known shops {ok[~new].mean():.1%} (rule {(p['根拠'] == 'ルール').mean():.0%}), unseen branches {ok[new].mean():.1%}; "
+          f"fill ≥0.8: {k:,} rows at {acc_k:.1%}")
+
+def synth_subs(k, years=10, seed=7):
+    # 毎月・毎年の支払いを k 件（半分は途中で解約、どれも途中で1回値上げ）。日付は数日ぶれる
+    rng = np.random.default_rng(seed); rows = []
+    for i in range(k):
+        yearly = i % 4 == 3; start = pd.Timestamp('2015-01-01') + pd.Timedelta(days=int(rng.integers(0, 365*2)))
+        end = (2015 + years - 1 - start.year) if yearly else (2015 + years - 1 - start.year)*12 + 12 - start.month  # 期間の終わりまで続けた場合の回数-1
+        cnt = end + 1 if i % 2 else int(rng.integers(2, end)); amt = int(rng.integers(3, 300)) * 100
+        for j in range(cnt):
+            d = start + (pd.DateOffset(years=j) if yearly else pd.DateOffset(months=j)) + pd.Timedelta(days=int(rng.integers(0, 3)))
+            rows.append((d, f"SUB-{chr(65 + i//26 % 26)}{chr(65 + i % 26)} 会員番号{rng.integers(10**5, 10**6)}", -(amt if j < cnt//2 else int(amt*1.15)), "趣味・娯楽"))
+    return pd.DataFrame(rows, columns=['日付', '内容', '金額_数値', '大項目']).assign(保有金融機関='楽天カード', 中項目='')
+
+def bench_recurring(n=500000, k=200):
+    tx = typed_tx(synth_sheet(n, cats=len(CATS)), cost_type); sub = typed_tx(synth_subs(k), cost_type)
+    full = pd.concat([tx, sub], ignore_index=True).sample(frac=1, random_state=0, ignore_index=True)
+    rc, t_full = timed(lambda: RecurringDetector().sync(full), rep=1)
+    inc = RecurringDetector().sync(full.iloc[:-1000]); _, t_add = timed(inc.add, full.iloc[-1000:], rep=1)
+    today = full['日付'].max()
+    a = rc.subscriptions(today, True); b = inc.subscriptions(today, True)
+    pd.testing.assert_frame_equal(a.sort_values('内容', ignore_index=True), b.sort_values('内容', ignore_index=True))
+    found = a['内容'].str.startswith('SUB').sum(); fp = (~a['内容'].str.startswith('SUB')).sum()
+    y, m = today.year, today.month
+    print(f"recurring {len(full):,} rows: build {t_full*1000:.0f}ms, add 1,000 rows {t_add*1000:.1f}ms, incremental parity OK; "
+          f"found {found}/{k} subscriptions ({fp} false), active {(a['状態'] == '継続中').sum()}, fixed_extra {y}-{m:02d} {rc.fixed_extra(y, m)}")
+
+def bench_search(n=500000, uniq=20000):
+    # 内容の索引。実データに近づけるため店名に支店・番号を付けて異なる文字列を uniq 件ほどにする
+    rng = np.random.default_rng(3)
+    names, _ = synth_shops(uniq)
+    tx = typed_tx(synth_sheet(n, cats=len(CATS)), cost_type)
+    tx['内容'] = names[rng.integers(0, uniq, n)]
+    xi, t_build = timed(lambda: TextIndex().sync(tx), rep=1)
+    h = n // 2; inc = TextIndex().sync(tx.iloc[:h]); _, t_add = timed(inc.add, tx.iloc[h:h+1000], rep=1); inc.add(tx.iloc[h+1000:])
+    def legacy(q):
+        m = tx['内容'].str.contains(q, case=False, regex=False)
+        return tx[m].groupby('内容', observed=True)['金額_数値'].agg(['size', 'sum'])
+    out = []
+    # 半角カナ・空白の揺れは索引側で吸収される（比較用の contains には正規化済みの文字列を渡す）
+    for q, mode, lq in (("amazon", "substr", "amazon"), ("電力", "substr", "電力"), ("ﾛｰｿﾝ渋谷", "substr", "ローソン 渋谷"), ("ユニ", "prefix", ""), ("東京電カ", "fuzzy", "")):
+        r, t = timed(xi.search, q, mode, 10**9)
+        if lq:
+            ref, t_ref = timed(legacy, lq)
+            assert len(r) == len(ref) and r['件数'].sum() == ref['size'].sum(), (q, len(r), len(ref))
+            out.append(f"{q} {len(r)}件 {t*1000:.2f}ms (contains+groupby {t_ref*1000:.0f}ms)")
+        else: out.append(f"{q}[{mode}] {len(r)}件 {t*1000:.2f}ms")
+    a = inc.search("東京", "substr", 10**9).sort_values('内容', ignore_index=True); b = xi.search("東京", "substr", 10**9).sort_values('内容', ignore_index=True)
+    pd.testing.assert_frame_equal(a, b)
+    print(f"search {n:,} rows / {len(xi.text):,} strings: build {t_build*1000:.0f}ms, add 1,000 rows {t_add*1000:.1f}ms, incremental parity OK; " + ", ".join(out))
+
+def bench_trends(n=500000, years=10):
+    # 推移の指標を pandas の groupby / rolling でカテゴリごとに作ったものと突き合わせる
+    t = monthly_totals(typed_tx(synth_sheet(n, years=years, cats=len(CATS)), cost_type))
+    tr, t_build = timed(Trends, t, rep=3)
+    def legacy():
+        ix = pd.period_range(f"{tr.years[0]}-01", f"{tr.years[-1]}-12", freq='M'); out = {}
+        e = t[t['支出'] > 0]
+        p = e.assign(p=pd.PeriodIndex.from_fields(year=e['年'], month=e['月'], freq='M')).pivot_table(index='p', columns='大項目', values='支出', aggfunc='sum', observed=True)
+        p = p.reindex(ix).fillna(0); p['合計'] = p.sum(axis=1)
+        for c in p.columns:
+            s = p[c]; d = {'支出': s}
+            for w in WINDOWS: d[f'{w}ヶ月平均'] = s.rolling(w, min_periods=1).mean()
+            d['例年同月'] = s.groupby(ix.month).transform(lambda g: g.expanding().mean().shift(1))
+            d['前年差'] = s.diff(12); d['年累計'] = s.groupby(ix.year).cumsum()
+            out[c] = pd.DataFrame(d).iloc[:tr.last + 1]
+        return out
+    ref, t_ref = timed(legacy, rep=1)
+    for c, r in ref.items():
+        a = tr.series(c).drop(columns='月')
+        np.testing.assert_allclose(a.to_numpy(), r.to_numpy(), rtol=1e-9, atol=1e-6, err_msg=str(c))
+    _, t_series = timed(lambda: [tr.series(c) for c in tr.cats] + [tr.year_curves(c) for c in tr.cats])
+    print(f"trends {len(t):,} month×category rows ({len(tr.years)} years, {len(tr.cats)} cats): build {t_build*1000:.1f}ms "
+          f"(groupby/rolling per category {t_ref*1000:.0f}ms), all series+curves {t_series*1000:.1f}ms, parity OK")
+
+def synth_balances(years=10, accounts=8, seed=0):
+    # 口座ごとの残高スナップショット（balances シート）。口座によって毎日・数日おき・月1回と記録の間隔を変える
+    rng = np.random.default_rng(seed + 5); out = []
+    kinds = ['銀行', '証券', 'iDeCo', 'カード']
+    for j in range(accounts):
+        step = (1, 3, 7, 30)[j % 4]; days = pd.date_range('2015-01-01', periods=365*years, freq='D')[rng.integers(0, step)::step]
+        bal = np.maximum(300_000*(j+1) + np.cumsum(rng.normal(500, 20_000, len(days))*step**0.5), 0).round()
+        out.append(pd.DataFrame({'Date': days.strftime('%Y-%m-%d'), 'Account': f"{kinds[j % 4]}{j}", 'Group': '', 'Balance': bal}))
+    return pd.concat(out, ignore_index=True).sample(frac=1, random_state=seed, ignore_index=True)
+
+def bench_balances(years=10, accounts=8):
+    # 口座ごとの配列から日・週・月に引き直したものを、pandas の pivot + reindex + ffill と突き合わせる
+    df = synth_balances(years, accounts)
+    csv = io.BytesIO(); df.to_csv(csv, index=False); _, t_read = timed(lambda: read_balances(io.BytesIO(csv.getvalue())), rep=1)
+    bl, t_build = timed(Balances, df)
+    def legacy(freq):
+        p = df.assign(Date=pd.to_datetime(df['Date'])).pivot_table(index='Date', columns='Account', values='Balance', aggfunc='last')
+        ix = pd.DatetimeIndex(bl.grid(freq).astype('datetime64[D]'))
+        return p.reindex(p.index.union(ix)).ffill().reindex(ix).fillna(0)[bl.acc]
+    out = []
+    for freq in ('D', 'W', 'M'):
+        r, t = timed(bl.frame, freq); ref, t_ref = timed(legacy, freq, rep=1)
+        np.testing.assert_allclose(r[bl.acc].to_numpy(), ref.to_numpy())
+        out.append(f"{freq} {len(r):,} points {t*1000:.1f}ms (pivot+ffill {t_ref*1000:.0f}ms)")
+    # 縦持ちで読めない残高（'abc'・'-'）の行は落ち、前の残高を引き継ぐ（0 の記録にならない）
+    bad = read_balances(io.BytesIO("日付,口座,残高\n2024-01-31,A,1000\n2024-02-29,A,-\n2024-03-31,A,abc\n2024-04-30,A,1200\n".encode('utf-8')))
+    assert bad['Date'].tolist() == ['2024-01-31', '2024-04-30'], bad
+    assert Balances(bad).monthly()['Total'].tolist() == [1000, 1000, 1000, 1200]
+    mb = sum(d.nbytes + v.nbytes for d, v in zip(bl.d, bl.v)) / 2**20
+    print(f"balances {len(df):,} snapshots / {len(bl.acc)} accounts ({mb:.2f}MB arrays): read csv {t_read*1000:.0f}ms, build {t_build*1000:.0f}ms, " + ", ".join(out) + ", parity OK")
+
+def bench_writes(saves=20, latency=0.05):
+    # フォームの保存を続けて行ったときに画面を止める時間。直接書くと1回ごとに全件書き直し、write-behind は積むだけで後でまとめて書く。
+    # 途中で 429 を2回返させて、再試行で最後の内容に揃うことも確かめる
+    h = synth_household(1000, years=2)
+    def store():
+        c = fake_gspread.Client(latency); s = GSheetStore(lambda: c, 'money_db', tempfile.mkdtemp(prefix='kakeibo-bench-'))
+        s.save(h['journal'], 'journal'); return c.open('money_db'), s
+    def edits(save, load):
+        t = 0.0
+        for i in range(saves):
+            dj = load('journal'); dj.loc[i % len(dj), 'Score'] = str(i)
+            t0 = time.perf_counter(); save(dj, 'journal'); t += time.perf_counter() - t0
+        return t
+    book, direct = store(); c0 = book.calls
+    t_direct, _ = timed(edits, direct.save, direct.load, rep=1); calls_direct = book.calls - c0
+    book2, base = store(); fail = [2]
+    class Quota(Exception): response = type('R', (), {'status_code': 429})()
+    def flaky(df, name):
+        if fail[0]: fail[0] -= 1; raise Quota('429')
+        return GSheetStore.save(base, df, name)
+    base.save = flaky
+    wb = WriteBehind(base, tempfile.mkdtemp(prefix='kakeibo-bench-')); c0 = book2.calls
+    t_queued, _ = timed(edits, wb.save, wb.load, rep=1)
+    ok = wb.flush(timeout=30); calls_queued = book2.calls - c0
+    pd.testing.assert_frame_equal(direct.load('journal'), base.load('journal'))
+    print(f"writes {saves} journal saves at {latency*1000:.0f}ms/API call: save() blocks {t_direct*1000:.0f}ms direct ({calls_direct} calls incl. reads) vs "
+          f"{t_queued*1000:.1f}ms write-behind ({calls_queued} calls, 2 quota retries, flushed={ok}), contents match")
+
+def bench_cache(n=100000, reruns=20, latency=0.02):
+    # 再実行ごとに5つのシートを読むときの時間。リビジョンで引くと、書き込んだシートの分だけ読み直す
+    h = synth_household(n, years=10); c = fake_gspread.Client(latency)
+    base = GSheetStore(lambda: c, 'money_db', tempfile.mkdtemp(prefix='kakeibo-bench-'))
+    base.save(sheet_rows(h['export']), 'transactions')
+    for t in ('budgets', 'assets', 'goals', 'journal'): base.save(h[t], t)
+    wb = WriteBehind(base, tempfile.mkdtemp(prefix='kakeibo-bench-')); rc = RevCache()
+    loads = {'transactions': lambda: wb.sync('transactions', lambda d: typed_tx(d, cost_type), 2), 'budgets': lambda: wb.load('budgets'),
+             'assets': lambda: wb.load('assets'), 'goals': lambda: wb.load('goals'), 'journal': lambda: wb.load('journal')}
+    def rerun(cached):
+        return {k: rc.get(k, wb.rev(k), f) if cached else f() for k, f in loads.items()}
+    def session(cached):
+        for i in range(reruns):
+            if i == reruns // 2:
+                dj = rerun(cached)['journal']; wb.save(dj.assign(Score='5'), 'journal')
+            rerun(cached)
+    _, t_plain = timed(session, False, rep=1)
+    rerun(True); m0 = rc.misses
+    _, t_cached = timed(session, True, rep=1)
+    miss = rc.misses - m0
+    assert miss == 1, miss  # 振り返りの保存で作り直すのは journal だけ
+    wb.flush(); small = RevCache(max_entries=3)
+    for k, f in loads.items(): small.get(k, wb.rev(k), f)
+    assert list(small.d) == ['assets', 'goals', 'journal']
+    print(f"cache {reruns} reruns x 5 sheets ({n:,} tx, {latency*1000:.0f}ms/API call): uncached {t_plain*1000:.0f}ms, revision-keyed {t_cached*1000:.0f}ms "
+          f"({miss} rebuild after a journal save, transactions kept), {len(rc.d)} entries {rc.bytes/2**20:.1f}MB, LRU bound OK")
+
+def legacy_forecast(da, target_date, today):
+    # 以前のゴール予測（ゴールごとに relativedelta で1ヶ月ずつ進める）
+    tots=da['Total'].values; avg=np.mean(np.diff(tots))
+    lt=tots[-1]; lm=da.iloc[-1]['Month']
+    try: tdt=datetime.strptime(str(target_date)[:10],'%Y-%m-%d')
+    except: tdt=datetime(today.year+5,12,31)
+    mah=min(max((tdt.year-today.year)*12+(tdt.month-today.month),12),240)
+    fm2,fv2=[],[]; cur=lt; base=datetime.strptime(lm+"-01",'%Y-%m-%d')
+    for i in range(1,mah+1):
+        nd=base+relativedelta(months=i); fm2.append(nd.strftime('%Y-%m')); cur+=avg; fv2.append(max(cur,0))
+    return avg, fm2, fv2
+
+def bench_projection(goals=20, years=10):
+    h = synth_household(100, years); da = h['assets']; today = datetime.today()
+    dg = pd.DataFrame({'GoalName': [f'g{i}' for i in range(goals)], 'TargetAmount': np.linspace(5e6, 8e7, goals),
+                       'TargetDate': [f'{today.year + 1 + i % 25}-{1 + i % 12:02d}-01' for i in range(goals - 1)] + ['不明']})
+    ref, t_ref = timed(lambda: [legacy_forecast(da, g, today) for g in dg['TargetDate']])
+    pj, t_vec = timed(Projection, da, dg, today)
+    for i, (avg, fm, fv) in enumerate(ref):
+        m, v, _ = pj.goal(i)
+        assert m == fm and avg == pj.pace; np.testing.assert_array_equal(v, fv)
+    mc = {p: timed(lambda: Projection(da, dg, today, 'montecarlo', paths=p), rep=1)[1] for p in (1000, 10000)}
+    print(f"projection {goals} goals: loop {t_ref*1000:.1f}ms / vectorized {t_vec*1000:.2f}ms (x{t_ref/t_vec:.0f}), parity OK; "
+          + ", ".join(f"montecarlo {p:,} paths {t*1000:.0f}ms" for p, t in mc.items()))
+
+def bench_charts(years=20):
+    # 月末資産 years 年分と、モンテカルロの帯つきゴールのグラフを、間引き・型付き配列の有無で比べる
+    h = synth_household(100, years); da = h['assets']; today = datetime.today()
+    dg = pd.DataFrame({'GoalName': ['g'], 'TargetAmount': [1e8], 'TargetDate': [f'{today.year + 20}-12-01']})
+    pj = Projection(da, dg, today, 'montecarlo'); fm, fv, band = pj.goal(0)
+    figs = {'assets': lambda slim: charts.assets(da, slim),
+            'goal': lambda slim: charts.goal(da['Month'], da['Total'], fm, fv, band, 1e8, '予測', '目標', slim)}
+    for name, build in figs.items():
+        out = {}
+        for slim in (False, True):
+            f, t = timed(build, slim, rep=3)
+            out[slim] = (charts.nbytes(f), t)
+            if slim: assert f.data[0].x[0] == da['Month'].iloc[0] and f.data[-1].x[-1] == (fm[-1] if name == 'goal' else da['Month'].iloc[-1])
+        (b0, t0), (b1, t1) = out[False], out[True]
+        print(f"chart {name} ({len(da)} months{f' + {len(fm)} forecast' if name == 'goal' else ''}): "
+              f"{b0/1024:.1f}KB {t0*1000:.1f}ms -> slim {b1/1024:.1f}KB {t1*1000:.1f}ms ({1-b1/b0:.0%} smaller)")
+
+def bench_ai(months=24, workers=4, limit=3, latency=0.2):
+    # ローカルの Messages API スタブ（同時 limit 件を超えると 429）に対して、直列と並行バッチを比べる
+    srv = serve_stub(0, latency=latency, limit=limit); threading.Thread(target=srv.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{srv.server_address[1]}"; tmp = tempfile.mkdtemp(prefix='kakeibo-ai-')
+    try:
+        prompts = {f"{2020 + i // 12}-{i % 12 + 1:02d}": f"{2020 + i // 12}年{i % 12 + 1}月の家計データ\n..." for i in range(months)}
+        out = {}
+        for w in (1, workers):
+            adv = Advisor("stub", os.path.join(tmp, f"c{w}.json"), base_url=url)
+            srv.state.update(peak=0, requests=0, limited=0)
+            t0 = time.perf_counter(); res = list(adv.batch(prompts, workers=w, backoff=0.05)); out[w] = time.perf_counter() - t0
+            assert sorted(k for k, _, _ in res) == sorted(prompts) and all(e is None for *_, e in res), [e for *_, e in res if e]
+            assert all(k[:4] in r for k, r, _ in res) and srv.state['peak'] <= limit
+            print(f"ai batch {months} months, workers={w}: {out[w]*1000:.0f}ms "
+                  f"(requests {srv.state['requests']}, 429 {srv.state['limited']}, peak concurrency {srv.state['peak']})")
+            t0 = time.perf_counter(); list(adv.batch(prompts, workers=w))
+        print(f"ai batch: x{out[1]/out[workers]:.1f} with {workers} workers, cached rerun {(time.perf_counter()-t0)*1000:.1f}ms")
+    finally:
+        srv.shutdown(); shutil.rmtree(tmp, ignore_errors=True)
+
+# ==========================================
+# 家計データ一式での通しベンチマーク（メモリ上の gspread に対して）
+# ==========================================
+def synth_household(n, years=10, cats=len(CATS), seed=0):
+    # 取引のほか、予算・月末資産・ゴール・振り返りをそれらしく作る
+    rng = np.random.default_rng(seed + 1)
+    months = pd.period_range('2015-01', periods=12*years, freq='M').strftime('%Y-%m')
+    bank = np.maximum(1_000_000 + np.cumsum(rng.normal(30_000, 80_000, len(months))), 0).round()
+    sec = np.maximum(500_000 + np.cumsum(rng.normal(40_000, 150_000, len(months))), 0).round()
+    ide = (np.arange(len(months)) * 23_000).astype(float); oth = np.full(len(months), 200_000.0)
+    return dict(
+        export=synth_export(n, seed, years, cats),
+        budgets=pd.DataFrame({'Category': CATS[:cats], 'Budget': rng.integers(1, 20, cats) * 5000}),
+        assets=pd.DataFrame({'Month': months, 'Bank': bank, 'Securities': sec, 'iDeCo': ide, 'Other': oth, 'Total': bank+sec+ide+oth}),
+        goals=pd.DataFrame({'GoalName': ['老後資金', '住宅頭金', '教育費'], 'TargetAmount': [50_000_000, 8_000_000, 15_000_000],
+                            'TargetDate': ['2045-01-01', '2030-06-01', '2038-04-01']}),
+        journal=pd.DataFrame({'Month': months, 'Comment': '外食が多かった。来月は自炊を増やしたい。', 'Score': rng.integers(1, 11, len(months))}),
+    )
+
+class Stages:
+    # ステージごとの時間（ms）・ピークメモリ（MB, tracemalloc）・API 呼び出し数
+    def __init__(self, book, mem):
+        self.book, self.mem, self.out = book, mem, {}
+
+    def __call__(self, name, f, *a):
+        c0 = self.book.calls
+        if self.mem:
+            base = tracemalloc.get_traced_memory()[0]; tracemalloc.reset_peak()
+        t0 = time.perf_counter(); r = f(*a); ms = (time.perf_counter() - t0) * 1000
+        row = self.out.setdefault(name, {})
+        if self.mem: row['peak_mb'] = (tracemalloc.get_traced_memory()[1] - base) / 2**20
+        else: row.update(ms=ms, calls=self.book.calls - c0)
+        return r
+
+def run_suite(h, mem=False):
+    cache = tempfile.mkdtemp(prefix='kakeibo-bench-')
+    client = fake_gspread.Client(); book = client.open('money_db')
+    store = GSheetStore(lambda: client, 'money_db', cache)
+    parse = lambda d: typed_tx(d, cost_type)
+    st = Stages(book, mem)
+    if mem: tracemalloc.start()
+    try:
+        ex = h['export']; k = len(ex) // 2; extra = max(len(ex) // 100, 1)
+        raw = sheet_rows(ex.iloc[:k])
+        st('seed', lambda: [store.save(raw, 'transactions')] + [store.save(h[t], t) for t in ('budgets', 'assets', 'goals', 'journal')])
+        st('prefetch', store.prefetch)
+        st('load_tx (full)', store.sync, 'transactions', parse, 2)
+        st('load_tx (hit)', store.sync, 'transactions', parse, 2)
+        store.append(sheet_rows(ex.iloc[k:k+extra]), 'transactions')
+        tx = st('load_tx (delta)', store.sync, 'transactions', parse, 2)
+        def misc():
+            b = store.load('budgets'); b['Budget'] = parse_yen(b['Budget'])
+            a = store.load('assets')
+            for c in ['Bank', 'Securities', 'iDeCo', 'Other', 'Total']: a[c] = parse_yen(a[c])
+            g = store.load('goals'); g['TargetAmount'] = parse_yen(g['TargetAmount'])
+            return b, a.sort_values('Month'), g, store.load('journal')
+        _, da, dg, dj = st('load budgets/assets/goals/journal', misc)
+        # 前半と重なる行・新しい行が半々のエクスポートを取り込む
+        buf = io.BytesIO(ex.iloc[k//2:].to_csv(index=False).encode('utf-8-sig'))
+        def imp():
+            for *_, n in import_export(buf, tx, lambda d: store.append(d, 'transactions'), lambda d: store.update_rows(d, 'transactions')): pass
+            return n
+        n = st('import (dedup)', imp)
+        tx = st('load_tx (after import)', store.sync, 'transactions', parse, 2)
+        cube = st('aggregate (monthly_totals + Cube)', lambda: Cube(monthly_totals(tx), cost_type))
+        tr = st('budget tracker (build)', lambda: BudgetTracker().sync(tx))
+        st('budget tracker (add 1 row + sync)', lambda: tr.add(tx.iloc[:1]) or tr.sync(pd.concat([tx, tx.iloc[:1]])))
+        bs = h['budgets'].set_index('Category')['Budget']
+        st('budget burn + history', lambda: (tr.burn(*divmod(max(tr.mi), 100), bs, 15), tr.history(bs)))
+        ym = [(y, m) for y in cube.years() for m in cube.months(y)]
+        def dash():
+            for y, m in ym:
+                cube.month(y, m); cube.month(y-1, m); cube.cats(y, m); cube.fixed_var(y, m)
+                cube.year_months(y); cube.year_cats(y); cube.exp_months(y)
+        st(f'dashboard x{len(ym)} months', dash)
+        st(f'build_prompt x{len(ym)}', lambda: [build_prompt(y, m, cube, dj) for y, m in ym])
+        today = datetime.today()
+        st(f'projection linear x{len(dg)} goals', Projection, da, dg, today)
+        st('projection montecarlo 10k paths', Projection, da, dg, today, 'montecarlo')
+    finally:
+        if mem: tracemalloc.stop()
+        shutil.rmtree(cache, ignore_errors=True)
+    return st.out, n, len(tx)
+
+def bench_suite(n, years, cats, mem=True, log=None):
+    h = synth_household(n, years, cats)
+    out, imp, total = run_suite(h)
+    if mem:
+        for k, v in run_suite(h, mem=True)[0].items(): out[k].update(v)
+    print(f"\nsuite {n:,} rows / {years} years / {cats} categories  (import: new {imp['new']:,}, upd {imp['upd']:,}, skip {imp['skip']:,}; {total:,} rows after)")
+    print(f"  {'stage':<36}{'ms':>10}{'peak MB':>10}{'API':>6}")
+    for k, v in out.items():
+        print(f"  {k:<36}{v['ms']:>10.1f}{v.get('peak_mb', float('nan')):>10.1f}{v['calls']:>6}")
+    if log:
+        with open(log, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(at=datetime.now().isoformat(timespec='seconds'), rows=n, years=years, cats=cats,
+                                    stages={k: {m: round(x, 2) for m, x in v.items()} for k, v in out.items()}), ensure_ascii=False) + '\n')
+    return out
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--rows', type=int, nargs='+', default=[100000])
+    ap.add_argument('--suite', action='store_true', help='家計データ一式で読み込み〜集計〜予測まで通しで測る')
+    ap.add_argument('--years', type=int, default=10)
+    ap.add_argument('--cats', type=int, default=len(CATS))
+    ap.add_argument('--no-mem', action='store_true', help='ピークメモリの計測（2周目）を省く')
+    ap.add_argument('--json', help='結果を JSONL で追記するファイル')
+    ap.add_argument('--ai', action='store_true', help='AI のまとめて分析をローカルのスタブで測る')
+    ap.add_argument('--months', type=int, default=24)
+    a = ap.parse_args()
+    if a.ai: bench_ai(a.months); raise SystemExit
+    for n in a.rows:
+        if a.suite: bench_suite(n, a.years, min(a.cats, len(CATS)), not a.no_mem, a.json)
+        else: bench_parse(n); bench_schema(n); bench_explore(n); bench_search(n); bench_categorize(); bench_recurring(n); bench_trends(n); bench_balances(); bench_writes(); bench_cache(n); bench_projection(); bench_charts()
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+from data import Incremental
+from search import norm, grams
+from prof import staged
+
+# ==========================================
+# 大項目の自動分類
+# ==========================================
+# 分類済みの履歴から学ぶ。まず「この内容はいつもこのカテゴリ」という店名ルールを引き、当たらなければ
+# 文字 n-gram（＋金額の符号・決済元）のナイーブベイズで推す。どちらも件数の足し算なので、取引の追記は add() で足すだけ
+UNSET = {'', '未分類'}
+BUCKETS = 1 << 16  # n-gram はハッシュでこの数に畳む
+RULE_MIN, RULE_PURITY = 2, 0.9  # 店名ルールにする条件（件数・同じカテゴリの割合）
+
+def _keys(df):
+    # 分類の単位（正規化した内容, 金額の符号, 決済元）。同じ組は1回だけ計算する
+    bk = df['保有金融機関'].fillna('').astype(str) if '保有金融機関' in df.columns else pd.Series('', index=df.index)
+    c = df['内容'].fillna('').astype(str); u = c.unique()
+    return pd.DataFrame({'t': c.map(dict(zip(u, map(norm, u)))).to_numpy(object),
+                         's': np.where(df['金額_数値'].to_numpy(float) > 0, '+', '-'), 'b': bk.to_numpy(object)})
+
+def _hash(g): return hash(g) % BUCKETS  # hash() はプロセスごとに変わるので、モデルはメモリ上だけで使う（保存しない）
+
+class Categorizer(Incremental):
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        super().__init__()
+
+    def _clear(self):
+        self.ci, self.cats = {}, []
+        self.F = np.zeros((0, BUCKETS), np.float32); self.N = np.zeros(0)
+        self.rules = {}; self.tf = {}; self._w = None
+
+    def _feats(self, t, s, b):
+        f = self.tf.get(t)
+        if f is None: f = self.tf[t] = [_hash(g) for g in grams(t)]
+        return f + [_hash('$' + s), _hash('@' + b)]
+
+    def _rule(self, t):
+        # 店名ルール -> (カテゴリ, 割合) or None
+        r = self.rules.get(t)
+        if not r: return None
+        c, m = max(r.items(), key=lambda x: x[1]); tot = sum(r.values())
+        return (c, m/tot) if tot >= RULE_MIN and m/tot >= RULE_PURITY else None
+
+    @staged('aggregate')
+    def _fold(self, tx):
+        c = tx['大項目'].fillna('').astype(str).to_numpy(object); ok = ~pd.Series(c).isin(UNSET).to_numpy()
+        if not ok.any(): return
+        k = _keys(tx[ok]).assign(c=c[ok])
+        for u in pd.unique(k['c']):
+            if u not in self.ci: self.ci[u] = len(self.cats); self.cats.append(u)
+        C = len(self.cats)
+        if self.F.shape[0] < C:
+            self.F = np.pad(self.F, ((0, C - self.F.shape[0]), (0, 0))); self.N = np.pad(self.N, (0, C - len(self.N)))
+        g = k.groupby(['t', 's', 'b', 'c'], sort=False).size()
+        for (t, sg, b, cat), m in g.items():
+            i = self.ci[cat]
+            np.add.at(self.F[i], self._feats(t, sg, b), m)
+            self.N[i] += m
+            r = self.rules.setdefault(t, {}); r[cat] = r.get(cat, 0) + m
+        self._w = None
+
+    def _weights(self):
+        # log P(特徴 | カテゴリ)（加法スムージング）と log P(カテゴリ)。(BUCKETS, C) にして特徴で行を引く
+        if self._w is None:
+            F = self.F.astype(float) + self.alpha
+            self._w = (np.ascontiguousarray((np.log(F) - np.log(F.sum(axis=1, keepdims=True))).T), np.log(self.N / self.N.sum()))
+        return self._w
+
+    @staged('classify')
+    def predict(self, df):
+        # 行ごとの (候補, 確度, 根拠)。学習データが無ければ候補は空
+        out = pd.DataFrame({'候補': '', '確度': 0.0, '根拠': ''}, index=df.index)
+        with self.lock:
+            if df.empty or not self.cats: return out
+            k = _keys(df); inv = pd.factorize(k['t'] + '\x00' + k['s'] + '\x00' + k['b'])[0]
+            first = np.unique(inv, return_index=True)[1]
+            uk = k.iloc[first]; U = len(uk)
+            cat = np.empty(U, object); conf = np.zeros(U); src = np.full(U, '学習', object)
+            rule = {t: self._rule(t) for t in pd.unique(uk['t'])}; need = []
+            for j, t in enumerate(uk['t']):
+                r = rule[t]
+                if r: cat[j], conf[j], src[j] = r[0], r[1], 'ルール'
+                else: need.append(j)
+            if need:
+                # 特徴をまとめて引いて文字列ごとに足す（reduceat）、softmax で確度にする
+                WT, prior = self._weights()
+                fs = [self._feats(t, s, b) for t, s, b in uk.iloc[need][['t', 's', 'b']].itertuples(index=False)]
+                starts = np.r_[0, np.cumsum([len(f) for f in fs])[:-1]]
+                S = np.add.reduceat(WT[np.concatenate(fs)], starts, axis=0) + prior
+                S -= S.max(axis=1, keepdims=True); P = np.exp(S); P /= P.sum(axis=1, keepdims=True)
+                b = P.argmax(axis=1)
+                cat[need] = np.array(self.cats, object)[b]; conf[need] = P[np.arange(len(b)), b]
+            out['候補'] = cat[inv]; out['確度'] = conf[inv]; out['根拠'] = src[inv]
+        return out
+
+    def fill(self, df, threshold=0.8):
+        # 大項目が未設定（空・未分類）で確度が threshold 以上の行だけ候補で埋める -> (埋めた df, 件数)
+        if df.empty or '大項目' not in df.columns: return df, 0
+        todo = df['大項目'].fillna('').astype(str).isin(UNSET).to_numpy()
+        if not todo.any(): return df, 0
+        p = self.predict(df[todo]); ok = (p['確度'] >= threshold).to_numpy() & (p['候補'] != '').to_numpy()
+        if not ok.any(): return df, 0
+        df = df.copy(); ix = np.flatnonzero(todo)[ok]
+        df['大項目'] = df['大項目'].astype(object)
+        df.iloc[ix, df.columns.get_loc('大項目')] = p['候補'].to_numpy()[ok]
+        return df, int(ok.sum())
@@ -0,0 +1,136 @@
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+
+# ==========================================
+# グラフ（Streamlit に依存しない組み立て部分）
+# ==========================================
+# Japandi palette for Plotly
+C_MOSS = '#7a9466'
+C_TERRACOTTA = '#d4895e'
+C_INK = '#1a1a1a'
+C_INK_LIGHT = 'rgba(26,26,26,0.55)'
+C_STONE = '#8c8578'
+C_BORDER = '#ddd8d0'
+C_BG = '#f7f6f3'
+C_BG_WARM = '#f0eee9'
+
+CHART_LAYOUT = dict(
+    margin=dict(l=0, r=0, t=10, b=0),
+    plot_bgcolor='rgba(0,0,0,0)',
+    paper_bgcolor='rgba(0,0,0,0)',
+    font=dict(family="DM Sans, Noto Sans JP, sans-serif", size=12, color="#5c5c5c"),
+)
+
+CHART_LEGEND = dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1, font=dict(size=11))
+
+PIE_COLORS = [C_INK_LIGHT, C_MOSS, C_TERRACOTTA, C_STONE, C_BORDER, 'rgba(26,26,26,0.25)', 'rgba(140,133,120,0.5)', '#b8a99a', '#8a9e7a', '#c4a882', '#9a8e82', '#7a7267', '#bfb5a8', '#a09486', '#8c8578', '#706b64', '#5c5c5c']
+ASSET_COLS = [('Bank','銀行・現金',C_MOSS),('Securities','証券',C_TERRACOTTA),('iDeCo','iDeCo',C_STONE),('Other','その他',C_BORDER)]
+MAX_POINTS = 120
+TREND_COLORS = [C_TERRACOTTA, C_MOSS, C_INK_LIGHT, C_STONE]
+
+# ==========================================
+# 送る量を減らす
+# ==========================================
+# 画面幅に対して点が多すぎる系列は等間隔に間引く（最初と最後の点は必ず残す）。
+# 値は円単位に丸めて int32 の numpy 配列にすると、plotly が JSON の数値列ではなく base64 の型付き配列で書き出すので小さくなる
+def thin(n, cap=MAX_POINTS):
+    if n <= cap: return np.arange(n)
+    ix = np.arange(0, n, -(-n // cap))
+    return ix if ix[-1] == n-1 else np.r_[ix, n-1]
+
+def compact(v):
+    a = np.asarray(v, float)
+    if np.isfinite(a).all() and (np.abs(a) < 2**31).all(): return np.rint(a).astype(np.int32)
+    return a
+
+def _pick(v, ix): return [v[i] for i in ix] if isinstance(v, list) else np.asarray(v)[ix]
+
+def dtick(n): return max(1, n//12)
+
+def nbytes(fig):
+    # ブラウザに送る JSON のバイト数（st.plotly_chart と同じ書き出し方）
+    return len(fig.to_json(validate=False).encode('utf-8'))
+
+# ==========================================
+# 各グラフ
+# ==========================================
+def year_bars(dfc, cm):
+    f = px.bar(dfc, x='月', y='金額', color='種別', barmode='group', color_discrete_map=cm)
+    f.update_layout(**CHART_LAYOUT, legend=CHART_LEGEND, height=320, xaxis=dict(dtick=1, title=""), yaxis=dict(title="", gridcolor=C_BORDER, gridwidth=0.5))
+    f.update_xaxes(ticksuffix="月")
+    return f
+
+def cat_pie(cd):
+    f = px.pie(cd, values='AbsAmount', names='大項目', hole=0.5, color_discrete_sequence=PIE_COLORS[:len(cd)])
+    f.update_layout(**CHART_LAYOUT, height=320, showlegend=True,
+        legend=dict(orientation="v", yanchor="middle", y=0.5, xanchor="left", x=1.02, font=dict(size=10)))
+    f.update_traces(textposition='inside', textinfo='percent', textfont_size=10)
+    return f
+
+def month_compare(chd):
+    f = px.bar(chd, x='カテゴリ', y='金額', color='種別', barmode='group', color_discrete_map={'今月':C_TERRACOTTA,'年平均':C_BORDER})
+    f.update_layout(**CHART_LAYOUT, legend=CHART_LEGEND, height=280, xaxis=dict(title=""), yaxis=dict(title="", gridcolor=C_BORDER, gridwidth=0.5))
+    return f
+
+def assets(da, slim=True):
+    ix = thin(len(da)) if slim else np.arange(len(da))
+    x = da['Month'].astype(str).to_numpy()[ix].tolist()
+    f = go.Figure()
+    for col, nm, clr in ASSET_COLS:
+        y = da[col].to_numpy(float)[ix]
+        f.add_trace(go.Scatter(x=x, y=compact(y) if slim else y, mode='lines', stackgroup='one', name=nm, line=dict(width=0.5), fillcolor=clr))
+    f.update_layout(**CHART_LAYOUT, legend=CHART_LEGEND, height=350, xaxis=dict(type='category',title=""), yaxis=dict(title="",gridcolor=C_BORDER,gridwidth=0.5))
+    return f
+
+def goal(hm, hv, fm, fv, band, target, name, label, slim=True):
+    # hm/hv: 実績の月と総資産、fm/fv: 予測の月と中央値、band: {分位点: 値} or None
+    hm, fm = list(hm), list(fm)
+    hv, fv = np.asarray(hv, float), np.asarray(fv, float)
+    lm, lt = hm[-1], hv[-1]
+    hi_, fi = (thin(len(hm)), thin(len(fm))) if slim else (np.arange(len(hm)), np.arange(len(fm)))
+    y = compact if slim else (lambda v: v)
+    xs = [lm] + _pick(fm, fi)
+    f = go.Figure()
+    f.add_trace(go.Scatter(x=_pick(hm, hi_), y=y(hv[hi_]), mode='lines+markers', name='実績', line=dict(color=C_MOSS,width=3), marker=dict(size=6 if len(hi_) <= 60 else 3)))
+    if band:
+        # 5–95% と 25–75% の帯（扇形）
+        for lo, hi, op in ((5,95,0.12),(25,75,0.25)):
+            f.add_trace(go.Scatter(x=xs, y=y(np.r_[lt, np.asarray(band[hi])[fi]]), mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'))
+            f.add_trace(go.Scatter(x=xs, y=y(np.r_[lt, np.asarray(band[lo])[fi]]), mode='lines', line=dict(width=0), fill='tonexty', fillcolor=f'rgba(122,148,102,{op})', name=f'{lo}–{hi}%'))
+    f.add_trace(go.Scatter(x=xs, y=y(np.r_[lt, fv[fi]]), mode='lines', name=name, line=dict(color=C_MOSS,width=2,dash='dash')))
+    f.add_hline(y=target, line_dash="dot", line_color=C_TERRACOTTA, annotation_text=label, annotation_position="top left")
+    f.update_layout(**CHART_LAYOUT, legend=CHART_LEGEND, height=380, xaxis=dict(type='category',title="",tickangle=-45,dtick=dtick(len(hi_)+len(xs))), yaxis=dict(title="",gridcolor=C_BORDER,gridwidth=0.5))
+    return f
+
+def trend(dt, cols):
+    # dt: Trends.series() の結果。月ごとの支出を棒で、cols の指標（移動平均・例年同月）を線で重ねる
+    ix = thin(len(dt)); x = dt['月'].to_numpy()[ix].tolist()
+    f = go.Figure()
+    f.add_trace(go.Bar(x=x, y=compact(dt['支出'].to_numpy(float)[ix]), name='支出', marker_color=C_BORDER))
+    for c, clr in zip(cols, TREND_COLORS):
+        f.add_trace(go.Scatter(x=x, y=compact(dt[c].to_numpy(float)[ix]), mode='lines', name=c, line=dict(color=clr, width=2, dash='dot' if c == '例年同月' else 'solid')))
+    f.update_layout(**CHART_LAYOUT, legend=CHART_LEGEND, height=340, xaxis=dict(type='category',title="",tickangle=-45,dtick=dtick(len(ix))), yaxis=dict(title="",gridcolor=C_BORDER,gridwidth=0.5))
+    return f
+
+def year_curves(yc):
+    # yc: Trends.year_curves() の結果（行: 年、列: 月）。今年と前年は色を付け、それより前は薄く
+    f = go.Figure(); ys = list(yc.index)
+    for y in ys:
+        k = ys[-1] - y; clr = C_TERRACOTTA if k == 0 else C_MOSS if k == 1 else C_STONE
+        f.add_trace(go.Scatter(x=list(range(1, 13)), y=compact(yc.loc[y].to_numpy(float)), mode='lines', name=f"{y}年",
+                               line=dict(color=clr, width=3 if k < 2 else 1), opacity=1 if k < 2 else 0.45))
+    f.update_layout(**CHART_LAYOUT, legend=CHART_LEGEND, height=340, xaxis=dict(dtick=1,title="",ticksuffix="月"), yaxis=dict(title="",gridcolor=C_BORDER,gridwidth=0.5))
+    return f
+
+def balances(db):
+    # db: Balances.frame() の結果（index: 日付、列: 口座または種別＋Total）。内訳を積み上げ、合計を線で重ねる
+    ix = thin(len(db)); x = db.index[ix].strftime('%Y-%m-%d').tolist()
+    names = {k: (nm, clr) for k, nm, clr in ASSET_COLS}
+    f = go.Figure()
+    for i, c in enumerate(c for c in db.columns if c != 'Total'):
+        nm, clr = names.get(c, (c, PIE_COLORS[i % len(PIE_COLORS)]))
+        f.add_trace(go.Scatter(x=x, y=compact(db[c].to_numpy(float)[ix]), mode='lines', stackgroup='one', name=nm, line=dict(width=0.5), fillcolor=clr))
+    f.add_trace(go.Scatter(x=x, y=compact(db['Total'].to_numpy(float)[ix]), mode='lines', name='合計', line=dict(color=C_INK, width=1.5)))
+    f.update_layout(**CHART_LAYOUT, legend=CHART_LEGEND, height=350, xaxis=dict(type='category',title="",tickangle=-45,dtick=dtick(len(ix))), yaxis=dict(title="",gridcolor=C_BORDER,gridwidth=0.5))
+    return f
@@ -0,0 +1,357 @@
+import zipfile, threading
+import numpy as np
+import pandas as pd
+from prof import staged
+
+TX_COLS = ['日付','内容','金額（円）','保有金融機関','大項目','中項目','年','月','金額_数値','AbsAmount']
+# typed_tx のフレームの形が変わったら上げる（ローカルキャッシュを作り直させる）
+SCHEMA_VERSION = 2
+
+# ==========================================
+# 金額パース
+# ==========================================
+def cc(x):
+    if isinstance(x, str):
+        s = x.replace(',','').replace('¥','').replace('\\','').replace('▲','-').strip()
+        try: return float(s)
+        except: return 0
+    return float(x) if x else 0
+
+def _num(s):
+    try: return float(s)
+    except: return 0
+
+_NUM = r'[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?'
+
+@staged('parse')
+def parse_yen(col):
+    # cc() を列単位で。Arrow 文字列上で記号を落とし、素直な数値表記だけ一括で float にし、それ以外はユニーク値ごとに float() で読み直して結果を揃える
+    if pd.api.types.is_numeric_dtype(col): return col.astype(float)
+    s = col.astype(str).astype('string[pyarrow]').fillna('nan')
+    for a, b in ((',', ''), ('¥', ''), ('\\', ''), ('▲', '-')): s = s.str.replace(a, b, regex=False)
+    s = s.str.strip()
+    ok = s.str.fullmatch(_NUM).astype(bool)
+    r = s.where(ok).astype(float)
+    if not ok.all():
+        u = s[~ok]
+        r[~ok] = u.map({v: _num(v) for v in pd.unique(u)})
+    return r
+
+def _dates(col):
+    # シートには "2024-01-05" と "2024-01-05 00:00:00"、CSV には "2024/01/05" が混ざる。to_datetime は先頭の書式で
+    # 全体を読むので、読めなかった値だけユニーク値ごとに書式を推測し直す
+    d = pd.to_datetime(col, errors='coerce')
+    if pd.api.types.is_datetime64_any_dtype(col): return d
+    bad = d.isna() & col.notna() & (col.astype(str).str.strip() != '')
+    if bad.any():
+        u = pd.unique(col[bad])
+        d[bad] = col[bad].map(dict(zip(u, pd.to_datetime(pd.Series(u), errors='coerce', format='mixed'))))
+    return d
+
+def _text(df, c):
+    return df[c].fillna('').astype(str) if c in df.columns else pd.Series('', index=df.index)
+
+def _fingerprint(d, c, a, i):
+    k = pd.DataFrame({'d': d.values.astype('datetime64[D]').astype('int64'), 'c': c.str.strip(), 'a': a, 'i': i.str.strip()})
+    return pd.util.hash_pandas_object(k, index=False).values
+
+def _yen(df):
+    return parse_yen(df['金額_数値'] if '金額_数値' in df.columns else df['金額（円）']).fillna(0).round().astype('int64')
+
+FP_COLS = ('日付', '内容', '金額_数値', '保有金融機関')  # 指紋に入っている列
+
+def tx_fingerprint(df):
+    # 取引の指紋（日付・内容・金額・金融機関の uint64 ハッシュ）
+    return _fingerprint(_dates(df['日付']), _text(df, '内容'), _yen(df), _text(df, '保有金融機関'))
+
+def fp_index(cur):
+    # 既存の指紋 -> cur の行位置（同じ指紋は後の行）。取り込み1回につき1回だけ作り、plan_import が追加した行の指紋を -1 で足していく
+    return dict(zip(cur['_fp'].tolist(), range(len(cur)))) if not cur.empty and '_fp' in cur.columns else {}
+
+def plan_import(new, cur, cols=('大項目','中項目'), ix=None):
+    # 取込行を既存の指紋と突き合わせる。既存側は読み込み時に計算済みの _fp / _row を使うので、見るのは取込行だけ
+    # ix（fp_index）を渡すと、追加する行の指紋をそこに足す（後のチャンクに同じ取引があればスキップになる）
+    # -> (追加する行, 書き換える行（_row 付き）, スキップ件数)
+    fp = tx_fingerprint(new); last = ~pd.Series(fp).duplicated(keep='last').values
+    new, fp = new[last], fp[last]; skip = int((~last).sum())
+    if ix is None: ix = fp_index(cur)
+    pos = np.fromiter((ix.get(x, -2) for x in fp.tolist()), np.int64, len(fp))
+    hit, add = pos >= 0, pos == -2
+    old = cur.iloc[pos[hit]]; got = new[hit]
+    cols = [c for c in cols if c in got.columns and c in old.columns]
+    diff = np.zeros(len(got), dtype=bool)
+    for c in cols: diff |= got[c].fillna('').astype(str).values != old[c].fillna('').astype(str).values
+    upd = got[diff].assign(_row=old['_row'].values[diff])
+    ix.update(dict.fromkeys(fp[add].tolist(), -1))
+    return new[add], upd, skip + int((~diff).sum()) + int((pos == -1).sum())
+
+@staged('parse')
+def typed_tx(df, cost_type):
+    # シートの生の行 -> メモリ上の取引フレーム。金額は整数円、種類の少ない列はカテゴリ、年月は小さい整数。
+    # 金額（円）・AbsAmount は持たない（tx_rows で作り直す）。日付の読めない行は落とす
+    out = pd.DataFrame({'日付': _dates(df['日付'])}, index=df.index)
+    out['内容'] = _text(df, '内容')
+    out['金額_数値'] = _yen(df)
+    for c in ('大項目','中項目','保有金融機関'): out[c] = _text(df, c).astype('category')
+    out['費用タイプ'] = out['大項目'].map(cost_type).astype('category')
+    out['_fp'] = _fingerprint(out['日付'], out['内容'], out['金額_数値'], _text(df, '保有金融機関'))
+    if '_row' in df.columns: out['_row'] = df['_row'].astype('int64')
+    out = out[out['日付'].notna()]
+    out['年'] = out['日付'].dt.year.astype('int16'); out['月'] = out['日付'].dt.month.astype('int8')
+    return out
+
+def tx_rows(df):
+    # 型付きフレーム -> シートに書く TX_COLS。金額（円）・AbsAmount はここで作り直す
+    v = df['金額_数値']
+    return pd.DataFrame({'日付': df['日付'], '内容': df['内容'], '金額（円）': v.astype(str), '保有金融機関': df['保有金融機関'],
+                         '大項目': df['大項目'], '中項目': df['中項目'], '年': df['年'], '月': df['月'], '金額_数値': v, 'AbsAmount': v.abs()})
+
+# ==========================================
+# CSV 取り込み（チャンク単位）
+# ==========================================
+def sniff_encoding(head):
+    # 先頭の数KBだけで判定する。マネーフォワードの既定は Shift_JIS
+    for enc in ('utf-8-sig', 'cp932'):
+        try:
+            head.decode(enc); return enc
+        except UnicodeDecodeError as e:
+            if e.start >= len(e.object) - 3: return enc  # 切り出した末尾で文字が途中なだけ（BOM を除いた位置で比べる）
+    return 'cp932'
+
+def _csv_chunks(f, chunksize):
+    # 判定用に先頭を読んでから巻き戻す（ZIP の中のファイルも seek(0) で展開し直せる。peek() は 512 バイトまでしか返さない）
+    head = f.read(4096); f.seek(0)
+    for dn in pd.read_csv(f, encoding=sniff_encoding(head), chunksize=chunksize):
+        yield dn, f.tell()
+
+def read_export(f, chunksize=5000):
+    # CSV か、月別 CSV をまとめた ZIP を (チャンク, 読んだバイト数, 総バイト数) で順に返す
+    if zipfile.is_zipfile(f):
+        f.seek(0); z = zipfile.ZipFile(f)
+        ms = sorted((i for i in z.infolist() if i.filename.lower().endswith('.csv')), key=lambda i: i.filename)
+        total = sum(i.file_size for i in ms) or 1; base = 0
+        for i in ms:
+            with z.open(i) as m:
+                for dn, pos in _csv_chunks(m, chunksize): yield dn, base + pos, total
+            base += i.file_size
+    else:
+        f.seek(0, 2); total = f.tell() or 1; f.seek(0)
+        for dn, pos in _csv_chunks(f, chunksize): yield dn, pos, total
+
+def normalize_export(dn):
+    dn['日付']=_dates(dn['日付']); dn=dn.dropna(subset=['日付'])
+    dn['年']=dn['日付'].dt.year; dn['月']=dn['日付'].dt.month
+    dn['金額_数値']=parse_yen(dn['金額（円）']); dn['AbsAmount']=dn['金額_数値'].abs()
+    return dn[[c for c in TX_COLS if c in dn.columns]]
+
+def import_export(f, cur, append, update, chunksize=5000, classify=None):
+    # チャンクごとに正規化→既存と突き合わせ→書き込みまで済ませ、(読んだバイト, 総バイト, 件数) を返していく。
+    # classify: 正規化したチャンク -> (大項目を埋めたチャンク, 埋めた件数)。突き合わせの前に掛けるので、埋めた結果が既存と同じなら書き換えない
+    ix = fp_index(cur); n = dict(rows=0, new=0, upd=0, skip=0, auto=0)
+    for dn, done, total in read_export(f, chunksize):
+        dn = normalize_export(dn)
+        if classify: dn, k = classify(dn); n['auto'] += k
+        new, upd, skip = plan_import(dn, cur, ix=ix)
+        append(new); update(upd)
+        n['rows'] += len(dn); n['new'] += len(new); n['upd'] += len(upd); n['skip'] += skip
+        yield done, total, n
+
+# ==========================================
+# 集計
+# ==========================================
+@staged('aggregate')
+def monthly_totals(df):
+    # (年, 月, 大項目) ごとの収入・支出。SQLite 側は同じものを SQL で返す
+    if df.empty: return pd.DataFrame(columns=['年','月','大項目','収入','支出','件数'])
+    v = df['金額_数値']
+    t = df.assign(収入=v.where(v>0, 0), 支出=(-v).where(v<0, 0))
+    return t.groupby(['年','月','大項目'], as_index=False, observed=True).agg(収入=('収入','sum'), 支出=('支出','sum'), 件数=('収入','size'))
+
+class Cube:
+    # (年, 月, 大項目, 費用タイプ) × 収入/支出 の集計。データが変わるまで1回だけ作り、各タブは辞書を引くだけにする
+    @staged('aggregate')
+    def __init__(self, totals, cost_type):
+        t = totals.copy()
+        t['費用タイプ'] = t['大項目'].map(cost_type)
+        self.t = t
+        self.m = t.groupby(['年','月'], observed=True)[['収入','支出']].sum()
+        e = t[t['支出']>0]
+        self.mc = {k: g.droplevel([0,1]).sort_values(ascending=False) for k, g in e.groupby(['年','月','大項目'], observed=True)['支出'].sum().groupby(level=[0,1])}
+        self.mf = e.groupby(['年','月','費用タイプ'], observed=True)['支出'].sum().to_dict()
+        self.yc = {k: g.droplevel(0).sort_values(ascending=False) for k, g in e.groupby(['年','大項目'], observed=True)['支出'].sum().groupby(level=0)}
+        self.ye = e.groupby('年')['月'].nunique().to_dict()
+
+    @property
+    def empty(self): return self.t.empty
+
+    def years(self): return sorted(self.m.index.get_level_values(0).unique(), reverse=True)
+
+    def months(self, y): return sorted(self.m.loc[y].index, reverse=True) if y in self.m.index else []
+
+    def month(self, y, m):
+        # (収入, 支出)
+        return tuple(self.m.loc[(y, m)]) if (y, m) in self.m.index else (0.0, 0.0)
+
+    def year_months(self, y):
+        # 月 → 収入/支出
+        return self.m.loc[y] if y in self.m.index else self.m.iloc[:0].droplevel(0)
+
+    def cats(self, y, m):
+        # 大項目 → 支出（降順）
+        return self.mc.get((y, m), pd.Series(dtype=float))
+
+    def fixed_var(self, y, m): return tuple(self.mf.get((y, m, k), 0.0) for k in ('固定費', '変動費'))
+
+    def year_cats(self, y): return self.yc.get(y, pd.Series(dtype=float))
+
+    def exp_months(self, y): return int(self.ye.get(y, 0)) or 1
+
+class Incremental:
+    # 取引から作る集計・索引の共通部分。追記された取引は add() で足し込むだけで、作り直さない。
+    # 読み込んだ取引と signature()（件数, 指紋と SIG の列の合計）が合わないとき（他の画面からの変更・行の書き換え）だけ全件から作り直す。
+    # 派生クラスは _clear()（空にする）と _fold(tx)（取引を足し込む）を書き、指紋の外で使う列を SIG に並べる
+    SIG = ('大項目',)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._reset(); self.dirty = True
+
+    def _reset(self):
+        self.rows = 0; self.sig = 0; self._clear()
+
+    @classmethod
+    def signature(cls, tx):
+        # 指紋は日付・内容・金額・金融機関だけなので、SIG の列（大項目・中項目）のハッシュを混ぜて手直しも拾う。指紋にある列は足さない
+        # 毎回の再実行で全件に掛けるので、ハッシュはカテゴリ（数十〜数百個）にだけ掛けてコードで引く。空（コード -1）は末尾の 0
+        if not len(tx): return (0, 0)
+        x = tx['_fp'].to_numpy(np.uint64).copy()
+        for i, k in enumerate(k for k in cls.SIG if k in tx.columns and k not in FP_COLS):
+            c = tx[k] if isinstance(tx[k].dtype, pd.CategoricalDtype) else tx[k].astype('category')
+            h = np.r_[pd.util.hash_array(np.asarray(c.cat.categories.astype(str), object)), np.uint64(0)]
+            x ^= h[c.cat.codes.to_numpy()] * np.uint64(0x9E3779B97F4A7C15 + 2*i)
+        return (len(tx), int(x.sum()))
+
+    def sync(self, tx):
+        with self.lock:
+            if self.dirty or (self.rows, self.sig) != self.signature(tx):
+                self._reset(); self._add(tx); self.dirty = False
+        return self
+
+    def add(self, tx):
+        with self.lock: self._add(tx)
+
+    def invalidate(self): self.dirty = True
+
+    def _add(self, tx):
+        if tx.empty: return
+        n, s = self.signature(tx); self.rows += n; self.sig = (self.sig + s) % 2**64
+        self._fold(tx)
+
+class BudgetTracker(Incremental):
+    # (年月, 大項目, 日) ごとの支出を密な配列 D に持つ
+    def _clear(self):
+        self.mi, self.ci = {}, {}; self.D = np.zeros((0, 0, 31))
+
+    @staged('aggregate')
+    def _fold(self, tx):
+        e = tx[tx['金額_数値'] < 0]
+        if e.empty: return
+        ym = pd.Series(e['年'].to_numpy(int)*100 + e['月'].to_numpy(int)); cat = pd.Series(e['大項目'].astype(str).to_numpy())
+        for k in ym.unique(): self.mi.setdefault(int(k), len(self.mi))
+        for k in cat.unique(): self.ci.setdefault(k, len(self.ci))
+        M, C = len(self.mi), len(self.ci)
+        if self.D.shape[:2] != (M, C): self.D = np.pad(self.D, ((0, M-self.D.shape[0]), (0, C-self.D.shape[1]), (0, 0)))
+        ix = (ym.map(self.mi).to_numpy()*C + cat.map(self.ci).to_numpy())*31 + e['日付'].dt.day.to_numpy() - 1
+        self.D += np.bincount(ix, weights=-e['金額_数値'].to_numpy(float), minlength=self.D.size).reshape(self.D.shape)
+
+    def spent(self, y, m):
+        # 大項目 → その月の支出
+        i = self.mi.get(y*100 + m)
+        return pd.Series(self.D[i].sum(axis=1) if i is not None else 0.0, index=list(self.ci), dtype=float)
+
+    def history(self, budgets):
+        # 全月 × 予算のあるカテゴリの実績（行: YYYY-MM）
+        ks = sorted(self.mi); cats = list(budgets.index)
+        A = np.zeros((len(ks), len(cats)))
+        have = [j for j, c in enumerate(cats) if c in self.ci]
+        if ks and have: A[:, have] = self.D[[self.mi[k] for k in ks]][:, [self.ci[cats[j]] for j in have]].sum(axis=2)
+        return pd.DataFrame(A, index=[f"{k//100}-{k%100:02d}" for k in ks], columns=cats)
+
+    def burn(self, y, m, budgets, day=None):
+        # 予算のあるカテゴリごとに day 日までの支出・日割りペース・月末見込みと、超過した日（超過済み）か超過しそうな日
+        nd = pd.Period(f"{y}-{m:02d}", 'M').days_in_month; day = min(day or nd, nd)
+        cats = list(budgets.index); b = budgets.to_numpy(float)
+        i = self.mi.get(y*100 + m); cum = np.zeros((len(cats), day))
+        if i is not None:
+            have = [j for j, c in enumerate(cats) if c in self.ci]
+            cum[have] = self.D[i, [self.ci[cats[j]] for j in have], :day].cumsum(axis=1)
+        sp = cum[:, -1]; pace = sp/day; proj = pace*nd
+        over = sp > b
+        first = np.where(over, (cum > b[:, None]).argmax(axis=1) + 1, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            eta = np.where(~over & (proj > b) & (pace > 0), np.ceil(b/np.where(pace > 0, pace, 1)), 0)
+        return pd.DataFrame({'予算': b, '支出': sp, 'ペース': pace, '月末見込み': proj, '超過済み': over,
+                             '超過日': np.where(over, first, eta).astype(int)}, index=cats)
+
+# ==========================================
+# 明細の絞り込み
+# ==========================================
+# 全期間の取引から条件に合う行の位置だけを出し、表示するのは1ページ分だけ。文字列への整形はしない（表示側の column_config で行う）
+TX_SORTS = {"new": "日付が新しい順", "old": "日付が古い順", "big": "金額が大きい順", "small": "金額が小さい順"}
+
+@staged('filter')
+def query_tx(tx, start=None, end=None, cats=(), banks=(), kind=None, text="", lo=None, hi=None, sort="new"):
+    # kind: "支出" / "収入" / None、lo・hi は金額の絶対値（円）。軽い条件から順に絞り、文字列検索は残った行だけに掛ける
+    if tx.empty: return np.array([], dtype=np.int64)
+    m = np.ones(len(tx), bool)
+    d = tx['日付'].to_numpy()
+    if start is not None: m &= d >= np.datetime64(pd.Timestamp(start))
+    if end is not None: m &= d < np.datetime64(pd.Timestamp(end) + pd.Timedelta(days=1))
+    if cats: m &= tx['大項目'].isin(cats).to_numpy()
+    if banks: m &= tx['保有金融機関'].isin(banks).to_numpy()
+    v = tx['金額_数値'].to_numpy(); a = np.abs(v)
+    if kind == "支出": m &= v < 0
+    elif kind == "収入": m &= v > 0
+    if lo is not None: m &= a >= lo
+    if hi is not None: m &= a <= hi
+    ix = np.flatnonzero(m)
+    if text and len(ix):
+        s = tx['内容'].iloc[ix]
+        ix = ix[s.str.contains(text, case=False, regex=False, na=False).to_numpy()]
+    if sort in ("big", "small"): k = a[ix]
+    else: k = d[ix]
+    o = np.argsort(k, kind='stable')
+    return ix[o[::-1]] if sort in ("new", "big") else ix[o]
+
+def tx_page(tx, ix, page, size):
+    # ix の page 番目（0始まり）を表示用の列で返す。金額は符号つきの整数のまま
+    p = tx.iloc[ix[page*size:(page+1)*size]]
+    return pd.DataFrame({'日付': p['日付'], '内容': p['内容'], '金額': p['金額_数値'], '大項目': p['大項目'], '中項目': p['中項目'],
+                         '費用タイプ': p['費用タイプ'], '決済元': p['保有金融機関']})
+
+def tx_summary(tx, ix):
+    v = tx['金額_数値'].to_numpy()[ix]
+    return dict(n=len(ix), out=int(-v[v < 0].sum()), inc=int(v[v > 0].sum()))
+
+# ==========================================
+# AI プロンプト
+# ==========================================
+def build_prompt(sy, sm, cube, dj):
+    vi, ve = cube.month(sy, sm); me = cube.cats(sy, sm)
+    yc = cube.year_cats(sy); am = cube.exp_months(sy)
+    p = f"あなたはプロのFPです。以下の{sy}年{sm}月の家計データを分析し、具体的で前向きなアドバイスを。\n\n収入:¥{vi:,.0f} 支出:¥{ve:,.0f} 収支:¥{(vi-ve):,.0f}\n\nカテゴリ別支出:\n"
+    if not me.empty:
+        for cat, val in me.items():
+            avg = yc.get(cat, 0)/am; d=val-avg
+            p += f"- {cat}: ¥{val:,.0f}（年平均¥{avg:,.0f}、差{'+' if d>0 else ''}{d:,.0f}）\n"
+    if not me.empty:
+        fx, vr = cube.fixed_var(sy, sm)
+        p += f"\n固定費:¥{fx:,.0f} 変動費:¥{vr:,.0f}\n"
+    if not dj.empty:
+        t = f"{sy}-{sm:02d}"
+        jr = dj[dj['Month'].astype(str)==t]
+        if not jr.empty:
+            r = jr.iloc[-1]
+            p += f"\n本人の振り返り（満足度{r['Score']}/10）: {r['Comment']}\n"
+    p += "\n回答は番号付きの平文で300〜400字:\n1. 今月の総評\n2. 良い点\n3. 改善ポイント（金額目安込み）\n4. 来月のアクション"
+    return p
@@ -0,0 +1,112 @@
+import time
+import gspread
+from gspread.utils import a1_range_to_grid_range
+
+# ==========================================
+# メモリ上の gspread（ベンチマーク・動作確認用）
+# ==========================================
+# GSheetStore が使うメソッドだけを持つ。セルは文字列の2次元リスト、API 呼び出しは calls に数える（latency 秒ずつ待たせられる）
+def _grid(a1):
+    g = a1_range_to_grid_range(a1.split('!')[-1])
+    return g.get('startRowIndex', 0), g.get('endRowIndex', 10**9), g.get('startColumnIndex', 0), g.get('endColumnIndex', 10**9)
+
+def _trim(rows):
+    # Sheets API と同じく末尾の空行・空セルは返さない
+    while rows and not any(rows[-1]): rows.pop()
+    out = []
+    for r in rows:
+        k = len(r)
+        while k and r[k-1] == '': k -= 1
+        out.append(r[:k])
+    return out
+
+class Worksheet:
+    def __init__(self, book, title, rows=1000, cols=15):
+        self.book, self.title, self.row_count, self.col_count = book, title, rows, cols
+        self.cells = []
+
+    def _call(self):
+        self.book.calls += 1
+        if self.book.latency: time.sleep(self.book.latency)
+
+    def _get(self, a1):
+        r0, r1, c0, c1 = _grid(a1)
+        return _trim([[str(v) for v in r[c0:c1]] for r in self.cells[r0:r1]])
+
+    def _put(self, r0, c0, vals):
+        for i, row in enumerate(vals):
+            while len(self.cells) <= r0 + i: self.cells.append([])
+            cur = self.cells[r0 + i]
+            if len(cur) < c0 + len(row): cur.extend([''] * (c0 + len(row) - len(cur)))
+            cur[c0:c0+len(row)] = ['' if v is None else str(v) for v in row]
+        # 本物の gspread と同じく row_count / col_count は書き込んでも更新しない（シートを開き直すまで古いまま）
+
+    def get_all_values(self):
+        self._call()
+        w = max((len(r) for r in self.cells), default=0)
+        return _trim([[str(v) for v in r] + [''] * (w - len(r)) for r in self.cells])
+
+    def row_values(self, i):
+        self._call()
+        return _trim([list(self.cells[i-1])])[0] if len(self.cells) >= i else []
+
+    def batch_get(self, ranges):
+        self._call()
+        return [self._get(r) for r in ranges]
+
+    def update(self, vals, range_name='A1', **kw):
+        self._call()
+        r0, _, c0, _ = _grid(range_name)
+        self._put(r0, c0, vals)
+
+    def batch_update(self, data, **kw):
+        self._call()
+        for d in data:
+            r0, _, c0, _ = _grid(d['range']); self._put(r0, c0, d['values'])
+
+    def batch_clear(self, ranges):
+        self._call()
+        for a in ranges:
+            r0, r1, c0, c1 = _grid(a)
+            for row in self.cells[r0:r1]:
+                for j in range(c0, min(c1, len(row))): row[j] = ''
+        while self.cells and not any(self.cells[-1]): self.cells.pop()
+
+    def append_rows(self, rows, **kw):
+        self._call()
+        while self.cells and not any(self.cells[-1]): self.cells.pop()
+        self._put(len(self.cells), 0, rows)
+
+class Spreadsheet:
+    def __init__(self, title, latency=0):
+        self.title, self.ws, self.calls, self.latency = title, {}, 0, latency
+
+    def worksheets(self):
+        self.calls += 1
+        return list(self.ws.values())
+
+    def worksheet(self, title):
+        self.calls += 1
+        if title not in self.ws: raise gspread.exceptions.WorksheetNotFound(title)
+        return self.ws[title]
+
+    def add_worksheet(self, title, rows=1000, cols=15):
+        self.calls += 1
+        self.ws[title] = Worksheet(self, title, rows, cols)
+        return self.ws[title]
+
+    def values_batch_get(self, ranges):
+        self.calls += 1
+        out = []
+        for r in ranges:
+            name, _, a1 = r.partition('!')
+            w = self.ws[name.strip("'")]
+            out.append({'values': w._get(a1) if a1 else _trim([[str(v) for v in row] for row in w.cells])})
+        return {'valueRanges': out}
+
+class Client:
+    def __init__(self, latency=0): self.books = {}; self.latency = latency
+
+    def open(self, title):
+        if title not in self.books: self.books[title] = Spreadsheet(title, self.latency)
+        return self.books[title]
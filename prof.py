@@ -0,0 +1,82 @@
+import os, json, time, threading
+from contextlib import contextmanager
+from functools import wraps
+from datetime import datetime
+
+# ==========================================
+# 実行ごとの計測（有効時のみ）
+# ==========================================
+# begin() から end() までの1回の再実行について、名前付きステージの時間と API 呼び出し回数・バイト数を集計する。
+# begin() していないスレッドでは stage()/count() は何もしない
+_local = threading.local()
+
+def active(): return getattr(_local, 'rec', None) is not None
+
+def begin(**tags):
+    _local.rec = dict(t0=time.perf_counter(), tags=tags, stages={}, calls={}, open={})
+
+@contextmanager
+def stage(name):
+    rec = getattr(_local, 'rec', None)
+    if rec is None or rec['open'].get(name):
+        # 無効時と、同名ステージの入れ子（二重計上になる）は素通し
+        yield; return
+    rec['open'][name] = 1; t = time.perf_counter()
+    try: yield
+    finally:
+        s = rec['stages'].setdefault(name, [0.0, 0])
+        s[0] += (time.perf_counter()-t)*1000; s[1] += 1
+        rec['open'][name] = 0
+
+def staged(name):
+    # 関数全体をステージとして計測するデコレータ
+    def deco(f):
+        @wraps(f)
+        def run(*a, **kw):
+            with stage(name): return f(*a, **kw)
+        return run
+    return deco
+
+def count(name, n=1, nbytes=0):
+    rec = getattr(_local, 'rec', None)
+    if rec is None: return
+    c = rec['calls'].setdefault(name, [0, 0])
+    c[0] += n; c[1] += nbytes
+
+def end(log_path=None, **tags):
+    # 集計を返し、log_path があれば JSONL に1行追記する
+    rec = getattr(_local, 'rec', None)
+    if rec is None: return None
+    _local.rec = None
+    out = dict(at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), ms=round((time.perf_counter()-rec['t0'])*1000, 1), **rec['tags'], **tags,
+               stages={k: [round(v[0], 1), v[1]] for k, v in rec['stages'].items()},
+               calls={k: list(v) for k, v in rec['calls'].items()})
+    if log_path:
+        os.makedirs(os.path.dirname(log_path) or '.', exist_ok=True)
+        with open(log_path, 'a', encoding='utf-8') as f: f.write(json.dumps(out, ensure_ascii=False) + '\n')
+    return out
+
+def history(log_path, n=50):
+    try:
+        with open(log_path, encoding='utf-8') as f: lines = f.readlines()[-n:]
+    except OSError: return []
+    return [json.loads(l) for l in lines if l.strip()]
+
+# ==========================================
+# gspread の HTTP 呼び出しを数える
+# ==========================================
+def instrument_gspread(client):
+    # client.http_client.request を包み、1リクエストごとに fetch ステージと送受信バイト数を記録する
+    hc = getattr(client, 'http_client', None)
+    if hc is None or getattr(hc, '_prof', False): return client
+    req = hc.request
+    def request(method, endpoint, *a, **kw):
+        if not active(): return req(method, endpoint, *a, **kw)
+        with stage('fetch'):
+            r = req(method, endpoint, *a, **kw)
+        body = kw.get('json') if kw.get('json') is not None else kw.get('data')
+        sent = len(body) if isinstance(body, (bytes, str)) else len(json.dumps(body, default=str)) if body is not None else 0
+        count('sheets', 1, len(r.content or b'') + sent)
+        return r
+    hc.request = request; hc._prof = True
+    return client
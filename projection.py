@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# 資産ゴールの予測
+# ==========================================
+# どのゴールも「最新の総資産から先の軌道」は同じなので、一番遠い期限まで1回だけ計算し、各ゴールはその先頭を切り出す
+MODELS = {"linear": "平均ペース（全期間）", "trailing": "直近12ヶ月のペース", "compound": "複利（証券・iDeCo）", "montecarlo": "モンテカルロ"}
+INVEST = ['Securities', 'iDeCo']
+QUANTILES = (5, 25, 50, 75, 95)
+
+def horizons(goals, today, lo=12, hi=240):
+    # ゴールごとの予測月数。期限が読めなければ5年後の年末、12〜240ヶ月に収める
+    d = pd.to_datetime(goals['TargetDate'].astype(str).str[:10], format='%Y-%m-%d', errors='coerce')
+    d = d.fillna(pd.Timestamp(today.year+5, 12, 31))
+    return np.clip((d.dt.year - today.year)*12 + (d.dt.month - today.month), lo, hi).to_numpy(int)
+
+def _split(da):
+    inv = da[[c for c in INVEST if c in da.columns]].sum(axis=1).to_numpy(float)
+    return da['Total'].to_numpy(float) - inv, inv
+
+class Projection:
+    def __init__(self, da, goals, today, model="linear", window=12, annual_return=0.04, annual_vol=0.15, paths=10000, seed=0):
+        tots = da['Total'].to_numpy(float)
+        self.model, self.paths, self.last, self.last_month = model, paths, tots[-1], str(da['Month'].iloc[-1])
+        self.h = horizons(goals, today); self.targets = goals['TargetAmount'].to_numpy(float)
+        H = int(self.h.max()) if len(self.h) else 12
+        self.months = pd.period_range(pd.Period(self.last_month, 'M') + 1, periods=H, freq='M').strftime('%Y-%m').tolist()
+        d = np.diff(tots)
+        self.pace = d.mean() if model != "trailing" else d[-window:].mean()
+        self.bands = None; self.prob = None
+        k = np.arange(1, H+1)
+        if model in ("linear", "trailing"):
+            # 以前の cur+=avg と同じ順で足す（浮動小数の丸めまで一致させる）
+            self.mid = np.add.accumulate(np.r_[tots[-1], np.full(H, self.pace)])[1:]
+        else:
+            cash, inv = _split(da)
+            r = (1 + annual_return)**(1/12) - 1
+            c_cash = np.diff(cash).mean(); c_inv = np.diff(inv).mean()
+            if model == "compound":
+                # 証券・iDeCo は月利 r で複利 + 毎月の平均積立、それ以外は平均ペースで線形
+                g = (1 + r)**k
+                self.mid = cash[-1] + c_cash*k + inv[-1]*g + c_inv*(g - 1)/r if r else cash[-1] + c_cash*k + inv[-1] + c_inv*k
+            else:
+                # 月次リターン ~ N(r, σ/√12)、現金部分の増減 ~ N(平均, 標準偏差)。配列は (月, パス) で、月方向の累積は連続メモリ上で済ませる。
+                # inv_k = inv_{k-1}(1+R_k) + c を G_k = Π(1+R) で割ると累積和になるので、月のループ無しで全パスを出せる
+                rng = np.random.default_rng(seed)
+                G = rng.standard_normal((H, paths)); G *= annual_vol/np.sqrt(12); G += 1 + r; np.cumprod(G, axis=0, out=G)
+                ps = np.reciprocal(G); np.cumsum(ps, axis=0, out=ps); ps *= c_inv; ps += inv[-1]; ps *= G
+                del G
+                sd = np.diff(cash).std() if len(cash) > 2 else 0.0
+                C = rng.standard_normal((H, paths)); C *= sd; C += c_cash; np.cumsum(C, axis=0, out=C); C += cash[-1]
+                ps += C; del C
+                np.maximum(ps, 0, out=ps)
+                # ゴールごとの期限時点で目標以上のパスの割合
+                self.prob = (ps[self.h - 1] >= self.targets[:, None]).mean(axis=1) if len(self.h) else np.array([])
+                # 分位点は全体を並べ替えず partition で（最近傍順位）
+                ix = [round(q/100*(paths-1)) for q in QUANTILES]
+                ps.partition(ix, axis=1)
+                self.bands = dict(zip(QUANTILES, ps[:, ix].T))
+                self.mid = self.bands[50]
+        self.mid = np.maximum(self.mid, 0)
+
+    def goal(self, i):
+        # i 番目のゴールの (予測月, 予測額, 帯 or None)
+        h = self.h[i]
+        return self.months[:h], self.mid[:h], {q: b[:h] for q, b in self.bands.items()} if self.bands else None
+
+    def reach(self, i):
+        # 中央の軌道が目標に届く最初の月（期限内に届かなければ None）
+        hit = np.flatnonzero(self.mid[:self.h[i]] >= self.targets[i])
+        return self.months[hit[0]] if len(hit) else None
@@ -0,0 +1,95 @@
+import re
+import numpy as np
+import pandas as pd
+from data import Incremental
+from search import norm, NAT
+from prof import staged
+
+# ==========================================
+# 定期的な支払い（サブスク）の検出
+# ==========================================
+# 支出を店ごと・日付順に並べ、隣どうしの間隔が周期（毎月・毎年）にどれだけ揃っているかで判定する。
+# 追記された取引は、その店の分だけ判定し直す
+PERIODS = {"monthly": ("毎月", 25, 36, 3, 12), "yearly": ("毎年", 350, 380, 2, 1)}  # 名前, 間隔の下限・上限（日）, 最少回数, 年に何回
+HIT = 0.75    # 間隔・金額が揃っている割合の下限
+STEADY = 0.2  # 前回からの金額の変化がこの割合以内なら「揃っている」（値上げ1回くらいは許す）
+_digits = re.compile(r'[0-9０-９]+')
+
+def merchant(s):
+    # 会員番号・日付などの数字を落として同じ店にまとめる
+    return _digits.sub('', norm(s))
+
+@staged('aggregate')
+def detect(m, d, v):
+    # m: 店の番号、d: 日付（日単位の整数）、v: 支出額（正）。店ごとの判定を DataFrame（index は店の番号）で返す
+    if not len(m): return pd.DataFrame()
+    # 同じ店・同じ日の支払いは1回にまとめる
+    d0 = d.min(); key, inv = np.unique(m.astype(np.int64)*100000 + (d - d0), return_inverse=True)
+    v = np.bincount(inv, weights=v); m = key // 100000; d = key % 100000 + d0
+    first = np.flatnonzero(np.r_[True, m[1:] != m[:-1]]); last = np.r_[first[1:], len(m)] - 1
+    n = last - first + 1; gid = np.repeat(np.arange(len(first)), n); G = len(first)
+    same = m[1:] == m[:-1]; gi = gid[1:][same]
+    gap = np.diff(d)[same].astype(float)
+    ch = np.abs(v[1:] / v[:-1] - 1)[same] <= STEADY
+    steady = np.bincount(gi, weights=ch, minlength=G) / np.maximum(n - 1, 1)
+    out = pd.DataFrame({'回数': n, '金額': v[last], '初回金額': v[first], '平均金額': np.bincount(gid, weights=v, minlength=G)/n,
+                        '初回': d[first], '最終': d[last], '周期': '', '間隔': 0.0}, index=m[first])
+    for k, (name, lo, hi, mn, _) in PERIODS.items():
+        hit = (gap >= lo) & (gap <= hi)
+        h = np.bincount(gi, weights=hit, minlength=G)
+        ok = (n >= mn) & (h / np.maximum(n - 1, 1) >= HIT) & (steady >= HIT) & (out['周期'] == '').to_numpy()
+        out.loc[ok, '周期'] = k
+        out.loc[ok, '間隔'] = (np.bincount(gi, weights=gap*hit, minlength=G) / np.maximum(h, 1))[ok]
+    return out
+
+class RecurringDetector(Incremental):
+    def _clear(self):
+        self.mi, self.names, self.cats, self.nd = {}, [], [], []
+        self.m = np.zeros(0, np.int64); self.d = np.zeros(0, np.int64); self.v = np.zeros(0); self.fx = np.zeros(0, bool); self.ym = np.zeros(0, np.int64)
+        self.tab = pd.DataFrame()
+
+    def _fold(self, tx):
+        e = tx[tx['金額_数値'].to_numpy() < 0]
+        if e.empty: return
+        e = e.sort_values('日付')
+        c = e['内容'].fillna('').astype(str); u = c.unique(); mk = c.map(dict(zip(u, map(merchant, u)))).to_numpy(object)
+        # 表示名・カテゴリは店ごとに一番新しい行のもの
+        d = e['日付'].to_numpy('datetime64[D]').astype(np.int64)
+        nw = pd.DataFrame({'k': mk, 'c': c.to_numpy(object), 'g': e['大項目'].astype(str).to_numpy(object), 'd': d}).drop_duplicates('k', keep='last')
+        for k, nm, g, dd in nw.itertuples(index=False):
+            j = self.mi.get(k)
+            if j is None: self.mi[k] = len(self.names); self.names.append(nm); self.cats.append(g); self.nd.append(dd)
+            elif dd >= self.nd[j]: self.names[j] = nm; self.cats[j] = g; self.nd[j] = dd
+        m = pd.Series(mk).map(self.mi).to_numpy(np.int64)
+        self.m = np.r_[self.m, m]; self.d = np.r_[self.d, d]
+        self.ym = np.r_[self.ym, e['年'].to_numpy(np.int64)*100 + e['月'].to_numpy(np.int64)]
+        self.v = np.r_[self.v, -e['金額_数値'].to_numpy(float)]; self.fx = np.r_[self.fx, (e['費用タイプ'].astype(str) == '固定費').to_numpy()]
+        # 判定し直すのは今回の行がある店だけ
+        hit = np.isin(self.m, np.unique(m))
+        r = detect(self.m[hit], self.d[hit], self.v[hit])
+        self.tab = pd.concat([self.tab.drop(index=r.index, errors='ignore'), r]) if len(self.tab) else r
+
+    def subscriptions(self, today, ended=False):
+        # 定期的な支払いの一覧。最後の支払いから周期の1.5倍を過ぎたものは「終了」（ended=False なら出さない）
+        with self.lock:
+            t = self.tab[self.tab['周期'] != ''] if len(self.tab) else self.tab
+            if t.empty: return pd.DataFrame(columns=['内容','大項目','周期','金額','変動','回数','初回','最終','次回予定','年額','状態'])
+            now = np.datetime64(pd.Timestamp(today).date(), 'D').astype(np.int64)
+            p = t['間隔'].to_numpy(); ls = t['最終'].to_numpy()
+            live = now - ls <= p*1.5
+            k = np.maximum(np.ceil((now - ls) / p), 1)
+            r = pd.DataFrame({'内容': [self.names[i] for i in t.index], '大項目': [self.cats[i] for i in t.index],
+                              '周期': t['周期'].map(lambda x: PERIODS[x][0]), '金額': t['金額'], '変動': t['金額']/t['初回金額'] - 1, '回数': t['回数'],
+                              '初回': t['初回'].to_numpy().astype('datetime64[D]'), '最終': ls.astype('datetime64[D]'),
+                              '次回予定': np.where(live, np.round(ls + k*p), NAT).astype(np.int64).astype('datetime64[D]'),
+                              '年額': t['金額'] * t['周期'].map(lambda x: PERIODS[x][4]), '状態': np.where(live, '継続中', '終了')}, index=t.index)
+            if not ended: r = r[live]
+            return r.assign(_l=live[live] if not ended else live).sort_values(['_l', '年額'], ascending=False).drop(columns='_l')
+
+    def fixed_extra(self, y, m):
+        # その月の支出のうち、定期的な支払いなのに大項目では変動費に入っているもの -> (金額, 件数)
+        with self.lock:
+            if not len(self.tab): return 0.0, 0
+            rec = np.zeros(len(self.names), bool); rec[self.tab.index[self.tab['周期'] != '']] = True
+            k = rec[self.m] & ~self.fx & (self.ym == y*100 + m)
+            return float(self.v[k].sum()), int(len(np.unique(self.m[k])))
@@ -0,0 +1,43 @@
+import threading, time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# ==========================================
+# シートのリビジョンで引くキャッシュ
+# ==========================================
+# (関数, 引数) ごとに1件だけ持ち、依存するシートのリビジョン（WriteBehind が書き込みのたびに進める）が変わったときだけ作り直す。
+# 件数とおおよそのバイト数に上限があり、超えたら使われていない順に捨てる（LRU）
+def nbytes(v, depth=1):
+    # DataFrame・配列はそのまま、オブジェクトは属性（1段目）にある DataFrame・配列（とそのリスト・辞書）を足す
+    if isinstance(v, pd.DataFrame): return int(v.memory_usage(index=True, deep=False).sum())
+    if isinstance(v, (pd.Series, pd.Index)): return int(v.memory_usage(index=True, deep=False))
+    if isinstance(v, np.ndarray): return v.nbytes
+    if isinstance(v, (list, tuple)): return sum(nbytes(x, depth) for x in v) if v and isinstance(v[0], (np.ndarray, pd.Series, pd.DataFrame)) else 0
+    if isinstance(v, dict): return sum(nbytes(x, depth) for x in v.values())
+    if depth and hasattr(v, '__dict__'): return sum(nbytes(x, depth - 1) for x in vars(v).values())
+    return 0
+
+class RevCache:
+    def __init__(self, max_entries=64, max_bytes=512 << 20):
+        self.max_entries, self.max_bytes = max_entries, max_bytes
+        self.lock = threading.Lock()
+        self.d = OrderedDict(); self.bytes = 0; self.hits = self.misses = 0
+
+    def get(self, key, rev, make, ttl=None):
+        # rev は make() を呼ぶ前に読んだもの（作っている間に書き込まれたら、次の呼び出しで作り直しになる）
+        now = time.time()
+        with self.lock:
+            e = self.d.get(key)
+            if e and e[0] == rev and (ttl is None or now - e[2] < ttl):
+                self.d.move_to_end(key); self.hits += 1
+                return e[1]
+            self.misses += 1
+        v = make(); n = nbytes(v)
+        with self.lock:
+            old = self.d.pop(key, None)
+            if old: self.bytes -= old[3]
+            self.d[key] = (rev, v, now, n); self.bytes += n
+            while len(self.d) > self.max_entries or (self.bytes > self.max_bytes and len(self.d) > 1):
+                _, e = self.d.popitem(last=False); self.bytes -= e[3]
+        return v
@@ -0,0 +1,85 @@
+import re, unicodedata
+from array import array
+import numpy as np
+import pandas as pd
+from data import Incremental
+from prof import staged
+
+# ==========================================
+# 内容・中項目の n-gram 索引
+# ==========================================
+# 索引を張るのは行ではなく「異なる文字列」（同じ店名は何千行あっても1件）。文字列ごとに件数・支出・収入・最終日を持ち、
+# 検索はその集計を引くだけにする。日本語は単語に切れないので 1文字と2文字の n-gram で引く
+MODES = {"substr": "部分一致", "prefix": "前方一致", "fuzzy": "あいまい"}
+_ws = re.compile(r'\s+')
+NAT = np.iinfo(np.int64).min  # 最終日の初期値（datetime64 にすると NaT）
+
+def norm(s):
+    # 全角/半角・大文字/小文字・空白の違いを無視する
+    return _ws.sub('', unicodedata.normalize('NFKC', s).casefold())
+
+def grams(t):
+    return set(t) | {t[i:i+2] for i in range(len(t)-1)}
+
+class TextIndex(Incremental):
+    SIG = ('内容', '中項目')
+    def _clear(self):
+        self.di, self.text, self.norm = {}, [], []
+        self.post = {}
+        self.n = np.zeros(0, np.int64); self.out = np.zeros(0); self.inc = np.zeros(0); self.last = np.zeros(0, np.int64)
+
+    def _doc(self, s):
+        i = len(self.text); t = norm(s)
+        self.di[s] = i; self.text.append(s); self.norm.append(t)
+        for x in grams(t): self.post.setdefault(x, array('i')).append(i)
+
+    @staged('aggregate')
+    def _fold(self, tx):
+        c = tx['内容'].fillna('').astype(str).to_numpy(object); m = tx['中項目'].fillna('').astype(str).to_numpy(object)
+        for u in pd.unique(np.r_[c, m]):
+            if u and u not in self.di: self._doc(u)
+        ic = pd.Series(c).map(self.di).fillna(-1).to_numpy(np.int64); im = pd.Series(m).map(self.di).fillna(-1).to_numpy(np.int64)
+        im[im == ic] = -1  # 内容と中項目が同じ文字列なら1回だけ数える
+        ids = np.r_[ic, im]; v = np.tile(tx['金額_数値'].to_numpy(float), 2); d = np.tile(tx['日付'].to_numpy('datetime64[D]'), 2)
+        k = ids >= 0; ids, v, d = ids[k], v[k], d[k]
+        N = len(self.text)
+        if len(self.n) < N:
+            p = N - len(self.n)
+            self.n = np.pad(self.n, (0, p)); self.out = np.pad(self.out, (0, p)); self.inc = np.pad(self.inc, (0, p))
+            self.last = np.r_[self.last, np.full(p, NAT, np.int64)]
+        self.n += np.bincount(ids, minlength=N)
+        self.out += np.bincount(ids, weights=np.where(v < 0, -v, 0), minlength=N)
+        self.inc += np.bincount(ids, weights=np.where(v > 0, v, 0), minlength=N)
+        np.maximum.at(self.last, ids, d.astype(np.int64))
+
+    def _post(self, g): return np.frombuffer(self.post[g], np.int32) if g in self.post else np.zeros(0, np.int32)
+
+    @staged('search')
+    def search(self, q, mode="substr", limit=50, cutoff=0.6):
+        # 一致した文字列ごとの (内容, 件数, 支出, 収入, 最終日[, 類似度])。件数の多い順（あいまいは類似度順）
+        with self.lock:
+            t = norm(q); score = None
+            if not t or not self.text: ids = np.zeros(0, np.int64)
+            elif mode == "fuzzy":
+                # 問い合わせの2文字 n-gram のうち何割を含むか（長い店名でも下がらないよう、相手の長さでは割らない）
+                qg = [g for g in grams(t) if len(g) == 2] or [t]
+                hit = np.bincount(np.concatenate([self._post(g) for g in qg]), minlength=len(self.text))
+                ids = np.flatnonzero(hit)
+                sc = hit[ids] / len(qg)
+                k = sc >= cutoff; ids, score = ids[k], sc[k]
+            else:
+                # 問い合わせの全 n-gram を含む文字列に絞ってから、本当に含むか（前方一致か）を確かめる
+                qg = sorted({t[i:i+2] for i in range(len(t)-1)} or {t}, key=lambda g: len(self.post.get(g, ())))
+                ids = self._post(qg[0])
+                for g in qg[1:]:
+                    if not len(ids): break
+                    ids = np.intersect1d(ids, self._post(g), assume_unique=True)
+                ok = str.startswith if mode == "prefix" else (lambda s, t: t in s)
+                ids = np.array([i for i in ids if ok(self.norm[i], t)], np.int64)
+            if score is None: o = np.argsort(-self.n[ids], kind='stable')
+            else: o = np.lexsort((-self.n[ids], -score))
+            ids = ids[o[:limit]]
+            r = pd.DataFrame({'内容': [self.text[i] for i in ids], '件数': self.n[ids], '支出': self.out[ids], '収入': self.inc[ids],
+                              '最終日': self.last[ids].astype('datetime64[D]')})
+            if score is not None: r['類似度'] = score[o[:limit]]
+            return r
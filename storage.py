@@ -0,0 +1,520 @@
+import os, json, time, sqlite3, threading
+from datetime import datetime
+import gspread
+import numpy as np
+import pandas as pd
+from data import parse_yen, monthly_totals
+from prof import staged, count
+
+def _col(n): return gspread.utils.rowcol_to_a1(1, n)[:-1]
+
+def _concat(a, *bs):
+    # カテゴリ列はカテゴリを合わせてから繋ぐ（そのままだと object に戻る）
+    for c in a.columns:
+        if isinstance(a[c].dtype, pd.CategoricalDtype) and any(c in b.columns for b in bs):
+            cats = a[c].cat.categories
+            for b in bs:
+                if c in b.columns: cats = cats.union(b[c].astype('category').cat.categories)
+            a[c] = a[c].cat.set_categories(cats)
+            for b in bs:
+                if c in b.columns: b[c] = b[c].astype(pd.CategoricalDtype(cats))
+    return pd.concat([a, *bs], ignore_index=True)
+
+def _cells(df):
+    s = df.copy()
+    for c in s.columns: s[c] = s[c].astype(str)
+    return s.values.tolist()
+
+# ==========================================
+# Google Sheets
+# ==========================================
+SHEETS = ["transactions", "budgets", "assets", "balances", "goals", "journal", "advice"]
+PREFETCH_TTL = 30
+FULL_TTL = 600  # 差分同期は追記しか見ないので、途中の行の書き換え（シート上での手直し）を拾うためにこの秒数ごとに全件を取り直す
+
+def _frame(vals):
+    hd = vals[0] if vals else []
+    return pd.DataFrame([r + ['']*(len(hd)-len(r)) for r in vals[1:]], columns=hd)
+
+def _stale(e):
+    # 認証切れ・シート削除など、ハンドルを開き直せば通るエラー
+    code = getattr(getattr(e, 'response', None), 'status_code', 0)
+    return code in (401, 404) or (code == 400 and 'Unable to parse range' in str(e))
+
+class GSheetStore:
+    name = "gsheets"
+
+    def __init__(self, client, spreadsheet, cache_dir):
+        # client: gspread クライアントを返す関数（認証失敗時は None）
+        self.client, self.spreadsheet, self.cache_dir = client, spreadsheet, cache_dir
+        self._ss = None; self._ws = {}; self._pre = {}
+        self.lock = threading.RLock()
+
+    def reset(self, auth=False):
+        with self.lock:
+            self._ss = None; self._ws = {}; self._pre = {}
+            if auth and hasattr(self.client, 'clear'): self.client.clear()
+
+    def _open(self):
+        # スプレッドシートは1回だけ開き、ワークシート一覧もまとめて登録する
+        if self._ss is None:
+            client = self.client()
+            if not client: return None
+            self._ss = client.open(self.spreadsheet)
+            self._ws = {w.title: w for w in self._ss.worksheets()}
+        return self._ss
+
+    def worksheet(self, sheet_name):
+        with self.lock:
+            try:
+                ss = self._open()
+                if not ss: return None
+                if sheet_name not in self._ws:
+                    self._ws[sheet_name] = ss.add_worksheet(title=sheet_name, rows=1000, cols=15)
+                return self._ws[sheet_name]
+            except gspread.exceptions.APIError as e:
+                if _stale(e): self.reset(auth=True)
+                return None
+            except: return None
+
+    def _run(self, name, fn):
+        # ハンドルが古くなっていたら開き直して1回だけやり直す
+        ws = self.worksheet(name)
+        if not ws: return None
+        try: return fn(ws)
+        except gspread.exceptions.APIError as e:
+            if not _stale(e): raise
+            self.reset(auth=e.response.status_code == 401)
+            ws = self.worksheet(name)
+            return fn(ws) if ws else None
+
+    def prefetch(self, names=SHEETS):
+        # 起動時に全シートを1回の values_batch_get で読む。キャッシュのあるシートは差分範囲だけ
+        # 開けなければ（シートが無い・認証切れ・通信エラー）先読みせずに戻る。読み込みは各 load / sync が worksheet() 経由でやり直す
+        try:
+            with self.lock: ss = self._open()
+        except gspread.exceptions.APIError as e:
+            if _stale(e): self.reset(auth=True)
+            return
+        except Exception: return
+        if not ss: return
+        ranges, plan = [], []
+        for n in names:
+            ws = self.worksheet(n)
+            if not ws: continue
+            meta = self.cache_meta(n); k = meta.get('rows', 0)
+            if k and self._delta_ok(n, meta):
+                ranges += [f"'{n}'!A1:{_col(ws.col_count)}1", f"'{n}'!A{k+1}:{_col(ws.col_count)}"]; plan.append((n, 'delta'))
+            else:
+                ranges.append(f"'{n}'"); plan.append((n, 'full'))
+        try: vr = ss.values_batch_get(ranges).get('valueRanges', [])
+        except gspread.exceptions.APIError as e:
+            if _stale(e): self.reset(auth=e.response.status_code == 401)
+            return
+        vals = [v.get('values', []) for v in vr]
+        now = time.time()
+        with self.lock:
+            for n, mode in plan:
+                if mode == 'delta': self._pre[n] = (now, mode, vals.pop(0)[:1], vals.pop(0))
+                else: self._pre[n] = (now, mode, vals.pop(0))
+
+    def _take(self, name, mode):
+        with self.lock:
+            p = self._pre.pop(name, None)
+        if p and p[1] == mode and time.time() - p[0] < PREFETCH_TTL: return p[2:]
+        return None
+
+    def load(self, name, cols=None):
+        p = self._take(name, 'full')
+        try: vals = p[0] if p else self._run(name, lambda ws: ws.get_all_values())
+        except: vals = None
+        if vals and len(vals) > 1: return _frame(vals)
+        return pd.DataFrame(columns=cols) if cols else pd.DataFrame()
+
+    def _header(self, ws, df):
+        # 既存ヘッダーに無い列は末尾に足す
+        hd = ws.row_values(1)
+        ext = [c for c in df.columns if c not in hd]
+        if ext:
+            hd = hd + ext
+            ws.update([hd])
+        return hd
+
+    def save(self, df, name):
+        # 全件書き直し（compaction）。上書きしてから余った行だけ消すので、途中で落ちてもシートが空にならない
+        self._pre.pop(name, None)
+        def go(ws):
+            self.drop_cache(name)
+            vals = [df.columns.values.tolist()] + _cells(df)
+            ws.update(vals)
+            # ws.row_count / col_count は開いた時点の値のまま（他の端末の追記や update での拡張は反映されない）ので、
+            # 行は終わりを指定しない範囲で消す。列は書いた幅とシートの幅の大きい方まで
+            n, w = len(vals), len(vals[0]); c = max(ws.col_count, w)
+            rest = [f"A{n+1}:{_col(c)}"]
+            if c > w: rest.append(f"{_col(w+1)}1:{_col(c)}{n}")
+            ws.batch_clear(rest)
+        self._run(name, go)
+
+    def append(self, df, name):
+        if df.empty: return 0
+        self._pre.pop(name, None)
+        def go(ws):
+            hd = self._header(ws, df)
+            ws.append_rows(_cells(df.reindex(columns=hd).fillna('')), value_input_option='RAW', table_range='A1')
+            return len(df)
+        return self._run(name, go) or 0
+
+    def update_rows(self, df, name):
+        # df['_row'] のシート行だけを行範囲で書き換える
+        if df.empty: return 0
+        self._pre.pop(name, None)
+        def go(ws):
+            d = df.drop(columns='_row')
+            hd = self._header(ws, d)
+            rows = _cells(d.reindex(columns=hd).fillna(''))
+            ws.batch_update([{'range': f"A{r}:{gspread.utils.rowcol_to_a1(r, len(hd))}", 'values': [v]} for r, v in zip(df['_row'], rows)], value_input_option='RAW')
+            self.drop_cache(name)
+            return len(rows)
+        return self._run(name, go) or 0
+
+    def monthly_totals(self, tx): return monthly_totals(tx)
+
+    # ---- Local cache (Parquet + 差分同期) ----
+    def _cache_files(self, name): return os.path.join(self.cache_dir, f"{name}.parquet"), os.path.join(self.cache_dir, f"{name}.json")
+
+    def cache_meta(self, name):
+        try:
+            with open(self._cache_files(name)[1], encoding='utf-8') as f: return json.load(f)
+        except Exception: return {}
+
+    def _save_meta(self, name, meta):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._cache_files(name)[1], 'w', encoding='utf-8') as f: json.dump(meta, f, ensure_ascii=False)
+
+    def drop_cache(self, name):
+        # 行の書き換え・全件書き直しの後は差分同期できないので、次回は全件取得させる
+        pq, _ = self._cache_files(name)
+        if os.path.exists(pq): os.remove(pq)
+        meta = self.cache_meta(name)
+        if meta: meta.update(rows=0, tail=None); self._save_meta(name, meta)
+
+    def _delta_ok(self, name, meta, version=None):
+        # キャッシュがあり、形式が同じで、最後に全件取得してから FULL_TTL 以内なら差分で足りる
+        return (os.path.exists(self._cache_files(name)[0]) and (version is None or meta.get('v', 0) == version)
+                and time.time() - meta.get('full_at', 0) < FULL_TTL)
+
+    def sync(self, name, parse, version=0):
+        # 前回同期した最終行が変わっていなければ、それ以降に追記された行だけを取得してキャッシュに足す。_row はシートの行番号
+        t0 = time.perf_counter()
+        pq, _ = self._cache_files(name); meta = self.cache_meta(name)
+        ws = self.worksheet(name)
+        if not ws: return pd.read_parquet(pq) if os.path.exists(pq) else pd.DataFrame()
+        n = meta.get('rows', 0); df = None; mode = 'full'
+        if n and self._delta_ok(name, meta, version):
+            p = self._take(name, 'delta')
+            hr, got = p or self._run(name, lambda ws: ws.batch_get([f"A1:{_col(ws.col_count)}1", f"A{n+1}:{_col(ws.col_count)}"])) or ([], [])
+            hd = meta.get('cols', [])
+            got = [r + ['']*(len(hd)-len(r)) for r in got]
+            if hr and hr[0] == hd and got and got[0] == meta.get('tail'):
+                df = pd.read_parquet(pq); rows = got[1:]; mode = 'delta' if rows else 'hit'
+                if rows: df = _concat(df, parse(pd.DataFrame(rows, columns=hd).assign(_row=range(n+2, n+2+len(rows)))))
+                n += len(rows)
+        if df is None:
+            p = self._take(name, 'full')
+            vals = p[0] if p else self._run(name, lambda ws: ws.get_all_values()) or []
+            hd = vals[0] if vals else []
+            rows = [r + ['']*(len(hd)-len(r)) for r in vals[1:]]
+            df = parse(pd.DataFrame(rows, columns=hd).assign(_row=range(2, len(rows)+2))) if rows else pd.DataFrame()
+            n = len(rows); meta['full_at'] = time.time()
+        if mode != 'hit':
+            os.makedirs(self.cache_dir, exist_ok=True)
+            df.to_parquet(pq, index=False)
+            meta.update(rows=n, cols=hd, tail=rows[-1] if rows else meta.get('tail'), v=version)
+        meta['hits' if mode != 'full' else 'misses'] = meta.get('hits' if mode != 'full' else 'misses', 0) + 1
+        meta['last'] = dict(mode=mode, fetched=len(rows), total=len(df), ms=round((time.perf_counter()-t0)*1000), at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        self._save_meta(name, meta)
+        return df
+
+# ==========================================
+# SQLite
+# ==========================================
+SCHEMA = {
+    'transactions': {'日付':'TEXT','内容':'TEXT','金額（円）':'TEXT','保有金融機関':'TEXT','大項目':'TEXT','中項目':'TEXT',
+                     '年':'INTEGER','月':'INTEGER','金額_数値':'REAL','AbsAmount':'REAL'},
+    'budgets': {'Category':'TEXT','Budget':'REAL'},
+    'assets': {'Month':'TEXT','Bank':'REAL','Securities':'REAL','iDeCo':'REAL','Other':'REAL','Total':'REAL'},
+    'balances': {'Date':'TEXT','Account':'TEXT','Group':'TEXT','Balance':'REAL'},
+    'goals': {'GoalName':'TEXT','TargetAmount':'REAL','TargetDate':'TEXT'},
+    'journal': {'Month':'TEXT','Comment':'TEXT','Score':'INTEGER'},
+    'advice': {'Month':'TEXT','Advice':'TEXT','At':'TEXT'},
+}
+INDEXES = {'transactions': [('年','月','大項目'), ('日付',)], 'budgets': [('Category',)], 'assets': [('Month',)], 'balances': [('Account','Date')],
+           'goals': [('GoalName',)], 'journal': [('Month',)], 'advice': [('Month',)]}
+
+def _q(s): return '"' + str(s).replace('"', '""') + '"'
+
+class SQLiteStore:
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.RLock()
+        for t, cols in SCHEMA.items(): self._table(t, list(cols))
+
+    def _table(self, name, cols):
+        # テーブルが無ければ作り、足りない列は追加する
+        have = [r[1] for r in self.con.execute(f"PRAGMA table_info({_q(name)})")]
+        types = SCHEMA.get(name, {})
+        with self.con:
+            if not have:
+                defs = ', '.join(_q(c) + ' ' + types.get(c, 'TEXT') for c in cols)
+                self.con.execute(f"CREATE TABLE {_q(name)} ({defs})")
+                for ix in INDEXES.get(name, []):
+                    self.con.execute(f"CREATE INDEX {_q('ix_' + name + '_' + '_'.join(ix))} ON {_q(name)} ({', '.join(map(_q, ix))})")
+                have = list(cols)
+            for c in cols:
+                if c not in have: self.con.execute(f"ALTER TABLE {_q(name)} ADD COLUMN {_q(c)} {types.get(c, 'TEXT')}"); have.append(c)
+        return have
+
+    def _rows(self, df, name, cols):
+        types = SCHEMA.get(name, {}); out = []
+        for c in cols:
+            s = df[c] if c in df.columns else pd.Series([None]*len(df), index=df.index, dtype=object)
+            t = types.get(c, 'TEXT')
+            if t == 'REAL': out.append([None if np.isnan(v) else float(v) for v in parse_yen(s)])
+            elif t == 'INTEGER': out.append([None if np.isnan(v) else int(v) for v in pd.to_numeric(s, errors='coerce').astype(float)])
+            else: out.append([None if pd.isna(v) else str(v) for v in s])
+        return list(zip(*out))
+
+    @staged('fetch')
+    def _read(self, sql):
+        df = pd.read_sql_query(sql, self.con)
+        count('sqlite', 1, int(df.memory_usage(deep=False).sum()))
+        return df
+
+    def load(self, name, cols=None):
+        with self.lock:
+            have = self._table(name, cols or [])
+            df = self._read(f"SELECT {', '.join(map(_q, have))} FROM {_q(name)} ORDER BY rowid") if have else pd.DataFrame()
+        if not df.empty: return df
+        return pd.DataFrame(columns=cols) if cols else pd.DataFrame()
+
+    def save(self, df, name):
+        # トランザクション内で入れ替えるので途中で落ちても元のまま
+        with self.lock:
+            cols = self._table(name, list(df.columns))
+            with self.con:
+                self.con.execute(f"DELETE FROM {_q(name)}")
+                self.con.executemany(f"INSERT INTO {_q(name)} ({', '.join(map(_q, cols))}) VALUES ({', '.join('?'*len(cols))})", self._rows(df, name, cols))
+
+    def append(self, df, name):
+        if df.empty: return 0
+        with self.lock:
+            cols = self._table(name, list(df.columns))
+            with self.con:
+                self.con.executemany(f"INSERT INTO {_q(name)} ({', '.join(map(_q, cols))}) VALUES ({', '.join('?'*len(cols))})", self._rows(df, name, cols))
+        return len(df)
+
+    def update_rows(self, df, name):
+        if df.empty: return 0
+        with self.lock:
+            # SET は df にある列だけ（表にしか無い列は NULL にせずそのまま残す）
+            cols = [c for c in df.columns if c != '_row']; self._table(name, cols)
+            with self.con:
+                self.con.executemany(f"UPDATE {_q(name)} SET {', '.join(f'{_q(c)}=?' for c in cols)} WHERE rowid=?",
+                                     [r + (int(i),) for r, i in zip(self._rows(df, name, cols), df['_row'])])
+        return len(df)
+
+    @staged('aggregate')
+    def monthly_totals(self, tx=None):
+        with self.lock:
+            return pd.read_sql_query("""SELECT 年, 月, 大項目,
+                    SUM(CASE WHEN 金額_数値 > 0 THEN 金額_数値 ELSE 0 END) AS 収入,
+                    SUM(CASE WHEN 金額_数値 < 0 THEN AbsAmount ELSE 0 END) AS 支出,
+                    COUNT(*) AS 件数
+                FROM transactions WHERE 年 IS NOT NULL GROUP BY 年, 月, 大項目""", self.con)
+
+    def sync(self, name, parse, version=0):
+        with self.lock:
+            cols = self._table(name, [])
+            df = self._read(f"SELECT rowid AS _row, {', '.join(map(_q, cols))} FROM {_q(name)} ORDER BY rowid")
+        return parse(df) if not df.empty else pd.DataFrame()
+
+    def cache_meta(self, name): return {}
+
+    def copy_from(self, src):
+        # 別のストア（スプレッドシート）の内容をまるごと取り込む
+        n = {}
+        for t in SCHEMA:
+            df = src.load(t)
+            if not df.empty: self.save(df, t)
+            n[t] = len(df)
+        return n
+
+# ==========================================
+# Write-behind
+# ==========================================
+# save / append はキューに積んですぐ戻り、ワーカースレッドがシートごとにまとめて書く（続けて保存したら最後の分だけ、追記は1回に繋ぐ）。
+# 書き込み待ちはシートごとに区切り（1回の save / append）のリストで持ち、区切りごとに <path>/<シート>.<連番>.<op>.pkl にも置くので、
+# 途中で落ちても次の起動で書き直す（積むたびに書くのはその区切りだけ）。save が来たらそれより前の書き込み待ちは捨てる。
+# load / sync は書き込み待ちを重ねて返すので、保存直後の再実行でも結果が見える。
+# シートごとのリビジョンは、書き込みを積んだとき・追記を書き終えたとき（_row が付く）に進む。読み込み結果のキャッシュはこれで引く
+RETRY_MAX = 300  # 再試行の間隔の上限（秒）
+
+def _fold(segs):
+    # 区切り [(op, df, ファイル)] -> 1回分の書き込み (op, df) or None。save は先頭にしか無い
+    if not segs: return None
+    return (segs[0][0], _concat(*(d.copy() for _, d, _ in segs)))
+
+def _drop(segs):
+    for *_, f in segs:
+        try: os.remove(f)
+        except OSError: pass
+
+def _quota(e):
+    # 待てば通るエラー（Sheets の 429・SQLite のロック）
+    code = getattr(getattr(e, 'response', None), 'status_code', 0)
+    return code == 429 or any(w in str(e).lower() for w in ('quota', 'rate limit', 'locked'))
+
+class WriteBehind:
+    def __init__(self, store, path):
+        self.store, self.path = store, path
+        self.cv = threading.Condition()
+        self.pend, self.busy, self.retry, self.errors, self.io, self.revs = {}, {}, {}, {}, {}, {}
+        os.makedirs(path, exist_ok=True); self.seq = 0
+        fs = []
+        for f in os.listdir(path):
+            p = f[:-4].split('.')
+            if f.endswith('.pkl') and len(p) == 3 and p[1].isdigit(): fs.append((int(p[1]), p[0], p[2], f))
+        for k, name, op, f in sorted(fs):
+            f = os.path.join(path, f)
+            try: self._queue(name, op, pd.read_pickle(f), f)
+            except Exception: pass
+            self.seq = k
+        threading.Thread(target=self._run, daemon=True, name="write-behind").start()
+
+    def __getattr__(self, k):
+        # name, cache_meta などは元のストアのもの
+        if k == 'store': raise AttributeError(k)
+        return getattr(self.store, k)
+
+    def _lock(self, name):
+        # シートごとの読み書きの排他（書いている最中に読むと、書き込み待ちと書いた分が二重に見える）
+        with self.cv: return self.io.setdefault(name, threading.Lock())
+
+    def rev(self, *names):
+        with self.cv: return tuple(self.revs.get(n, 0) for n in names)
+
+    def _bump(self, *names):
+        with self.cv:
+            for n in names: self.revs[n] = self.revs.get(n, 0) + 1
+
+    def _queue(self, name, op, df, f):
+        segs = self.pend.setdefault(name, [])
+        if op == 'save': _drop(segs); segs.clear()
+        segs.append((op, df, f))
+
+    def _segs(self, name):
+        # 書いている最中の分（busy）の後ろに書き込み待ち。待ちが save なら busy は上書きされる
+        p = self.pend.get(name, [])
+        return list(p) if p and p[0][0] == 'save' else self.busy.get(name, []) + p
+
+    def _put(self, name, op, df):
+        df = df.copy()
+        with self.cv:
+            self.seq += 1; f = os.path.join(self.path, f"{name}.{self.seq:012d}.{op}.pkl")
+            pd.to_pickle(df, f + '.tmp'); os.replace(f + '.tmp', f)
+            self._queue(name, op, df, f)
+            self.retry.pop(name, None); self._bump(name); self.cv.notify_all()
+
+    def save(self, df, name): self._put(name, 'save', df)
+
+    def append(self, df, name):
+        if df.empty: return 0
+        self._put(name, 'append', df)
+        return len(df)
+
+    def pending(self, name=None):
+        # 書き込み待ち (op, df) or None。name=None ならシート名 → 行数
+        with self.cv:
+            if not name: return {n: sum(len(d) for _, d, _ in self._segs(n)) for n in set(self.pend) | set(self.busy)}
+            segs = self._segs(name)
+        return _fold(segs)
+
+    def _run(self):
+        while True:
+            with self.cv:
+                now = time.time()
+                ready = [n for n in self.pend if n not in self.busy and self.retry.get(n, (0, 0))[0] <= now]
+                if not ready:
+                    at = [self.retry[n][0] for n in self.pend if n in self.retry]
+                    self.cv.wait(max(min(at) - now, 0.05) if at else None); continue
+                name = ready[0]; segs = self.busy[name] = self.pend.pop(name)
+            err = None; op, df = _fold(segs)
+            # busy の片付けとリビジョンも排他の中で（外でやると、その間の load / sync に書いた行と busy の行が二重に見える）
+            with self._lock(name):
+                try:
+                    if op == 'save': self.store.save(df, name)
+                    elif not self.store.append(df, name): raise RuntimeError(f"{name} に書き込めません")
+                except Exception as e: err = e
+                with self.cv:
+                    self.busy.pop(name)
+                    if err is None:
+                        _drop(segs); self.retry.pop(name, None); self.errors.pop(name, None)
+                        if op == 'append': self._bump(name)  # 重ねていた行に _row が付く
+                    else:
+                        # 失敗した分は後から来た書き込みの前に戻し、間隔を倍にしながら書き直す
+                        p = self.pend.get(name, [])
+                        if p and p[0][0] == 'save': _drop(segs)
+                        else: self.pend[name] = segs + p
+                        k = self.retry.get(name, (0, 0))[1] + 1
+                        self.retry[name] = (time.time() + min(2**k, RETRY_MAX), k)
+                        if not _quota(err): self.errors[name] = str(err)
+                    self.cv.notify_all()
+
+    def flush(self, name=None, timeout=30):
+        # 書き込み待ちが無くなるまで待つ -> 書き終えたか（失敗が続いていれば timeout で諦める）
+        end = time.time() + timeout
+        with self.cv:
+            for n in ([name] if name else list(self.pend)): self.retry.pop(n, None)
+            self.cv.notify_all()
+            while (name in self.pend or name in self.busy) if name else (self.pend or self.busy):
+                left = end - time.time()
+                if left <= 0: return False
+                self.cv.wait(left)
+        return True
+
+    def load(self, name, cols=None):
+        with self._lock(name):
+            p = self.pending(name)
+            if p and p[0] == 'save': return p[1].copy()
+            df = self.store.load(name, cols)
+        if not p: return df
+        return _concat(df, p[1].copy()) if not df.empty else p[1].copy()
+
+    def sync(self, name, parse, version=0):
+        # 全件の書き直し待ちは行番号（_row）が変わるので書き終わるのを待つ。追記待ちの行は _row=0（まだシートに無い）で重ねる
+        p = self.pending(name)
+        if p and p[0] == 'save': self.flush(name)
+        with self._lock(name):
+            df = self.store.sync(name, parse, version); p = self.pending(name)
+        if not p: return df
+        t = parse(p[1].assign(_row=0))
+        return _concat(df, t) if p[0] == 'append' and not df.empty else t
+
+    def update_rows(self, df, name):
+        # 行番号で書き換えるので、追記待ちの行（_row=0）は飛ばす
+        p = self.pending(name)
+        if p and p[0] == 'save': self.flush(name)
+        with self._lock(name): n = self.store.update_rows(df[df['_row'] > 0], name)
+        self._bump(name)
+        return n
+
+    def monthly_totals(self, tx=None):
+        # SQLite は表から集計するので、追記待ちがあるうちは読み込んだ取引から数える
+        return monthly_totals(tx) if self.pending('transactions') and tx is not None else self.store.monthly_totals(tx)
+
+    def copy_from(self, src):
+        self.flush()
+        n = self.store.copy_from(src); self._bump(*n)
+        return n
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+from prof import staged
+
+# ==========================================
+# 複数年の推移（移動平均・季節の基準・年累計・前年差）
+# ==========================================
+# 月次集計（monthly_totals）を (月, 大項目) の支出行列に広げ、全部の指標をこの行列への配列演算1回ずつで出す。
+# 月は最初の1月から最後の12月まで隙間なく並べる（データの無い月は 0）。最後の列は全カテゴリ合計
+WINDOWS = (3, 6, 12)
+TOTAL = '合計'
+
+class Trends:
+    @staged('aggregate')
+    def __init__(self, totals):
+        t = totals[totals['支出'] > 0] if len(totals) else totals
+        self.cats = sorted(t['大項目'].astype(str).unique()) if len(t) else []
+        if not len(t):
+            self.years, self.months, self.E = [], [], np.zeros((0, 1)); self.last = None; return
+        y0, y1 = int(t['年'].min()), int(t['年'].max())
+        self.years = list(range(y0, y1 + 1)); Y, C = len(self.years), len(self.cats)
+        ci = pd.Series(range(C), index=self.cats)
+        k = (t['年'].to_numpy(int) - y0)*12 + t['月'].to_numpy(int) - 1
+        E = np.zeros((Y*12, C + 1))
+        np.add.at(E, (k, ci[t['大項目'].astype(str)].to_numpy()), t['支出'].to_numpy(float))
+        E[:, C] = E[:, :C].sum(axis=1)
+        self.E = E; self.last = int(k.max())  # 最後にデータのある月（それ以降は未来なので指標から外す）
+        self.months = [f"{y}-{m:02d}" for y in self.years for m in range(1, 13)]
+        # 移動平均: 累積和の差。窓がデータの先頭より前にはみ出す月は、ある分だけで割る
+        cs = np.vstack([np.zeros((1, C + 1)), E.cumsum(axis=0)]); i = np.arange(1, Y*12 + 1)
+        self.roll = {w: (cs[i] - cs[np.maximum(i - w, 0)]) / np.minimum(i, w)[:, None] for w in WINDOWS}
+        # (年, 月, カテゴリ) に畳んで、年累計と「前年までの同じ月の平均」（例年）を出す
+        E3 = E.reshape(Y, 12, C + 1)
+        self.cum = E3.cumsum(axis=1).reshape(Y*12, C + 1)
+        prior = np.vstack([np.zeros((1, 12, C + 1)), E3.cumsum(axis=0)[:-1]])
+        self.base = (prior / np.arange(Y)[:, None, None].clip(1)).reshape(Y*12, C + 1)
+        self.base[:12] = np.nan  # 最初の年には比べる過去が無い
+        self.yoy = np.full_like(E, np.nan); self.yoy[12:] = E[12:] - E[:-12]
+
+    @property
+    def empty(self): return self.last is None
+
+    def _col(self, cat): return len(self.cats) if cat in (None, TOTAL) else self.cats.index(cat)
+
+    def series(self, cat=None, start=None):
+        # 1カテゴリ（None なら合計）の月次推移。start（'YYYY-MM'）より前と、最後のデータより後は出さない
+        j = self._col(cat); s = self.months.index(start) if start in self.months else 0; e = self.last + 1
+        d = {'月': self.months[s:e], '支出': self.E[s:e, j]}
+        for w in WINDOWS: d[f'{w}ヶ月平均'] = self.roll[w][s:e, j]
+        d['例年同月'] = self.base[s:e, j]; d['前年差'] = self.yoy[s:e, j]; d['年累計'] = self.cum[s:e, j]
+        return pd.DataFrame(d)
+
+    def year_curves(self, cat=None, years=None):
+        # 年ごとの累計支出（行: 年、列: 1〜12月）。最後のデータより後の月は NaN
+        j = self._col(cat); c = self.cum[:, j].copy(); c[self.last + 1:] = np.nan
+        df = pd.DataFrame(c.reshape(len(self.years), 12), index=self.years, columns=range(1, 13))
+        return df.loc[[y for y in (years or self.years) if y in df.index]]
+
+    def snapshot(self, y, m):
+        # (y, m) 時点の全カテゴリの指標を1表で（行: カテゴリ＋合計）
+        k = (y - self.years[0])*12 + m - 1 if self.years else -1
+        if not (0 <= k <= self.last): return pd.DataFrame()
+        d = {'当月': self.E[k]}
+        for w in WINDOWS: d[f'{w}ヶ月平均'] = self.roll[w][k]
+        d['例年同月'] = self.base[k]; d['前年差'] = self.yoy[k]; d['年累計'] = self.cum[k]
+        df = pd.DataFrame(d, index=self.cats + [TOTAL])
+        return df[(df[['当月', '12ヶ月平均']].to_numpy() > 0).any(axis=1)]